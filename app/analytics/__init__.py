@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""The analytics module, computing spend statistics over receipt data."""
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the vectorized engine against naive iteration over ORM objects."""
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import select
+
+from app.database import db
+from app.receipt.models import UNCATEGORIZED, LineItem, Receipt
+from app.user.models import User
+
+from . import engine
+
+CATEGORIES = ["groceries", "dining", "transport", "utilities", "travel", None]
+
+#: Receipts generated and inserted per transaction while seeding.
+SEED_BATCH_SIZE = 5_000
+
+
+def seed(user_id, line_items, items_per_receipt=4, random_seed=0):
+    """Insert ``line_items`` synthetic line items for ``user_id``."""
+    rng = np.random.default_rng(random_seed)
+    start = np.datetime64("2020-01-01T00:00:00")
+    receipt_count = -(-line_items // items_per_receipt)
+    for first in range(0, receipt_count, SEED_BATCH_SIZE):
+        size = min(SEED_BATCH_SIZE, receipt_count - first)
+        offsets = np.sort(rng.integers(0, 5 * 365 * 86400, size))
+        timestamps = (start + offsets.astype("timedelta64[s]")).tolist()
+        amounts = rng.integers(50, 20_000, (size, items_per_receipt))
+        categories = rng.integers(0, len(CATEGORIES), (size, items_per_receipt))
+        rows = Receipt.bulk_create(
+            [
+                {
+                    "user_id": user_id,
+                    "merchant": f"Merchant {n % 200}",
+                    "purchased_at": timestamp,
+                    "total": int(amounts[n].sum()) / 100,
+                }
+                for n, timestamp in enumerate(timestamps)
+            ],
+            chunk_size=SEED_BATCH_SIZE,
+            commit=False,
+            returning=(Receipt.id,),
+        )
+        LineItem.bulk_create(
+            (
+                {
+                    "receipt_id": row.id,
+                    "description": f"Product {amounts[n, i] % 997}",
+                    "category": CATEGORIES[categories[n, i]],
+                    "amount": int(amounts[n, i]) / 100,
+                }
+                for n, row in enumerate(rows)
+                for i in range(items_per_receipt)
+                if (first + n) * items_per_receipt + i < line_items
+            ),
+            chunk_size=SEED_BATCH_SIZE * items_per_receipt,
+            commit=False,
+        )
+        db.session.commit()
+
+
+def naive_summary(user_id, window=7):
+    """Compute the statistics of :func:`engine.summarize` by iterating ORM objects."""
+    amounts = []
+    daily = defaultdict(int)
+    monthly = defaultdict(int)
+    categories = defaultdict(int)
+    query = (
+        select(LineItem, Receipt)
+        .join(Receipt, LineItem.receipt_id == Receipt.id)
+        .where(Receipt.user_id == user_id)
+        .execution_options(yield_per=10_000)
+    )
+    for item, receipt in db.session.execute(query).tuples():
+        cents = int(round(item.amount * 100))
+        amounts.append(cents)
+        daily[receipt.purchased_at.date()] += cents
+        monthly[receipt.purchased_at.date().replace(day=1)] += cents
+        categories[item.category or UNCATEGORIZED] += cents
+    db.session.expunge_all()
+
+    daily_totals = []
+    day = min(daily, default=None)
+    while day is not None and day <= max(daily):
+        daily_totals.append(daily[day])
+        day += timedelta(days=1)
+    moving_average = []
+    for index in range(len(daily_totals)):
+        first = max(0, index + 1 - window)
+        trailing = daily_totals[first : index + 1]  # noqa: E203
+        moving_average.append(sum(trailing) / len(trailing) / 100)
+    monthly_totals = []
+    month = min(monthly, default=None)
+    while month is not None and month <= max(monthly):
+        monthly_totals.append(monthly[month])
+        month = (month + timedelta(days=31)).replace(day=1)
+    month_over_month = [float("nan")] + [
+        (current - previous) / previous if previous else float("nan")
+        for previous, current in zip(monthly_totals, monthly_totals[1:])
+    ]
+    amounts.sort()
+    return {
+        "total": sum(amounts) / 100,
+        "median": amounts[len(amounts) // 2] / 100 if amounts else 0.0,
+        "moving_average": moving_average,
+        "month_over_month": month_over_month,
+        "categories": sorted(
+            ((name, cents / 100) for name, cents in categories.items()),
+            key=lambda pair: pair[1],
+            reverse=True,
+        ),
+    }
+
+
+def _timed(function, *args):
+    """Return the result of ``function(*args)`` and the seconds it took."""
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def run(line_items, window=7):
+    """Seed a fresh user with ``line_items`` items and time both implementations.
+
+    Runs against the database of the current app, which should be a scratch one.
+    """
+    user = User.create(
+        username=f"bench{time.time_ns()}", email=f"bench{time.time_ns()}@example.com"
+    )
+    _, seed_seconds = _timed(seed, user.id, line_items)
+    frame, load_seconds = _timed(engine.load_spend_frame, user.id)
+    summary, compute_seconds = _timed(engine.summarize, frame, window)
+    naive, naive_seconds = _timed(naive_summary, user.id, window)
+    if round(naive["total"], 2) != round(summary.total, 2):
+        raise AssertionError(f"Totals differ: {naive['total']} != {summary.total}")
+    vectorized_seconds = load_seconds + compute_seconds
+    return {
+        "line_items": len(frame),
+        "seed_seconds": seed_seconds,
+        "load_seconds": load_seconds,
+        "compute_seconds": compute_seconds,
+        "vectorized_seconds": vectorized_seconds,
+        "naive_seconds": naive_seconds,
+        "speedup": naive_seconds / vectorized_seconds if vectorized_seconds else 0.0,
+    }
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""Columnar snapshots of receipt data for offline analytics.
+
+``flask receipts snapshot`` copies receipts and line items into Arrow IPC or
+Parquet files under ``SNAPSHOT_DIR``, one file per user and month of purchase::
+
+    receipts/user_id=7/month=2024-03/part-0.arrow
+    line_items/user_id=7/month=2024-03/part-0.arrow
+
+Merchants, categories and currencies are dictionary encoded. Arrow files are
+written uncompressed, so :func:`open_dataset` memory-maps them, and heavy
+historical reports read them from the page cache instead of the database.
+
+Snapshots are incremental. ``_snapshot.json`` records when the last one
+started, and the next one only rewrites the partitions holding rows whose
+``updated_at`` is later. It rewrites both the partition a row is in now and
+the one the snapshot last saw it in. Deleted rows leave no ``updated_at``
+behind, so they only leave the snapshot when their partition is rewritten
+for another reason, or on a full snapshot.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import groupby
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from flask import current_app
+from pyarrow import fs
+from sqlalchemy import and_, or_, select
+
+from app.database import db, utcnow
+from app.receipt.models import LineItem, Receipt
+from app.utils import chunked
+
+#: Snapshot file formats, as pyarrow dataset formats and file extensions.
+FORMATS = {"arrow": ("ipc", ".arrow"), "parquet": ("parquet", ".parquet")}
+
+#: Rows written before the previous snapshot started that it may have missed,
+#: because their transaction committed after it read.
+OVERLAP = timedelta(minutes=5)
+
+#: Rows fetched from the database cursor at a time.
+YIELD_PER = 10_000
+
+#: Partitions rewritten per query by incremental snapshots.
+PARTITIONS_PER_QUERY = 100
+
+MANIFEST = "_snapshot.json"
+
+_MONEY = pa.decimal128(12, 2)
+_LABEL = pa.dictionary(pa.int32(), pa.string())
+
+#: Columns of each dataset; ``purchased_at`` of line items is their receipt's.
+SCHEMAS = {
+    "receipts": pa.schema(
+        [
+            ("id", pa.int64()),
+            ("external_id", pa.string()),
+            ("merchant", _LABEL),
+            ("merchant_id", pa.int64()),
+            ("purchased_at", pa.timestamp("us")),
+            ("total", _MONEY),
+            ("currency", _LABEL),
+            ("notes", pa.string()),
+            ("updated_at", pa.timestamp("us")),
+        ]
+    ),
+    "line_items": pa.schema(
+        [
+            ("id", pa.int64()),
+            ("receipt_id", pa.int64()),
+            ("purchased_at", pa.timestamp("us")),
+            ("description", pa.string()),
+            ("category", _LABEL),
+            ("quantity", pa.decimal128(10, 3)),
+            ("amount", _MONEY),
+            ("updated_at", pa.timestamp("us")),
+        ]
+    ),
+}
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("user_id", pa.int64()), ("month", pa.string())]), flavor="hive"
+)
+
+
+@dataclass
+class SnapshotStats:
+    """Counters collected while taking a snapshot."""
+
+    full: bool = False
+    partitions: int = 0
+    removed: int = 0
+    receipts: int = 0
+    line_items: int = 0
+    elapsed: float = 0.0
+
+    def summary(self):
+        """Return a one-line human readable summary."""
+        kind = "Full" if self.full else "Incremental"
+        return (
+            f"{kind} snapshot: {self.partitions} partitions written, "
+            f"{self.removed} removed, {self.receipts} receipts, "
+            f"{self.line_items} line items in {self.elapsed:.2f}s"
+        )
+
+
+def _month(timestamp):
+    """Return the partition month of a timestamp."""
+    return f"{timestamp.year:04}-{timestamp.month:02}"
+
+
+def _month_range(month):
+    """Return the half-open datetime range of a partition month."""
+    year, number = map(int, month.split("-"))
+    return datetime(year, number, 1), datetime(year + number // 12, number % 12 + 1, 1)
+
+
+def read_manifest(directory):
+    """Return the manifest of the snapshot in ``directory``, or None."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return None
+
+
+def open_dataset(dataset="line_items", directory=None):
+    """Open a snapshot dataset, with ``user_id`` and ``month`` partition columns.
+
+    Arrow files are memory-mapped rather than read.
+    """
+    directory = directory or current_app.config["SNAPSHOT_DIR"]
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No receipt snapshot in {directory}")
+    schema = SCHEMAS[dataset]
+    for field in PARTITIONING.schema:
+        schema = schema.append(field)
+    return ds.dataset(
+        os.path.join(directory, dataset),
+        schema=schema,
+        format=FORMATS[manifest["format"]][0],
+        partitioning=PARTITIONING,
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def _statement(dataset):
+    """Select the partition key and columns of ``dataset``, in partition order."""
+    receipts, items = Receipt.__table__, LineItem.__table__
+    names = SCHEMAS[dataset].names
+    if dataset == "receipts":
+        columns = [receipts.c[name] for name in names]
+        source = receipts
+        order = (receipts.c.id,)
+    else:
+        columns = [
+            receipts.c.purchased_at if name == "purchased_at" else items.c[name]
+            for name in names
+        ]
+        source = items.join(receipts, items.c.receipt_id == receipts.c.id)
+        order = (receipts.c.id, items.c.id)
+    return (
+        select(receipts.c.user_id, *columns)
+        .select_from(source)
+        .order_by(receipts.c.user_id, receipts.c.purchased_at, *order)
+    )
+
+
+def _partition_clause(user_id, month):
+    """Return the clause selecting the receipts of one partition."""
+    receipts = Receipt.__table__
+    start, end = _month_range(month)
+    return and_(
+        receipts.c.user_id == user_id,
+        receipts.c.purchased_at >= start,
+        receipts.c.purchased_at < end,
+    )
+
+
+def _path(directory, fmt, dataset, user_id, month):
+    """Return the file of a partition."""
+    return os.path.join(
+        directory,
+        dataset,
+        f"user_id={user_id}",
+        f"month={month}",
+        "part-0" + FORMATS[fmt][1],
+    )
+
+
+def _write_partition(path, fmt, dataset, rows):
+    """Write the rows of one partition, replacing the file atomically."""
+    schema = SCHEMAS[dataset]
+    columns = zip(*rows)
+    table = pa.table(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema,
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Dataset discovery skips dot files, so readers never see a partial file.
+    partial = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+    if fmt == "arrow":
+        with pa.OSFile(partial, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, partial)
+    os.replace(partial, path)
+
+
+def _write(directory, fmt, dataset, statement):
+    """Write the rows selected by ``statement`` into their partitions.
+
+    :returns: The ``(user_id, month)`` partitions and the number of rows written.
+    """
+    rows = db.session.connection().execute(
+        statement.execution_options(yield_per=YIELD_PER)
+    )
+    written, count = set(), 0
+    for (user_id, month), group in groupby(
+        rows, key=lambda row: (row[0], _month(row.purchased_at))
+    ):
+        group = [row[1:] for row in group]
+        _write_partition(
+            _path(directory, fmt, dataset, user_id, month), fmt, dataset, group
+        )
+        written.add((user_id, month))
+        count += len(group)
+    return written, count
+
+
+def _snapshot_partitions(directory, dataset, ids):
+    """Return the partitions of the snapshot holding rows with the given ids."""
+    if not ids:
+        return set()
+    table = open_dataset(dataset, directory).to_table(
+        columns=["user_id", "month"], filter=pc.field("id").isin(sorted(ids))
+    )
+    return set(zip(table["user_id"].to_pylist(), table["month"].to_pylist()))
+
+
+def stale_partitions(directory, since):
+    """Return the partitions holding rows updated since ``since``, now or before."""
+    receipts, items = Receipt.__table__, LineItem.__table__
+    stale, receipt_ids, item_ids = set(), set(), set()
+    for ids, statement in (
+        (
+            receipt_ids,
+            select(receipts.c.id, receipts.c.user_id, receipts.c.purchased_at).where(
+                receipts.c.updated_at >= since
+            ),
+        ),
+        (
+            item_ids,
+            select(items.c.id, receipts.c.user_id, receipts.c.purchased_at)
+            .join(receipts, items.c.receipt_id == receipts.c.id)
+            .where(items.c.updated_at >= since),
+        ),
+    ):
+        for row_id, user_id, purchased_at in db.session.connection().execute(statement):
+            ids.add(row_id)
+            stale.add((user_id, _month(purchased_at)))
+    stale |= _snapshot_partitions(directory, "receipts", receipt_ids)
+    stale |= _snapshot_partitions(directory, "line_items", item_ids)
+    return stale
+
+
+def _full(directory, fmt, stats):
+    """Write every partition into a fresh directory and swap it in."""
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=directory)
+    try:
+        partitions = set()
+        for dataset in SCHEMAS:
+            written, count = _write(staging, fmt, dataset, _statement(dataset))
+            partitions |= written
+            setattr(stats, dataset, count)
+            os.makedirs(os.path.join(staging, dataset), exist_ok=True)
+        for dataset in SCHEMAS:
+            current = os.path.join(directory, dataset)
+            if os.path.exists(current):
+                os.rename(current, os.path.join(staging, f".{dataset}"))
+            os.rename(os.path.join(staging, dataset), current)
+    finally:
+        shutil.rmtree(staging)
+    stats.partitions = len(partitions)
+
+
+def _remove_partition(path):
+    """Remove the file of a partition and its emptied directories, if it exists."""
+    if not os.path.exists(path):
+        return False
+    os.remove(path)
+    month = os.path.dirname(path)
+    for directory in (month, os.path.dirname(month)):
+        try:
+            os.rmdir(directory)
+        except OSError:  # Not empty
+            break
+    return True
+
+
+def _incremental(directory, fmt, since, stats):
+    """Rewrite the partitions changed since ``since``, removing emptied ones."""
+    written, removed = set(), set()
+    for chunk in chunked(
+        sorted(stale_partitions(directory, since)), PARTITIONS_PER_QUERY
+    ):
+        clause = or_(*(_partition_clause(user_id, month) for user_id, month in chunk))
+        for dataset in SCHEMAS:
+            partitions, count = _write(
+                directory, fmt, dataset, _statement(dataset).where(clause)
+            )
+            written |= partitions
+            setattr(stats, dataset, getattr(stats, dataset) + count)
+            for user_id, month in set(chunk) - partitions:
+                if _remove_partition(_path(directory, fmt, dataset, user_id, month)):
+                    removed.add((user_id, month))
+    stats.partitions = len(written)
+    stats.removed = len(removed - written)
+
+
+def snapshot(directory=None, fmt="arrow", full=False):
+    """Bring the snapshot in ``directory`` up to date with the database.
+
+    A full snapshot is taken the first time, when ``fmt`` changes or if
+    ``full`` is set; otherwise only the changed partitions are rewritten.
+
+    :returns: A :class:`SnapshotStats`.
+    """
+    directory = directory or current_app.config["SNAPSHOT_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    started_at = db.session.scalar(select(utcnow()))
+    manifest = read_manifest(directory)
+    full = full or manifest is None or manifest["format"] != fmt
+    stats = SnapshotStats(full=full)
+    if full:
+        _full(directory, fmt, stats)
+    else:
+        since = datetime.fromisoformat(manifest["started_at"]) - OVERLAP
+        _incremental(directory, fmt, since, stats)
+    partial = os.path.join(directory, "." + MANIFEST)
+    with open(partial, "w") as stream:
+        json.dump({"format": fmt, "started_at": started_at.isoformat()}, stream)
+    os.replace(partial, os.path.join(directory, MANIFEST))
+    stats.elapsed = time.perf_counter() - started
+    return stats
@@ -1,30 +1,31 @@
 # -*- coding: utf-8 -*-
 """The app module, containing the app factory function."""
-import logging
-import sys
-
+import click
 from flask import Flask, render_template
 
-from app import commands, public, user
+from app import commands, jobs, logs, public, receipt, search, user
 from app.extensions import (
     bcrypt,
     cache,
     csrf_protect,
     db,
-    debug_toolbar,
     flask_static_digest,
     login_manager,
-    migrate,
+    pool_monitor,
+    query_profiler,
 )
 
 
-def create_app(config_object="app.settings"):
+def create_app(config_object="app.settings", config=None):
     """Create application factory, as explained here: http://flask.pocoo.org/docs/patterns/appfactories/.
 
     :param config_object: The configuration object to use.
+    :param config: Optional mapping of settings overriding ``config_object``.
     """
     app = Flask(__name__.split(".")[0])
     app.config.from_object(config_object)
+    app.config.update(config or {})
+    app.config.setdefault("CONFIG_OBJECT", config_object)
     register_extensions(app)
     register_blueprints(app)
     register_errorhandlers(app)
@@ -38,19 +39,33 @@ def register_extensions(app):
     """Register Flask extensions."""
     bcrypt.init_app(app)
     cache.init_app(app)
+    pool_monitor.init_app(app)
     db.init_app(app)
     csrf_protect.init_app(app)
     login_manager.init_app(app)
-    debug_toolbar.init_app(app)
-    migrate.init_app(app, db)
     flask_static_digest.init_app(app)
+    query_profiler.init_app(app)
+    if app.config.get("DEBUG_TB_ENABLED"):
+        from flask_debugtoolbar import DebugToolbarExtension
+
+        DebugToolbarExtension(app)
+    if _loaded_by_cli():
+        from flask_migrate import Migrate
+
+        Migrate(app, db)
     return None
 
 
+def _loaded_by_cli():
+    """Whether the app is created for a ``flask`` command rather than to serve requests."""
+    return click.get_current_context(silent=True) is not None
+
+
 def register_blueprints(app):
     """Register Flask blueprints."""
     app.register_blueprint(public.views.blueprint)
     app.register_blueprint(user.views.blueprint)
+    app.register_blueprint(search.views.blueprint)
     return None
 
 
@@ -73,7 +88,12 @@ def register_shellcontext(app):
 
     def shell_context():
         """Shell context objects."""
-        return {"db": db, "User": user.models.User}
+        return {
+            "db": db,
+            "User": user.models.User,
+            "Receipt": receipt.models.Receipt,
+            "Job": jobs.models.Job,
+        }
 
     app.shell_context_processor(shell_context)
 
@@ -82,10 +102,26 @@ def register_commands(app):
     """Register Click commands."""
     app.cli.add_command(commands.test)
     app.cli.add_command(commands.lint)
+    app.cli.add_command(commands.receipts)
+    app.cli.add_command(commands.rollups)
+    app.cli.add_command(commands.search)
+    app.cli.add_command(commands.merchants)
+    app.cli.add_command(commands.analytics)
+    app.cli.add_command(commands.worker)
+    app.cli.add_command(commands.jobs)
+    app.cli.add_command(commands.passwords)
+    app.cli.add_command(commands.bench)
+    app.cli.add_command(commands.startup)
 
 
 def configure_logger(app):
-    """Configure loggers."""
-    handler = logging.StreamHandler(sys.stdout)
+    """Configure loggers.
+
+    Records are written by a background thread, see :mod:`app.logs`.
+    """
+    app.before_request(logs.start_request)
+    app.after_request(logs.finish_request)
+    if app.config.get("LOG_LEVEL"):
+        app.logger.setLevel(app.config["LOG_LEVEL"])
     if not app.logger.handlers:
-        app.logger.addHandler(handler)
+        app.logger.addHandler(logs.create_handler(app.config))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the app's hot paths with JSON baselines.
+
+:func:`seed` fills a scratch database with synthetic users, receipts and line
+items, then :func:`run` times the hot paths -- logging in, registering, the
+profile page, ``CRUDMixin.create`` and the analytics queries -- through the
+test client. Results are written as JSON, and :func:`compare` diffs a run
+against a stored baseline.
+"""
+import json
+import platform
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+from app.analytics import benchmark as analytics_benchmark
+from app.analytics import engine
+from app.database import db
+from app.extensions import bcrypt
+from app.receipt import rollups
+from app.receipt.models import Receipt
+from app.user.models import User
+
+#: Password of every seeded user.
+PASSWORD = "benchmark"
+
+#: Users inserted per transaction while seeding.
+USER_BATCH_SIZE = 5_000
+
+
+#: Report fields that must match for two runs to be comparable.
+COMPARABLE = ("database", "users", "line_items")
+
+
+class IncomparableRuns(ValueError):
+    """Raised when a baseline was recorded on another database or data set."""
+
+
+def seed(users, line_items):
+    """Insert ``users`` users sharing ``line_items`` line items between them.
+
+    Receipts and line items come from the vectorized analytics seeder, which
+    scales to millions of rows. Returns the ids of the seeded users.
+    """
+    # Continue the usernames past earlier runs on the same database.
+    offset = db.session.scalar(select(func.max(User.id))) or 0
+    pw_hash = bcrypt.generate_password_hash(PASSWORD)
+    user_ids = []
+    for first in range(0, users, USER_BATCH_SIZE):
+        records = [
+            {
+                "username": f"bench{offset + n}",
+                "email": f"bench{offset + n}@example.com",
+                "active": True,
+                "_password": pw_hash,
+            }
+            for n in range(first, min(first + USER_BATCH_SIZE, users))
+        ]
+        rows = User.bulk_create(records, commit=False, returning=(User.id,))
+        db.session.commit()
+        user_ids.extend(row.id for row in rows)
+    per_user, extra = divmod(line_items, len(user_ids))
+    for n, user_id in enumerate(user_ids):
+        count = per_user + (1 if n < extra else 0)
+        if count:
+            analytics_benchmark.seed(user_id, count, random_seed=n)
+    return user_ids
+
+
+def measure(function, repeat):
+    """Call ``function`` ``repeat`` times and summarize the durations in milliseconds."""
+    durations = []
+    for n in range(repeat):
+        started = time.perf_counter()
+        function(n)
+        durations.append((time.perf_counter() - started) * 1000)
+    durations.sort()
+    return {
+        "runs": repeat,
+        "median_ms": statistics.median(durations),
+        "p95_ms": durations[min(repeat - 1, int(repeat * 0.95))],
+        "min_ms": durations[0],
+    }
+
+
+def _expect(response, status):
+    """Fail the benchmark when a request did not do what it should have."""
+    if response.status_code != status:
+        raise AssertionError(
+            f"{response.request.path} returned {response.status_code}, not {status}"
+        )
+
+
+def run(app, user_ids, repeat=20):
+    """Time the hot paths against the seeded database of ``app``."""
+    with app.app_context():
+        username = db.session.get(User, user_ids[0]).username
+        start = datetime(2020, 1, 1)
+        end = start + timedelta(days=5 * 365)
+    client = app.test_client()
+    credentials = {"username": username, "password": PASSWORD}
+    prefix = f"bench{time.time_ns() % 10**12}"
+
+    def login(n):
+        _expect(client.post("/", data=credentials), 302)
+
+    def register(n):
+        data = {
+            "username": f"{prefix}{n}",
+            "email": f"{prefix}{n}@example.com",
+            "password": PASSWORD,
+            "confirm": PASSWORD,
+        }
+        _expect(client.post("/register/", data=data), 302)
+
+    def profile(n):
+        _expect(client.get("/users/profile"), 200)
+
+    def create(n):
+        with app.app_context():
+            Receipt.create(
+                user_id=user_ids[0],
+                merchant="Benchmark",
+                purchased_at=start + timedelta(minutes=n),
+                total=1,
+            )
+
+    def analytics(n):
+        with app.app_context():
+            engine.summarize(engine.load_spend_frame(user_ids[n % len(user_ids)]))
+
+    def rollup_totals(n):
+        with app.app_context():
+            user_id = user_ids[n % len(user_ids)]
+            rollups.daily_totals(user_id, start, end)
+            rollups.category_totals(user_id, start, end)
+            rollups.merchant_totals(user_id, start, end)
+
+    results = {"login": measure(login, repeat)}
+    results["register"] = measure(register, repeat)
+    login(0)
+    results["profile"] = measure(profile, repeat)
+    results["crud_create"] = measure(create, repeat)
+    results["analytics_summary"] = measure(analytics, repeat)
+    results["rollup_totals"] = measure(rollup_totals, repeat)
+    return results
+
+
+def report(app, users, line_items, results):
+    """Wrap results with the facts needed to compare runs."""
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "database": dialect,
+        "users": users,
+        "line_items": line_items,
+        "python": platform.python_version(),
+        "bcrypt_log_rounds": app.config.get("BCRYPT_LOG_ROUNDS"),
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.2):
+    """Return ``(name, baseline_ms, current_ms)`` of benchmarks slower by ``threshold``.
+
+    Medians are compared; benchmarks missing from either run are skipped.
+
+    :raises IncomparableRuns: If the runs differ in a :data:`COMPARABLE` field.
+    """
+    differences = [
+        f"{field} {baseline[field]!r} != {current[field]!r}"
+        for field in COMPARABLE
+        if field in baseline and field in current and baseline[field] != current[field]
+    ]
+    if differences:
+        raise IncomparableRuns(f"Baseline not comparable: {', '.join(differences)}")
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        if result["median_ms"] > before["median_ms"] * (1 + threshold):
+            regressions.append((name, before["median_ms"], result["median_ms"]))
+    return regressions
+
+
+def load(path):
+    """Load a stored benchmark report."""
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def save(path, report):
+    """Store a benchmark report."""
+    with open(path, "w") as stream:
+        json.dump(report, stream, indent=2, sort_keys=True)
+        stream.write("\n")
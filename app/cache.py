@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Two-tier cache backend.
+
+Every gunicorn worker keeps a small in-process LRU (L1) in front of a cache
+shared by all workers (L2), such as :class:`~flask_caching.backends.FileSystemCache`
+or :class:`~flask_caching.backends.MemcachedCache`. Reads are served from L1
+when possible, and misses fall through to L2 and fill L1.
+
+Writes go to L2 and are broadcast through an invalidation log kept in L2
+itself: a sequence counter plus one entry per invalidated key. The counter is
+incremented atomically -- memcached ``incr``, Redis ``INCR``, a file lock for
+:class:`~flask_caching.backends.FileSystemCache` -- so concurrent writers never
+claim the same entry. Each worker replays the entries it has not seen yet, at
+most once per ``CACHE_SYNC_INTERVAL`` seconds, and drops those keys from its
+L1. When the log has a gap (expired entries, a cleared L2) or more entries
+than L1 holds, the whole L1 is dropped instead. ``CACHE_L1_TIMEOUT`` bounds
+how stale an L1 entry can get when everything else fails.
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask_caching.backends import FileSystemCache, MemcachedCache, RedisCache
+from flask_caching.backends.base import BaseCache
+from werkzeug.utils import import_string
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+#: Keys of the invalidation log in L2.
+SEQUENCE_KEY = "tiered-cache:sequence"
+LOG_KEY = "tiered-cache:log:{}"
+
+#: Marker logged by :meth:`TieredCache.clear`.
+CLEAR_ALL = "*"
+
+#: Lock file guarding the sequence counter of a FileSystemCache.
+LOCK_FILE = "tiered-cache.lock"
+
+#: Serializes sequence increments of the caches of this process.
+_sequence_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    """In-process LRU cache in front of a cache shared between processes.
+
+    :param l2: The shared cache.
+    :param l1_size: Entries kept in the process, least recently used evicted first.
+    :param l1_timeout: Seconds an entry lives in the process at most.
+    :param sync_interval: Seconds between reads of the invalidation log.
+    :param log_timeout: Seconds invalidation log entries are kept in L2.
+    """
+
+    def __init__(
+        self,
+        l2,
+        l1_size=1024,
+        l1_timeout=30,
+        sync_interval=1.0,
+        log_timeout=300,
+        default_timeout=300,
+        **kwargs,
+    ):
+        """Create instance."""
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.l2 = l2
+        self.l1_size = l1_size
+        self.l1_timeout = l1_timeout
+        self.sync_interval = sync_interval
+        self.log_timeout = log_timeout
+        self._l1 = OrderedDict()
+        self._lock = threading.RLock()
+        self._sequence = self.l2.get(SEQUENCE_KEY) or 0
+        self._published = set()
+        self._synced_at = time.monotonic()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        """Create the cache from the ``CACHE_*`` settings of an app."""
+        l2_type = config["CACHE_L2_TYPE"]
+        if "." not in l2_type:
+            l2_type = "flask_caching.backends." + l2_type
+        l2_factory = import_string(l2_type)
+        l2 = l2_factory.factory(app, config, list(args), dict(kwargs))
+        kwargs.update(
+            l1_size=config.get("CACHE_L1_SIZE", 1024),
+            l1_timeout=config.get("CACHE_L1_TIMEOUT", 30),
+            sync_interval=config.get("CACHE_SYNC_INTERVAL", 1.0),
+        )
+        return cls(l2, *args, **kwargs)
+
+    def _l1_get(self, key):
+        """Return the pickled L1 entry of ``key``, or None."""
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            return value
+
+    def _l1_set(self, key, value, timeout):
+        """Store a value in L1, evicting the least recently used entries."""
+        timeout = self._normalize_timeout(timeout)
+        lifetime = min(timeout, self.l1_timeout) if timeout else self.l1_timeout
+        with self._lock:
+            self._l1[key] = (
+                time.monotonic() + lifetime,
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            )
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, *keys):
+        """Drop keys from L1."""
+        with self._lock:
+            for key in keys:
+                self._l1.pop(key, None)
+
+    @contextmanager
+    def _locked_sequence(self):
+        """Hold the sequence counter for a read-modify-write.
+
+        The thread lock covers this process; workers sharing a cache directory
+        also take an exclusive lock on a file in it.
+        """
+        with _sequence_lock:
+            if fcntl is None or not isinstance(self.l2, FileSystemCache):
+                yield
+                return
+            with open(os.path.join(self.l2._path, LOCK_FILE), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _next_sequence(self):
+        """Atomically increment the sequence counter in L2 and return it."""
+        if isinstance(self.l2, RedisCache):
+            return self.l2.inc(SEQUENCE_KEY)
+        if isinstance(self.l2, MemcachedCache):
+            # MemcachedCache.inc is a get and a set; the raw client increments.
+            key = self.l2._normalize_key(SEQUENCE_KEY)
+            with self.l2._client_context() as client:
+                sequence = client.incr(key, 1)
+                if sequence is None and client.add(key, 1, 0):
+                    return 1
+                return int(sequence or client.incr(key, 1))
+        with self._locked_sequence():
+            sequence = (self.l2.get(SEQUENCE_KEY) or 0) + 1
+            self.l2.set(SEQUENCE_KEY, sequence, timeout=0)
+            return sequence
+
+    def _publish(self, *keys):
+        """Append invalidated keys to the log so other processes drop them."""
+        for key in keys:
+            sequence = self._next_sequence()
+            self.l2.set(LOG_KEY.format(sequence), key, timeout=self.log_timeout)
+            self._published.add(sequence)
+
+    def sync(self, force=False):
+        """Drop the keys other processes invalidated since the last sync."""
+        now = time.monotonic()
+        if not force and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        sequence = self.l2.get(SEQUENCE_KEY) or 0
+        if sequence == self._sequence:
+            return
+        if sequence < self._sequence or sequence - self._sequence > self.l1_size:
+            keys = [None]
+        else:
+            # Entries this process published itself are already applied.
+            numbers = [
+                n
+                for n in range(self._sequence + 1, sequence + 1)
+                if n not in self._published
+            ]
+            keys = self.l2.get_many(*(LOG_KEY.format(n) for n in numbers))
+        self._sequence = sequence
+        self._published.clear()
+        if None in keys or CLEAR_ALL in keys:
+            with self._lock:
+                self._l1.clear()
+        else:
+            self._l1_delete(*keys)
+
+    def get(self, key):
+        """Return a cached value, from L1 if possible."""
+        self.sync()
+        value = self._l1_get(key)
+        if value is not None:
+            return pickle.loads(value)
+        value = self.l2.get(key)
+        if value is not None:
+            self._l1_set(key, value, self.default_timeout)
+        return value
+
+    def has(self, key):
+        """Return whether ``key`` is cached."""
+        self.sync()
+        return self._l1_get(key) is not None or self.l2.has(key)
+
+    def set(self, key, value, timeout=None):
+        """Cache a value in both tiers and invalidate it in other processes."""
+        result = self.l2.set(key, value, timeout)
+        self._publish(key)
+        if result:
+            self._l1_set(key, value, timeout)
+        return result
+
+    def add(self, key, value, timeout=None):
+        """Cache a value unless ``key`` is already cached."""
+        result = self.l2.add(key, value, timeout)
+        if result:
+            self._publish(key)
+            self._l1_set(key, value, timeout)
+        return result
+
+    def delete(self, key):
+        """Remove ``key`` from both tiers and from other processes."""
+        self._l1_delete(key)
+        result = self.l2.delete(key)
+        self._publish(key)
+        return result
+
+    def delete_many(self, *keys):
+        """Remove several keys from both tiers and from other processes."""
+        self._l1_delete(*keys)
+        deleted = self.l2.delete_many(*keys)
+        self._publish(*keys)
+        return deleted
+
+    def inc(self, key, delta=1):
+        """Increment a counter in L2, which is the only tier holding counters."""
+        self._l1_delete(key)
+        result = self.l2.inc(key, delta)
+        self._publish(key)
+        return result
+
+    def dec(self, key, delta=1):
+        """Decrement a counter in L2."""
+        return self.inc(key, -delta)
+
+    def clear(self):
+        """Empty both tiers in every process."""
+        with self._lock:
+            self._l1.clear()
+        # Keep the sequence going, so other processes notice the clear.
+        sequence = self.l2.get(SEQUENCE_KEY) or 0
+        result = self.l2.clear()
+        self.l2.set(SEQUENCE_KEY, sequence, timeout=0)
+        self._publish(CLEAR_ALL)
+        return result
@@ -5,6 +5,7 @@ from glob import glob
 from subprocess import call
 
 import click
+from flask.cli import AppGroup
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.join(HERE, os.pardir)
@@ -73,3 +74,528 @@ def lint(fix_imports, check):
         execute_tool("Fixing import order", "isort", *isort_args)
     execute_tool("Formatting style", "black", *black_args)
     execute_tool("Checking code style", "flake8")
+
+
+def _get_user(username):
+    """Return the user called ``username`` or fail with a usage error."""
+    from app.user.models import User
+
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f"Unknown user {username!r}", param_hint="--user")
+    return user
+
+
+receipts = AppGroup("receipts", help="Manage receipt data.")
+
+
+@receipts.command("import")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "-u", "--user", "username", required=True, help="Owner of the imported receipts"
+)
+@click.option(
+    "-f",
+    "--format",
+    "fmt",
+    type=click.Choice(["csv", "jsonl", "ndjson"]),
+    default=None,
+    help="Input format, detected from the file extension by default",
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    default=500,
+    show_default=True,
+    help="Number of receipts inserted per transaction",
+)
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    show_default=True,
+    help="Number of processes importing files in parallel",
+)
+def import_receipts(paths, username, fmt, batch_size, workers):
+    """Stream receipts from CSV or JSONL export files or directories into the database."""
+    import time
+
+    from app.receipt.importer import ImportStats, find_files, import_files
+
+    user = _get_user(username)
+    started = time.perf_counter()
+    results = []
+    for stats in import_files(
+        list(find_files(paths)), user.id, fmt, batch_size, workers
+    ):
+        click.echo(stats.summary())
+        results.append(stats)
+    if len(results) > 1:
+        total = ImportStats.combine(results, time.perf_counter() - started)
+        click.echo(f"Total: {total.summary()}")
+    if any(stats.error for stats in results):
+        exit(1)
+
+
+@receipts.command("export")
+@click.option(
+    "-u", "--user", "username", required=True, help="Owner of the exported receipts"
+)
+@click.option(
+    "-d",
+    "--dataset",
+    type=click.Choice(["receipts", "categories", "merchants"]),
+    default="receipts",
+    show_default=True,
+    help="Receipts with their line items, or the daily category or merchant spend",
+)
+@click.option(
+    "-f",
+    "--format",
+    "fmt",
+    type=click.Choice(["csv", "ndjson"]),
+    default=None,
+    help="Output format, detected from the output file extension by default",
+)
+@click.option(
+    "--start",
+    type=click.DateTime(["%Y-%m-%d"]),
+    default=None,
+    help="First day to export",
+)
+@click.option(
+    "--end",
+    type=click.DateTime(["%Y-%m-%d"]),
+    default=None,
+    help="Day to export up to, excluded",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+    default="-",
+    help="Output file, gzipped if it ends in .gz; standard output by default",
+)
+def export_receipts(username, dataset, fmt, start, end, output):
+    """Stream a user's receipts or daily spend to CSV or NDJSON."""
+    from app.receipt.exporter import export
+
+    user = _get_user(username)
+    gzip = output.endswith(".gz")
+    if fmt is None:
+        extension = os.path.splitext(output[:-3] if gzip else output)[1].lstrip(".")
+        fmt = "ndjson" if extension in ("ndjson", "jsonl") else "csv"
+    chunks = export(
+        user.id,
+        dataset,
+        fmt,
+        start.date() if start else None,
+        end.date() if end else None,
+        gzip,
+    )
+    with click.open_file(output, "wb") as stream:
+        for chunk in chunks:
+            stream.write(chunk)
+
+
+@receipts.command("snapshot")
+@click.option(
+    "-o",
+    "--output",
+    "directory",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Snapshot directory, SNAPSHOT_DIR by default",
+)
+@click.option(
+    "-f",
+    "--format",
+    "fmt",
+    type=click.Choice(["arrow", "parquet"]),
+    default="arrow",
+    show_default=True,
+    help="Columnar file format; Arrow files can be memory-mapped",
+)
+@click.option(
+    "--full", is_flag=True, help="Rewrite every partition, dropping deleted rows"
+)
+def snapshot_receipts(directory, fmt, full):
+    """Copy receipts and line items changed since the last run into columnar files."""
+    from app.analytics.snapshot import snapshot
+
+    click.echo(snapshot(directory, fmt, full).summary())
+
+
+rollups = AppGroup("rollups", help="Manage the daily spend rollups.")
+
+
+@rollups.command("rebuild")
+@click.option(
+    "-u", "--user", "username", default=None, help="Only rebuild this user's rollups"
+)
+@click.option(
+    "--background", is_flag=True, help="Queue the rebuild for 'flask worker' instead"
+)
+def rebuild_rollups(username, background):
+    """Recompute the daily spend rollups from the raw receipts."""
+    from app.jobs.queue import enqueue
+    from app.receipt.rollups import rebuild
+
+    user_id = _get_user(username).id if username else None
+    if background:
+        enqueue("rollups.rebuild", {"user_id": user_id})
+        click.echo(f"Queued a rollup rebuild for {username or 'all users'}")
+        return
+    rebuild(user_id)
+    click.echo(f"Rebuilt rollups for {username or 'all users'}")
+
+
+search = AppGroup("search", help="Manage the receipt search index.")
+
+
+@search.command("rebuild")
+def rebuild_search():
+    """Reindex every receipt for full-text search."""
+    from app.receipt.search import rebuild
+
+    rebuild()
+    click.echo("Rebuilt the receipt search index")
+
+
+merchants = AppGroup("merchants", help="Manage the merchant dictionary.")
+
+
+@merchants.command("add")
+@click.argument("name")
+@click.option(
+    "-a", "--alias", "aliases", multiple=True, help="Another spelling of the name"
+)
+def add_merchant(name, aliases):
+    """Add a canonical merchant, or aliases to an existing one."""
+    from app.database import db
+    from app.receipt.models import Merchant, MerchantAlias
+
+    merchant = Merchant.query.filter_by(name=name).one_or_none() or Merchant(name=name)
+    db.session.add_all(
+        [
+            merchant,
+            *(MerchantAlias(merchant=merchant, alias=alias) for alias in aliases),
+        ]
+    )
+    db.session.commit()
+    click.echo(f"{name}: {len(aliases)} aliases added")
+
+
+@merchants.command("resolve")
+@click.argument("names", nargs=-1, required=True)
+def resolve_merchants(names):
+    """Show what raw merchant strings resolve to."""
+    from app.receipt.merchants import get_index
+
+    for raw, resolved in get_index().resolve_many(names).items():
+        click.echo(f"{raw} -> {resolved[1] if resolved else '(unresolved)'}")
+
+
+@merchants.command("apply")
+def apply_merchants():
+    """Resolve the merchants of stored receipts again."""
+    from app.receipt.merchants import apply
+
+    click.echo(f"Updated {apply():,} receipts")
+
+
+analytics = AppGroup("analytics", help="Spend analytics tools.")
+
+
+@analytics.command("benchmark")
+@click.option(
+    "-n",
+    "--line-items",
+    default=1_000_000,
+    show_default=True,
+    help="Number of synthetic line items to analyze",
+)
+@click.option(
+    "--database-url",
+    default="sqlite://",
+    show_default=True,
+    help="Scratch database seeded with the synthetic data",
+)
+def benchmark_analytics(line_items, database_url):
+    """Compare the vectorized analytics engine with naive ORM iteration."""
+    from flask import current_app
+
+    from app.analytics.benchmark import run
+    from app.app import create_app
+    from app.database import db
+
+    scratch = create_app(
+        current_app.config["CONFIG_OBJECT"],
+        {"SQLALCHEMY_DATABASE_URI": database_url},
+    )
+    with scratch.app_context():
+        db.create_all()
+        results = run(line_items)
+    for name, value in results.items():
+        click.echo(f"{name:>20}: {value:,.3f}")
+
+
+@analytics.command("report")
+@click.option("-u", "--user", "username", required=True, help="User to report on")
+@click.option(
+    "--start", type=click.DateTime(["%Y-%m-%d"]), default=None, help="First day"
+)
+@click.option(
+    "--end", type=click.DateTime(["%Y-%m-%d"]), default=None, help="Day up to, excluded"
+)
+@click.option(
+    "--snapshot/--database",
+    default=True,
+    show_default=True,
+    help="Read the receipt snapshot or the live database",
+)
+def report_analytics(username, start, end, snapshot):
+    """Print a user's spend statistics."""
+    from app.analytics.engine import load_snapshot_frame, load_spend_frame, summarize
+
+    user = _get_user(username)
+    load = load_snapshot_frame if snapshot else load_spend_frame
+    try:
+        summary = summarize(load(user.id, start, end))
+    except FileNotFoundError as error:
+        raise click.ClickException(f"{error}; run 'flask receipts snapshot' first")
+    click.echo(f"Total: {summary.total:,.2f} over {summary.item_count:,} line items")
+    for month, total in zip(summary.months, summary.monthly_totals):
+        click.echo(f"{month:%Y-%m}: {total:,.2f}")
+    for category, total in summary.categories:
+        click.echo(f"{category}: {total:,.2f}")
+
+
+@click.command()
+@click.option(
+    "-b",
+    "--batch-size",
+    default=20,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Number of jobs claimed at a time",
+)
+@click.option(
+    "-i",
+    "--poll-interval",
+    default=1.0,
+    type=click.FloatRange(min=0),
+    show_default=True,
+    help="Seconds to wait when no job is due",
+)
+@click.option("--burst", is_flag=True, help="Exit once no job is due")
+def worker(batch_size, poll_interval, burst):
+    """Run background jobs, such as the import of uploaded receipts."""
+    import signal
+
+    from flask import current_app
+
+    from app.jobs.queue import DEFAULT_TIMEOUT, Worker
+
+    runner = Worker(
+        batch_size,
+        poll_interval,
+        current_app.config.get("JOB_TIMEOUT", DEFAULT_TIMEOUT),
+    )
+    handlers = {
+        signum: signal.signal(signum, runner.stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    click.echo(f"Worker {runner.id} started")
+    try:
+        runner.run(burst)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    click.echo(f"Worker {runner.id} stopped")
+
+
+jobs = AppGroup("jobs", help="Inspect the background job queue.")
+
+
+@jobs.command("stats")
+def job_stats():
+    """Show the number of jobs and their mean timings by task and state."""
+    from app.jobs.queue import stats
+
+    click.echo(f"{'task':<20} {'state':<8} {'jobs':>8} {'wait ms':>10} {'run ms':>10}")
+    for row in stats():
+        wait_ms, run_ms = (
+            "-" if value is None else f"{value:,.1f}"
+            for value in (row.wait_ms, row.run_ms)
+        )
+        click.echo(
+            f"{row.name:<20} {row.state:<8} {row.count:>8,} {wait_ms:>10} {run_ms:>10}"
+        )
+
+
+@jobs.command("purge")
+@click.option(
+    "-d",
+    "--days",
+    default=7,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="Keep the jobs done within this many days",
+)
+def purge_jobs(days):
+    """Delete the jobs done long ago."""
+    from app.jobs.queue import purge
+
+    click.echo(f"Deleted {purge(days):,} jobs")
+
+
+passwords = AppGroup("passwords", help="Password hashing tools.")
+
+
+@passwords.command("calibrate")
+@click.option(
+    "-t",
+    "--target-ms",
+    default=250,
+    show_default=True,
+    help="Hashing time per login to aim for, in milliseconds",
+)
+@click.option(
+    "--max-rounds",
+    default=16,
+    show_default=True,
+    help="Highest bcrypt cost to try",
+)
+def calibrate_passwords(target_ms, max_rounds):
+    """Time bcrypt on this host and suggest BCRYPT_LOG_ROUNDS."""
+    from flask import current_app
+
+    from app.passwords import calibrate
+
+    rounds, timings = calibrate(target_ms / 1000, max_rounds=max_rounds)
+    for cost, seconds in timings:
+        click.echo(f"{cost:>3} rounds: {seconds * 1000:,.1f} ms")
+    current = current_app.config.get("BCRYPT_LOG_ROUNDS")
+    click.echo(f"Suggested: BCRYPT_LOG_ROUNDS={rounds} (currently {current})")
+    click.echo("Existing hashes are upgraded to the new cost as users log in.")
+
+
+@click.command()
+@click.option(
+    "-u",
+    "--users",
+    default=100,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Number of users to seed",
+)
+@click.option(
+    "-n",
+    "--rows",
+    default=10_000,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="Number of line items to seed, spread over the users",
+)
+@click.option(
+    "-r",
+    "--repeat",
+    default=20,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Runs of each benchmark",
+)
+@click.option(
+    "--database-url",
+    default="sqlite://",
+    show_default=True,
+    help="Scratch database seeded with the synthetic data",
+)
+@click.option(
+    "-o", "--output", type=click.Path(dir_okay=False), help="Write the results here"
+)
+@click.option(
+    "-b",
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Compare against the results stored in this file",
+)
+@click.option(
+    "-t",
+    "--threshold",
+    default=0.2,
+    show_default=True,
+    help="Relative slowdown of a median counted as a regression",
+)
+def bench(users, rows, repeat, database_url, output, baseline, threshold):
+    """Time the app's hot paths on synthetic data."""
+    from flask import current_app
+
+    from app import bench as benchmarks
+    from app.app import create_app
+    from app.database import db
+
+    scratch = create_app(
+        current_app.config["CONFIG_OBJECT"],
+        {"SQLALCHEMY_DATABASE_URI": database_url, "WTF_CSRF_ENABLED": False},
+    )
+    if baseline:
+        baseline = benchmarks.load(baseline)
+    with scratch.app_context():
+        db.create_all()
+        click.echo(f"Seeding {users:,} users and {rows:,} line items...")
+        user_ids = benchmarks.seed(users, rows)
+    results = benchmarks.run(scratch, user_ids, repeat)
+    report = benchmarks.report(scratch, users, rows, results)
+    for name, result in results.items():
+        click.echo(
+            f"{name:>20}: median {result['median_ms']:9,.2f} ms"
+            f"  p95 {result['p95_ms']:9,.2f} ms"
+        )
+    if output:
+        benchmarks.save(output, report)
+    if baseline:
+        try:
+            regressions = benchmarks.compare(baseline, report, threshold)
+        except benchmarks.IncomparableRuns as error:
+            raise click.ClickException(str(error))
+        for name, before, after in regressions:
+            click.echo(f"REGRESSION {name}: {before:,.2f} ms -> {after:,.2f} ms")
+        if regressions:
+            exit(1)
+
+
+@click.command()
+@click.option(
+    "-n",
+    "--top",
+    default=20,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Number of slowest imports to list",
+)
+@click.option(
+    "-d",
+    "--depth",
+    default=1,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="Deepest nested import listed, 0 for the app's own imports only",
+)
+def startup(top, depth):
+    """Time a cold start of the app factory, as a worker boot does."""
+    from flask import current_app
+
+    from app.startup import measure
+
+    report = measure(current_app.config["CONFIG_OBJECT"], cwd=PROJECT_ROOT)
+    click.echo(f"Imports:    {report.import_seconds * 1000:9,.1f} ms")
+    click.echo(f"create_app: {report.create_seconds * 1000:9,.1f} ms")
+    click.echo(f"Total:      {report.total_seconds * 1000:9,.1f} ms")
+    click.echo("Slowest imports (cumulative ms, self ms):")
+    for entry in report.slowest(top, depth):
+        click.echo(
+            f"{entry.cumulative_us / 1000:9,.1f} {entry.self_us / 1000:9,.1f}"
+            f"  {'  ' * entry.depth}{entry.module}"
+        )
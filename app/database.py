@@ -1,18 +1,102 @@
 # -*- coding: utf-8 -*-
 """Database module, including the SQLAlchemy database object and DB-related utilities."""
-from datetime import datetime, timezone
-from typing import Optional, Type, TypeVar
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import (
+    Any,
+    Generic,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+)
 
-from sqlalchemy.orm import Mapped, mapped_column
+from flask import current_app, has_app_context
+from sqlalchemy import DateTime, delete, event, insert, inspect, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import (
+    Mapped,
+    joinedload,
+    lazyload,
+    mapped_column,
+    raiseload,
+    selectinload,
+    subqueryload,
+)
+from sqlalchemy.sql.expression import FunctionElement
 
 from .compat import basestring
 from .extensions import db
+from .utils import chunked
 
 T = TypeVar("T", bound="TableModel")
 
 # Alias common SQLAlchemy names
 Column = db.Column
-relationship = db.relationship
+backref = db.backref
+
+#: Number of rows sent to the database per statement/commit by the bulk helpers.
+DEFAULT_CHUNK_SIZE = 1000
+
+#: Default and largest page size of keyset paginated listings.
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+#: Loader option of each relationship loading strategy.
+LOADERS = {
+    "select": lazyload,
+    "selectin": selectinload,
+    "joined": joinedload,
+    "subquery": subqueryload,
+    "raise": raiseload,
+}
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+class LazyLoadError(InvalidRequestError):
+    """Raised for lazy loads when ``SQLALCHEMY_RAISE_ON_LAZY_LOAD`` is set."""
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort key of the last row of a page into an opaque cursor."""
+    values = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Decode a cursor made by :func:`encode_cursor`."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as error:
+        raise InvalidCursor(cursor) from error
+
+
+@dataclass
+class Page(Generic[T]):
+    """A page of a keyset paginated listing."""
+
+    items: List[T]
+    next_cursor: Optional[str]
+
+    @property
+    def has_next(self) -> bool:
+        """Whether another page follows this one."""
+        return self.next_cursor is not None
 
 
 class CRUDMixin(object):
@@ -46,6 +130,256 @@ class CRUDMixin(object):
             return db.session.commit()
         return
 
+    @classmethod
+    def bulk_create(
+        cls,
+        records: Iterable[Any],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        commit: bool = True,
+        returning: Optional[Sequence[Any]] = None,
+        ignore_conflicts: Optional[Sequence[str]] = None,
+    ):
+        """Insert many records with one ``executemany`` round trip per chunk.
+
+        ``records`` may be dicts of column values or model instances. Unlike
+        :meth:`create`, no ORM instances are loaded into the session, and the
+        transaction is committed once per chunk instead of once per row.
+
+        :param returning: Columns to return for each inserted row, e.g.
+            ``(Receipt.id,)``. Rows come back in the order they were given.
+        :param ignore_conflicts: Columns of a unique index. Records conflicting
+            with an existing row on them are skipped with ``ON CONFLICT DO
+            NOTHING`` instead of failing the statement; only the rows actually
+            inserted are counted and returned, in no particular order.
+        :returns: The number of inserted rows, or the list of returned rows
+            when ``returning`` is given.
+        :raises NotImplementedError: If ``ignore_conflicts`` is given on a
+            database without ``ON CONFLICT`` support.
+        """
+        if ignore_conflicts is None:
+            stmt = insert(cls)
+            if returning:
+                stmt = stmt.returning(*returning, sort_by_parameter_order=True)
+        else:
+            dialect = db.session.get_bind().dialect.name
+            if dialect not in ("postgresql", "sqlite"):
+                raise NotImplementedError(f"Cannot skip conflicting rows on {dialect}")
+            dialect_insert = (
+                postgresql.insert if dialect == "postgresql" else sqlite.insert
+            )
+            # Skipped rows return nothing, so the inserted ones are counted
+            # from what comes back.
+            stmt = (
+                dialect_insert(cls)
+                .on_conflict_do_nothing(index_elements=ignore_conflicts)
+                .returning(*(returning or inspect(cls).primary_key))
+            )
+        total = 0
+        returned: List[Any] = []
+        for chunk in chunked(records, chunk_size):
+            rows = [cls._bulk_row(record) for record in chunk]
+            result = db.session.execute(stmt, rows)
+            if ignore_conflicts is not None:
+                inserted = result.all()
+                total += len(inserted)
+                if returning:
+                    returned.extend(inserted)
+            else:
+                if returning:
+                    returned.extend(result.all())
+                total += len(rows)
+            cls._bulk_written(rows)
+            cls._bulk_flush(commit)
+        return returned if returning else total
+
+    @classmethod
+    def bulk_upsert(
+        cls,
+        records: Iterable[Any],
+        index_elements: Optional[Sequence[str]] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        commit: bool = True,
+    ) -> int:
+        """Insert many records, updating the rows that already exist.
+
+        Uses ``INSERT ... ON CONFLICT (index_elements) DO UPDATE`` on PostgreSQL
+        and SQLite; other databases fall back to :meth:`Session.merge` per row.
+
+        :param index_elements: Columns of the unique constraint that identifies
+            an existing row; defaults to the primary key.
+        :returns: The number of inserted or updated rows.
+        :raises ValueError: If a record has a key that is not a mapped column.
+        """
+        mapper = inspect(cls)
+        if index_elements is None:
+            index_elements = [column.name for column in mapper.primary_key]
+        column_names = {attr.key: attr.columns[0].name for attr in mapper.column_attrs}
+        dialect = db.session.get_bind().dialect.name
+        if dialect not in ("postgresql", "sqlite"):
+            return cls._bulk_merge(records, chunk_size, commit)
+
+        total = 0
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        for chunk in chunked(records, chunk_size):
+            rows = [cls._bulk_row(record) for record in chunk]
+            unknown = set().union(*rows) - column_names.keys()
+            if unknown:
+                raise ValueError(
+                    f"Unknown {cls.__name__} columns: {', '.join(sorted(unknown))}"
+                )
+            cls._bulk_upserting(rows, index_elements)
+            # Each row updates exactly the columns it gives, so rows giving
+            # different columns go in separate statements.
+            groups: dict = {}
+            for row in rows:
+                groups.setdefault(frozenset(row), []).append(row)
+            for keys, group in groups.items():
+                stmt = dialect_insert(cls)
+                update_columns = {
+                    column_names[key]: stmt.excluded[column_names[key]]
+                    for key in sorted(keys)
+                    if column_names[key] not in index_elements and key != "created_at"
+                }
+                if "updated_at" in cls.__table__.c:
+                    update_columns["updated_at"] = stmt.excluded.updated_at
+                if update_columns:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=index_elements, set_=update_columns
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+                db.session.execute(stmt, group)
+            cls._bulk_written(rows)
+            total += len(rows)
+            cls._bulk_flush(commit)
+        return total
+
+    @classmethod
+    def bulk_update(
+        cls,
+        records: Iterable[Any],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        commit: bool = True,
+    ) -> int:
+        """Update many rows by primary key with one ``executemany`` round trip per chunk.
+
+        ``records`` are dicts holding the primary key and the columns to set.
+        Rows giving different columns go in separate statements.
+
+        :returns: The number of updated records.
+        """
+        index_elements = [column.name for column in inspect(cls).primary_key]
+        total = 0
+        for chunk in chunked(records, chunk_size):
+            rows = [cls._bulk_row(record) for record in chunk]
+            # The rows are overwritten just like by an upsert, and the models
+            # tracking their old state need to see it first.
+            cls._bulk_upserting(rows, index_elements)
+            groups: dict = {}
+            for row in rows:
+                groups.setdefault(frozenset(row), []).append(row)
+            for group in groups.values():
+                db.session.execute(update(cls), group)
+            cls._bulk_written(rows)
+            total += len(rows)
+            cls._bulk_flush(commit)
+        return total
+
+    @classmethod
+    def bulk_delete(
+        cls,
+        records: Iterable[Any],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        commit: bool = True,
+    ) -> int:
+        """Delete many records by primary key with one statement per chunk.
+
+        ``records`` may be primary key values or model instances.
+
+        :returns: The number of deleted rows.
+        """
+        pk = inspect(cls).primary_key[0]
+        total = 0
+        for chunk in chunked(records, chunk_size):
+            ids = [getattr(record, pk.key, record) for record in chunk]
+            cls._bulk_deleting(ids)
+            result = db.session.execute(
+                delete(cls)
+                .where(pk.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            total += result.rowcount
+            cls._bulk_flush(commit)
+        return total
+
+    @classmethod
+    def _bulk_written(cls, rows: List[dict]) -> None:
+        """Hook called with each chunk of rows inserted or upserted by the bulk helpers.
+
+        The bulk helpers bypass the ORM unit of work, so session events never see
+        these rows. Models maintaining derived data override this hook instead.
+        """
+
+    @classmethod
+    def _bulk_upserting(cls, rows: List[dict], index_elements: Sequence[str]) -> None:
+        """Hook called with each chunk of rows before ``bulk_upsert`` writes them.
+
+        Lets models read the current state of the rows about to be overwritten.
+        """
+
+    @classmethod
+    def _bulk_deleting(cls, ids: List[Any]) -> None:
+        """Hook called with each chunk of primary keys before ``bulk_delete`` removes them."""
+
+    @classmethod
+    def _bulk_conflicts(cls, rows: List[dict], index_elements: Sequence[str]):
+        """Return a clause matching the existing rows ``rows`` conflict with.
+
+        Rows without a value for every index element cannot conflict and are ignored.
+        """
+        columns = [cls.__table__.c[name] for name in index_elements]
+        keys = [
+            tuple(row[column.key] for column in columns)
+            for row in rows
+            if all(row.get(column.key) is not None for column in columns)
+        ]
+        if len(columns) == 1:
+            return columns[0].in_([key[0] for key in keys])
+        return tuple_(*columns).in_(keys)
+
+    @classmethod
+    def _bulk_merge(cls, records, chunk_size, commit) -> int:
+        """Upsert fallback for databases without ``ON CONFLICT`` support."""
+        total = 0
+        for chunk in chunked(records, chunk_size):
+            for record in chunk:
+                if isinstance(record, Mapping):
+                    record = cls(**record)
+                db.session.merge(record)
+                total += 1
+            cls._bulk_flush(commit)
+        return total
+
+    @classmethod
+    def _bulk_row(cls, record) -> dict:
+        """Return the column values of ``record`` as a dict."""
+        if isinstance(record, Mapping):
+            return dict(record)
+        values = {}
+        for attr in inspect(cls).column_attrs:
+            value = getattr(record, attr.key)
+            if value is not None:
+                values[attr.key] = value
+        return values
+
+    @staticmethod
+    def _bulk_flush(commit: bool) -> None:
+        """Commit the current chunk, or just flush it into the transaction."""
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
+
 
 class Model(CRUDMixin, db.Model):
     """Base model class that includes CRUD convenience methods."""
@@ -53,6 +387,35 @@ class Model(CRUDMixin, db.Model):
     __abstract__ = True
 
 
+class utcnow(FunctionElement):  # noqa: N801
+    """Current UTC time as a naive timestamp, evaluated by the database per row."""
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _compile_utcnow(element, compiler, **kw):
+    """Render the current time, which the database keeps in UTC."""
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "postgresql")
+def _compile_utcnow_postgresql(element, compiler, **kw):
+    """Render the current time converted from the session time zone to UTC."""
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow, "sqlite")
+def _compile_utcnow_sqlite(element, compiler, **kw):
+    """Render the current UTC time in the format SQLAlchemy stores datetimes in.
+
+    SQLite compares datetimes as text, so the default has to carry the same six
+    fractional digits as bound values; ``%f`` only yields milliseconds.
+    """
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
 class TableModel(Model):
     """Base model class that includes CRUD convenience methods, plus adds a 'primary key' column named ``id``."""
 
@@ -60,12 +423,10 @@ class TableModel(Model):
     # id = Column(db.Integer, primary_key=True)
     id: Mapped[int] = mapped_column(primary_key=True, sort_order=-1)
     created_at: Mapped[datetime] = mapped_column(
-        nullable=False, default=datetime.now(timezone.utc)
+        nullable=False, server_default=utcnow()
     )
     updated_at: Mapped[datetime] = mapped_column(
-        nullable=False,
-        default=datetime.now(timezone.utc),
-        onupdate=datetime.now(timezone.utc),
+        nullable=False, server_default=utcnow(), onupdate=utcnow(), index=True
     )
 
     @classmethod
@@ -80,6 +441,95 @@ class TableModel(Model):
             return cls.query.session.get(cls, int(record_id))
         return None
 
+    @classmethod
+    def loading(cls, *paths: str, strategy: str = "selectin") -> list:
+        """Return query options loading relationships with ``strategy``.
+
+        Paths are relationship names, dotted to reach further, e.g.
+        ``Receipt.query.options(*Receipt.loading("line_items", "user"))``.
+        """
+        loader = LOADERS[strategy]
+        options = []
+        for path in paths:
+            model, option = cls, None
+            for name in path.split("."):
+                attr = getattr(model, name)
+                option = (
+                    loader(attr)
+                    if option is None
+                    else getattr(option, loader.__name__)(attr)
+                )
+                model = attr.property.mapper.class_
+            options.append(option)
+        return options
+
+    @classmethod
+    def between(
+        cls: Type[T],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        column=None,
+        query=None,
+    ):
+        """Return a query of the records in ``[start, end)``, oldest first.
+
+        The half-open range maps onto a single index range scan of ``column``,
+        so consecutive buckets never overlap or miss a row.
+
+        :param column: Timestamp column to filter on; defaults to ``created_at``.
+        :param query: Filtered query to narrow down; defaults to all records.
+        """
+        column = cls.created_at if column is None else column
+        query = cls.query if query is None else query
+        if start is not None:
+            query = query.filter(column >= start)
+        if end is not None:
+            query = query.filter(column < end)
+        return query.order_by(column, cls.id)
+
+    @classmethod
+    def seek(
+        cls: Type[T],
+        cursor: Optional[str] = None,
+        per_page: int = DEFAULT_PAGE_SIZE,
+        query=None,
+    ) -> Page[T]:
+        """Return a page of records, newest first, paginated on ``(created_at, id)``.
+
+        Instead of an ``OFFSET``, which makes the database walk every skipped row,
+        the cursor holds the sort key of the previous page's last row and the
+        next page starts right after it, so every page costs the same index range
+        scan at any depth.
+
+        :param cursor: ``next_cursor`` of the previous page, if any.
+        :param per_page: Page size, capped at :data:`MAX_PAGE_SIZE`.
+        :param query: Filtered query to paginate; defaults to all records.
+        :raises InvalidCursor: If ``cursor`` was not made by this method.
+        """
+        query = cls.query if query is None else query
+        per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+        if cursor:
+            try:
+                created_at, record_id = decode_cursor(cursor)
+                created_at = datetime.fromisoformat(created_at)
+            except (TypeError, ValueError) as error:
+                raise InvalidCursor(cursor) from error
+            if not isinstance(record_id, int) or isinstance(record_id, bool):
+                raise InvalidCursor(cursor)
+            query = query.filter(
+                tuple_(cls.created_at, cls.id) < tuple_(created_at, record_id)
+            )
+        items = (
+            query.order_by(cls.created_at.desc(), cls.id.desc())
+            .limit(per_page + 1)
+            .all()
+        )
+        next_cursor = None
+        if len(items) > per_page:
+            items = items[:per_page]
+            next_cursor = encode_cursor((items[-1].created_at, items[-1].id))
+        return Page(items, next_cursor)
+
 
 def reference_col(
     tablename,
@@ -93,7 +543,7 @@ def reference_col(
     Usage: ::
 
         category_id = reference_col('category')
-        category = relationship('Category', backref='categories')
+        category = relationship('Category', backref='categories', lazy='joined')
     """
     foreign_key_kwargs = foreign_key_kwargs or {}
     column_kwargs = column_kwargs or {}
@@ -103,3 +553,42 @@ def reference_col(
         nullable=nullable,
         **column_kwargs,
     )
+
+
+def relationship(
+    argument, lazy="select", backref=None, backref_lazy="select", **kwargs
+):
+    """Relationship whose loading strategy, and that of its backref, is chosen here.
+
+    ``lazy`` and ``backref_lazy`` take the strategies of :data:`LOADERS`,
+    checked when the model is defined. Lazy loads, the default, are refused
+    when ``SQLALCHEMY_RAISE_ON_LAZY_LOAD`` is set, as it is in tests; views
+    load what they need with :meth:`TableModel.loading` instead.
+    """
+    for strategy in (lazy, backref_lazy):
+        if strategy not in LOADERS:
+            raise ValueError(f"Unknown loading strategy {strategy!r}")
+    if isinstance(backref, str):
+        kwargs["backref"] = db.backref(backref, lazy=backref_lazy)
+    elif backref is not None:
+        kwargs["backref"] = backref
+    return db.relationship(argument, lazy=lazy, **kwargs)
+
+
+@event.listens_for(db.session, "do_orm_execute")
+def _refuse_lazy_loads(orm_execute_state):
+    """Raise on lazy loads when configured to, so tests catch N+1 queries early."""
+    # The unit of work loads the collections a flush cascades to; those are fine.
+    if not orm_execute_state.is_select or orm_execute_state.session._flushing:
+        return
+    if not has_app_context():
+        return
+    if orm_execute_state.lazy_loaded_from is None:
+        return
+    if current_app.config.get("SQLALCHEMY_RAISE_ON_LAZY_LOAD"):
+        path = orm_execute_state.loader_strategy_path
+        raise LazyLoadError(
+            f"Lazy load of {path[-1] if path else 'a relationship'} of "
+            f"{orm_execute_state.lazy_loaded_from.object!r}; "
+            "load it with TableModel.loading() or pick an eager strategy"
+        )
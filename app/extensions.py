@@ -1,19 +1,24 @@
 # -*- coding: utf-8 -*-
-"""Extensions module. Each extension is initialized in the app factory located in app.py."""
-from flask_bcrypt import Bcrypt
+"""Extensions module. Each extension is initialized in the app factory located in app.py.
+
+The debug toolbar and Flask-Migrate are imported by the app factory, and only
+when needed: they are slow to import and serve no request in production.
+"""
 from flask_caching import Cache
-from flask_debugtoolbar import DebugToolbarExtension
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from flask_static_digest import FlaskStaticDigest
 from flask_wtf.csrf import CSRFProtect
 
-bcrypt = Bcrypt()
+from app.passwords import OffloadedBcrypt
+from app.pool import PoolMonitor
+from app.profiler import QueryProfiler
+
+bcrypt = OffloadedBcrypt()
 csrf_protect = CSRFProtect()
 login_manager = LoginManager()
 db = SQLAlchemy()
-migrate = Migrate()
+pool_monitor = PoolMonitor()
 cache = Cache()
-debug_toolbar = DebugToolbarExtension()
 flask_static_digest = FlaskStaticDigest()
+query_profiler = QueryProfiler()
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+"""The jobs module, running slow work in a background worker process."""
+from . import models, queue  # noqa
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Job models."""
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import TableModel, db
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job(TableModel):
+    """A unit of background work, see :mod:`app.jobs.queue`."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Workers claim runnable jobs in this order, straight off the index.
+        db.Index(
+            "ix_jobs_state_priority_run_at_id", "state", "priority", "run_at", "id"
+        ),
+    )
+    name: Mapped[str] = mapped_column(db.String(80), nullable=False)
+    payload: Mapped[dict] = mapped_column(db.JSON, nullable=False, default=dict)
+    state: Mapped[str] = mapped_column(db.String(16), nullable=False, default=QUEUED)
+    # Lower runs first.
+    priority: Mapped[int] = mapped_column(nullable=False, default=0)
+    attempts: Mapped[int] = mapped_column(nullable=False, default=0)
+    max_attempts: Mapped[int] = mapped_column(nullable=False, default=3)
+    # When the job is due, pushed back after each failed attempt.
+    run_at: Mapped[datetime] = mapped_column(nullable=False)
+    locked_by: Mapped[Optional[str]] = mapped_column(db.String(120), nullable=True)
+    locked_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    # Timings of the last attempt: from due to claimed, and running the handler.
+    wait_ms: Mapped[Optional[float]] = mapped_column(nullable=True)
+    run_ms: Mapped[Optional[float]] = mapped_column(nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(db.Text, nullable=True)
+    result: Mapped[Optional[dict]] = mapped_column(db.JSON, nullable=True)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Job({self.id!r}, {self.name!r}, {self.state!r})>"
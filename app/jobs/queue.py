@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""Background job queue.
+
+Slow work -- parsing uploaded exports, categorizing their receipts and rolling
+them up -- does not belong in a request. Views :func:`enqueue` a job, a row of
+the ``jobs`` table, and return; ``flask worker`` runs a :class:`Worker` that
+picks jobs up and calls the handler registered for their name with
+:func:`task`.
+
+Workers claim the most urgent due jobs a batch at a time, with one
+``UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED)``: concurrent
+workers skip the rows another one is claiming instead of waiting for it.
+SQLite has no row locks and ignores the clause, but it runs one writer at a
+time and the update rechecks the state, so no job is claimed twice there
+either.
+
+* Jobs run in order of ``priority``, lower first, then of when they are due.
+* Handlers of batched tasks get the payloads of all the jobs of theirs a
+  worker claimed at once, so many small jobs cost one call and one commit.
+* A failed job is retried after :data:`RETRY_DELAY` seconds, doubling with
+  every attempt, until it runs out of attempts.
+* A job still running ``timeout`` seconds after it was claimed is taken to
+  have lost its worker and is queued again, so handlers must be safe to run
+  twice.
+* Each attempt records how long the job waited once due, and ran.
+"""
+import os
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, func, select, update
+
+from app.database import db
+
+from .models import DONE, FAILED, QUEUED, RUNNING, Job
+
+#: Jobs claimed per round trip.
+DEFAULT_BATCH_SIZE = 20
+
+#: Seconds a worker sleeps when no job is due.
+DEFAULT_POLL_INTERVAL = 1.0
+
+#: Seconds a job may run before it is taken to have lost its worker.
+DEFAULT_TIMEOUT = 30 * 60
+
+#: Seconds before the second attempt of a failed job, doubled for each next one.
+RETRY_DELAY = 10
+
+#: Seconds between two looks for jobs that lost their worker.
+REQUEUE_INTERVAL = 60
+
+
+@dataclass
+class Task:
+    """A job handler and the defaults of its jobs."""
+
+    name: str
+    func: Callable
+    batched: bool = False
+    priority: int = 0
+    max_attempts: int = 3
+
+
+#: Registered tasks by name.
+TASKS: Dict[str, Task] = {}
+
+
+def task(name, batched=False, priority=0, max_attempts=3):
+    """Register the decorated function as the handler of the jobs called ``name``.
+
+    Handlers are called inside an app context with the payload of a job, or
+    with the list of payloads of a batch if ``batched`` is set. What they
+    return is stored as the result of the job and must be JSON serializable.
+    """
+
+    def register(func):
+        TASKS[name] = Task(name, func, batched, priority, max_attempts)
+        return func
+
+    return register
+
+
+def _now():
+    """Return the current UTC time as a naive datetime, as the database keeps it."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _ms(delta):
+    """Return a timedelta in milliseconds."""
+    return delta.total_seconds() * 1000
+
+
+def enqueue(name, payload=None, priority=None, delay=0, commit=True):
+    """Queue a job of the task called ``name``.
+
+    :param priority: Overrides the priority of the task; lower runs first.
+    :param delay: Seconds before the job is due.
+    :param commit: Otherwise workers only see the job once the caller commits.
+    """
+    if name not in TASKS:
+        raise ValueError(f"Unknown task {name!r}")
+    task = TASKS[name]
+    job = Job(
+        name=name,
+        payload=payload or {},
+        priority=task.priority if priority is None else priority,
+        max_attempts=task.max_attempts,
+        run_at=_now() + timedelta(seconds=delay),
+    )
+    return job.save(commit)
+
+
+def claim(worker, limit=DEFAULT_BATCH_SIZE, now=None):
+    """Claim up to ``limit`` due jobs for ``worker``, and commit.
+
+    :returns: The claimed jobs as rows, most urgent first.
+    """
+    now = now or _now()
+    jobs = Job.__table__
+    # An alias, so the subquery is not correlated to the updated table.
+    candidates = jobs.alias("candidates")
+    due = (
+        select(candidates.c.id)
+        .where(candidates.c.state == QUEUED, candidates.c.run_at <= now)
+        .order_by(candidates.c.priority, candidates.c.run_at, candidates.c.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.session.execute(
+        update(jobs)
+        .where(jobs.c.id.in_(due), jobs.c.state == QUEUED)
+        .values(
+            state=RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=jobs.c.attempts + 1,
+        )
+        .returning(
+            jobs.c.id,
+            jobs.c.name,
+            jobs.c.payload,
+            jobs.c.priority,
+            jobs.c.run_at,
+            jobs.c.attempts,
+            jobs.c.max_attempts,
+        )
+    ).all()
+    db.session.commit()
+    return sorted(rows, key=lambda row: (row.priority, row.run_at, row.id))
+
+
+def _update_each(values, params):
+    """Update jobs by id with per-job ``params``, bound by the names in ``values``."""
+    if not params:
+        return
+    jobs = Job.__table__
+    db.session.execute(
+        update(jobs).where(jobs.c.id == bindparam("job_id")).values(**values), params
+    )
+
+
+def finish(jobs, claimed_at, run_ms, result=None):
+    """Mark claimed jobs done, sharing ``run_ms`` out between them, and commit."""
+    now = _now()
+    _update_each(
+        {
+            "state": DONE,
+            "finished_at": now,
+            "locked_by": None,
+            "error": None,
+            "result": result,
+            "run_ms": run_ms / len(jobs),
+            "wait_ms": bindparam("job_wait_ms"),
+        },
+        [
+            {"job_id": job.id, "job_wait_ms": _ms(claimed_at - job.run_at)}
+            for job in jobs
+        ],
+    )
+    db.session.commit()
+
+
+def retry_or_fail(jobs, claimed_at, run_ms, error):
+    """Queue failed jobs again after a backoff, or fail those out of attempts."""
+    now = _now()
+    params = []
+    for job in jobs:
+        retry = job.attempts < job.max_attempts
+        params.append(
+            {
+                "job_id": job.id,
+                "job_state": QUEUED if retry else FAILED,
+                "job_run_at": (
+                    now + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+                    if retry
+                    else job.run_at
+                ),
+                "job_finished_at": None if retry else now,
+                "job_wait_ms": _ms(claimed_at - job.run_at),
+            }
+        )
+    _update_each(
+        {
+            "state": bindparam("job_state"),
+            "run_at": bindparam("job_run_at"),
+            "finished_at": bindparam("job_finished_at"),
+            "wait_ms": bindparam("job_wait_ms"),
+            "locked_by": None,
+            "error": error,
+            "run_ms": run_ms / len(jobs),
+        },
+        params,
+    )
+    db.session.commit()
+
+
+def release(jobs):
+    """Queue claimed jobs again without counting the attempt, and commit."""
+    table = Job.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id.in_([job.id for job in jobs]), table.c.state == RUNNING)
+        .values(state=QUEUED, locked_by=None, attempts=table.c.attempts - 1)
+    )
+    db.session.commit()
+
+
+def requeue_stale(timeout=DEFAULT_TIMEOUT, now=None):
+    """Queue jobs running for longer than ``timeout`` seconds again, and commit.
+
+    Those out of attempts fail instead.
+
+    :returns: The numbers of jobs queued again and failed.
+    """
+    now = now or _now()
+    jobs = Job.__table__
+    stale = (
+        jobs.c.state == RUNNING,
+        jobs.c.locked_at < now - timedelta(seconds=timeout),
+    )
+    error = f"Timed out after {timeout}s"
+    failed = db.session.execute(
+        update(jobs)
+        .where(*stale, jobs.c.attempts >= jobs.c.max_attempts)
+        .values(state=FAILED, finished_at=now, locked_by=None, error=error)
+    ).rowcount
+    queued = db.session.execute(
+        update(jobs)
+        .where(*stale)
+        .values(state=QUEUED, run_at=now, locked_by=None, error=error)
+    ).rowcount
+    db.session.commit()
+    return queued, failed
+
+
+def purge(days, now=None):
+    """Delete the jobs done more than ``days`` days ago, and commit.
+
+    :returns: The number of jobs deleted.
+    """
+    jobs = Job.__table__
+    cutoff = (now or _now()) - timedelta(days=days)
+    deleted = db.session.execute(
+        delete(jobs).where(jobs.c.state == DONE, jobs.c.finished_at < cutoff)
+    ).rowcount
+    db.session.commit()
+    return deleted
+
+
+def stats():
+    """Return the number of jobs and their mean timings, by task and state."""
+    jobs = Job.__table__
+    return db.session.execute(
+        select(
+            jobs.c.name,
+            jobs.c.state,
+            func.count().label("count"),
+            func.avg(jobs.c.wait_ms).label("wait_ms"),
+            func.avg(jobs.c.run_ms).label("run_ms"),
+        )
+        .group_by(jobs.c.name, jobs.c.state)
+        .order_by(jobs.c.name, jobs.c.state)
+    ).all()
+
+
+class Worker:
+    """Claims due jobs and runs them until stopped.
+
+    :param batch_size: Jobs claimed per round trip.
+    :param poll_interval: Seconds to sleep when no job is due.
+    :param timeout: Seconds after which running jobs are queued again.
+    """
+
+    def __init__(
+        self,
+        batch_size=DEFAULT_BATCH_SIZE,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        """Create instance."""
+        self.id = f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.stopping = False
+        self._requeued_at = None
+
+    def stop(self, *args):
+        """Finish the job at hand, then return from :meth:`run`."""
+        self.stopping = True
+
+    def run(self, burst=False):
+        """Run jobs until stopped, or until none is due if ``burst`` is set."""
+        while not self.stopping:
+            if not self.run_once():
+                if burst:
+                    return
+                time.sleep(self.poll_interval)
+
+    def run_once(self):
+        """Claim a batch of due jobs and run them.
+
+        :returns: The number of jobs claimed.
+        """
+        now = _now()
+        if self._requeued_at is None or now - self._requeued_at > timedelta(
+            seconds=REQUEUE_INTERVAL
+        ):
+            requeue_stale(self.timeout, now)
+            self._requeued_at = now
+        jobs = claim(self.id, self.batch_size, now)
+        groups = {}
+        for job in jobs:
+            task = TASKS.get(job.name)
+            batch = job.name if task is not None and task.batched else job.id
+            groups.setdefault(batch, []).append(job)
+        batches = list(groups.values())
+        for index, batch in enumerate(batches):
+            if self.stopping:
+                # Leave the rest to the next worker rather than to the timeout.
+                release([job for rest in batches[index:] for job in rest])
+                break
+            self._run(batch, now)
+        return len(jobs)
+
+    def _run(self, jobs, claimed_at):
+        """Run one job, or a batch of jobs of the same batched task."""
+        name = jobs[0].name
+        started = time.perf_counter()
+        try:
+            task = TASKS.get(name)
+            if task is None:
+                raise LookupError(f"Unknown task {name!r}")
+            payloads = [job.payload for job in jobs]
+            result = task.func(payloads if task.batched else payloads[0])
+            db.session.commit()
+        except Exception as error:  # noqa: B902
+            db.session.rollback()
+            run_ms = (time.perf_counter() - started) * 1000
+            current_app.logger.exception(f"Job {name} failed")
+            retry_or_fail(jobs, claimed_at, run_ms, f"{type(error).__name__}: {error}")
+            return
+        run_ms = (time.perf_counter() - started) * 1000
+        finish(jobs, claimed_at, run_ms, result)
+        wait_ms = max(_ms(claimed_at - job.run_at) for job in jobs)
+        current_app.logger.info(
+            f"Job {name}: {len(jobs)} done in {run_ms:.1f} ms, "
+            f"waited up to {wait_ms:.1f} ms"
+        )
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Structured logging off the request path.
+
+Writing to stdout is a blocking syscall, and under the gevent worker a slow
+pipe stalls every greenlet of the process. :class:`BackgroundHandler` only
+puts records on a queue; a native thread, which gevent does not patch, formats
+and writes them.
+
+Records carry the request id, user id, endpoint and latency of the request
+they were logged in, and are written as JSON lines by default. Info and debug
+records can be sampled, so chatty endpoints do not cost a write per hit.
+
+Settings:
+
+* ``LOG_LEVEL``: level of the app logger, e.g. ``INFO``; unset keeps Flask's.
+* ``LOG_FORMAT``: ``json`` for one JSON object per line, or ``text``.
+* ``LOG_INFO_SAMPLE_RATE``: share of info and debug records written, 0 to 1.
+"""
+import copy
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request, session
+from gevent import monkey
+
+#: Header carrying the request id, taken from the proxy when it sets one.
+REQUEST_ID_HEADER = "X-Request-ID"
+
+#: Record attributes added by :class:`RequestContextFilter`.
+CONTEXT_FIELDS = ("request_id", "user_id", "endpoint", "latency_ms")
+
+
+def start_request():
+    """Remember when the request started and which id it goes by."""
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+
+def finish_request(response):
+    """Send the request id back, so clients can quote it."""
+    if "request_id" in g:
+        response.headers.setdefault(REQUEST_ID_HEADER, g.request_id)
+    return response
+
+
+class RequestContextFilter(logging.Filter):
+    """Add the fields of the current request to records."""
+
+    def filter(self, record):
+        """Set the :data:`CONTEXT_FIELDS` of ``record``; None outside requests."""
+        for field in CONTEXT_FIELDS:
+            setattr(record, field, None)
+        if not has_request_context():
+            return True
+        record.endpoint = request.endpoint
+        record.request_id = g.get("request_id")
+        # The session cookie holds the id; current_user could hit the database.
+        record.user_id = session.get("_user_id")
+        started = g.get("request_started")
+        if started is not None:
+            record.latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Pass a share of the info and debug records; warnings and worse always pass."""
+
+    def __init__(self, rate=1.0):
+        """Create instance."""
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        """Return whether ``record`` is written."""
+        return record.levelno > logging.INFO or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        """Return ``record`` as JSON."""
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _NativeQueueListener(QueueListener):
+    """Queue listener running in a native thread even when gevent patched threading."""
+
+    def start(self):
+        """Start the thread writing the queued records."""
+        thread_class = monkey.get_original("threading", "Thread")
+        self._thread = thread_class(target=self._monitor, daemon=True)
+        self._thread.start()
+
+
+class BackgroundHandler(QueueHandler):
+    """Hand records over to ``handler``, which writes them in a background thread.
+
+    Threads do not survive a fork, so a forked worker starts its own.
+    """
+
+    def __init__(self, handler):
+        """Create instance."""
+        super().__init__(None)
+        self.handler = handler
+        self.listener = None
+        self._pid = None
+
+    def start(self):
+        """Start the background thread of this process."""
+        self.queue = monkey.get_original("queue", "SimpleQueue")()
+        self.listener = _NativeQueueListener(
+            self.queue, self.handler, respect_handler_level=True
+        )
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def prepare(self, record):
+        """Return a copy of ``record`` safe to pass between threads."""
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args = record.message, None
+        record.exc_info = record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        """Queue a record, starting the background thread if needed."""
+        if self._pid != os.getpid():
+            self.start()
+        self.queue.put_nowait(record)
+
+    def close(self):
+        """Write the queued records and stop the background thread."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        self.handler.close()
+        super().close()
+
+
+def create_handler(config, stream=None):
+    """Return the background handler configured by the ``LOG_*`` settings."""
+    handler = logging.StreamHandler(stream or sys.stdout)
+    if config.get("LOG_FORMAT", "json") == "json":
+        handler.setFormatter(JSONFormatter())
+    background = BackgroundHandler(handler)
+    background.addFilter(SamplingFilter(config.get("LOG_INFO_SAMPLE_RATE", 1.0)))
+    background.addFilter(RequestContextFilter())
+    return background
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Password hashing off the gevent hub.
+
+bcrypt is deliberately slow CPU work: at the default 13 rounds a single hash
+takes about a quarter of a second. Run inline under the gevent worker it
+freezes the event loop, and every other request on the worker with it.
+
+:class:`OffloadedBcrypt` runs hashing and verification in a bounded pool of
+native threads instead. bcrypt releases the GIL while it works, so the hub
+keeps serving other greenlets, and the pool size caps how many CPU cores a
+login burst can take. Outside a monkey patched process (tests, CLI commands,
+the sync dev server) the work simply runs inline.
+
+The cost of new hashes follows ``BCRYPT_LOG_ROUNDS``; :func:`calibrate` helps
+pick it per host, and hashes of another cost are upgraded on login.
+"""
+import os
+import statistics
+import time
+
+import bcrypt as _bcrypt
+from flask_bcrypt import Bcrypt
+from gevent import monkey
+from gevent.threadpool import ThreadPool
+
+
+def hash_cost(pw_hash):
+    """Return the log rounds a bcrypt hash was computed with."""
+    if isinstance(pw_hash, str):
+        pw_hash = pw_hash.encode("utf-8")
+    if not pw_hash.startswith(b"$2"):
+        raise ValueError("Not a bcrypt hash")
+    try:
+        return int(pw_hash.split(b"$")[2])
+    except (IndexError, ValueError):
+        raise ValueError("Not a bcrypt hash")
+
+
+def calibrate(target_seconds, min_rounds=4, max_rounds=20, samples=3):
+    """Time bcrypt on this host and suggest a cost for ``target_seconds`` per hash.
+
+    Costs are measured from ``min_rounds`` up, stopping at the first one over
+    the target, since each extra round doubles the time. Returns the suggested
+    cost, the highest one not exceeding the target, and the ``(rounds,
+    seconds)`` median timings.
+    """
+    timings = []
+    for rounds in range(min_rounds, max_rounds + 1):
+        salt = _bcrypt.gensalt(rounds)
+        durations = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            _bcrypt.hashpw(b"calibration password", salt)
+            durations.append(time.perf_counter() - started)
+        timings.append((rounds, statistics.median(durations)))
+        if timings[-1][1] > target_seconds:
+            break
+    within = [rounds for rounds, seconds in timings if seconds <= target_seconds]
+    return max(within, default=min_rounds), timings
+
+
+def _timed_call(function, args):
+    """Call ``function`` in a pool thread, returning its result and start time."""
+    started = time.perf_counter()
+    return function(*args), started
+
+
+class OffloadedBcrypt(Bcrypt):
+    """Flask-Bcrypt running its work in a gevent thread pool.
+
+    Settings:
+
+    * ``BCRYPT_THREADPOOL_SIZE``: threads hashing concurrently, 4 by default.
+    * ``BCRYPT_OFFLOAD``: ``True`` or ``False`` to force offloading on or off;
+      by default it follows whether gevent monkey patched the process.
+    """
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.pool_size = 4
+        self.offload = None
+        self._pool = None
+        self._pool_pid = None
+        self.reset_stats()
+        super().__init__(app)
+
+    def init_app(self, app):
+        """Read the thread pool settings of ``app``."""
+        super().init_app(app)
+        self.pool_size = app.config.get("BCRYPT_THREADPOOL_SIZE", 4)
+        self.offload = app.config.get("BCRYPT_OFFLOAD")
+
+    @property
+    def offloading(self):
+        """Whether hashing currently runs in the thread pool."""
+        if self.offload is not None:
+            return self.offload
+        return monkey.is_module_patched("socket")
+
+    @property
+    def pool(self):
+        """Thread pool of the current process, created on first use.
+
+        Pools hold native threads, which do not survive a fork, so every
+        gunicorn worker gets its own.
+        """
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPool(self.pool_size)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def reset_stats(self):
+        """Zero the pool metrics."""
+        self.calls = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def queue_depth(self):
+        """Calls waiting for a free thread."""
+        return max(0, self.in_flight - self.pool_size)
+
+    def stats(self):
+        """Return the pool metrics of this process."""
+        return {
+            "size": self.pool_size,
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "mean_wait_seconds": self.wait_seconds / self.calls if self.calls else 0.0,
+        }
+
+    def _run(self, function, *args):
+        """Run ``function(*args)`` in the pool when offloading, inline otherwise."""
+        if not self.offloading:
+            return function(*args)
+        self.calls += 1
+        self.in_flight += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        queued = time.perf_counter()
+        try:
+            result, started = self.pool.apply(_timed_call, (function, args))
+        finally:
+            self.in_flight -= 1
+        self.wait_seconds += started - queued
+        return result
+
+    def generate_password_hash(self, password, rounds=None, prefix=None):
+        """Hash ``password`` without blocking the event loop."""
+        return self._run(super().generate_password_hash, password, rounds, prefix)
+
+    def check_password_hash(self, pw_hash, password):
+        """Check ``password`` against ``pw_hash`` without blocking the event loop."""
+        return self._run(super().check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Return whether ``pw_hash`` was computed with another cost than configured.
+
+        Missing and non-bcrypt hashes cannot be upgraded and never need it.
+        """
+        if not pw_hash:
+            return False
+        try:
+            return hash_cost(pw_hash) != self._log_rounds
+        except ValueError:
+            return False
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Database connection pool settings and metrics.
+
+psycopg2 talks to the server in C, so under the gevent worker every query
+blocks the hub, and with it every greenlet of the process, until the server
+answers. :func:`make_green` installs a wait callback that yields to the hub
+instead, as the psycogreen recipe does.
+
+The pool is sized from the environment, and :class:`MeteredQueuePool` records
+how long checkouts wait for a connection and how close the pool is to running
+out. The wait of each request is sent as a ``Server-Timing`` metric and slow
+checkouts are logged with the pool's state.
+
+Settings:
+
+* ``DB_POOL_SIZE``: connections kept open per worker.
+* ``DB_MAX_OVERFLOW``: connections opened beyond the pool size under load.
+* ``DB_POOL_TIMEOUT``: seconds a checkout waits before failing.
+* ``DB_POOL_RECYCLE``: seconds after which a connection is replaced, or -1.
+* ``DB_POOL_PRE_PING``: test connections on checkout, dropping dead ones.
+* ``DB_POOL_WAIT_WARNING_MS``: log requests waiting longer for a connection.
+* ``DB_GREEN``: ``True`` or ``False`` to force the wait callback on or off;
+  by default it follows whether gevent monkey patched the process.
+"""
+import time
+from dataclasses import dataclass
+
+from flask import current_app, g, has_app_context, request
+from gevent import monkey
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+#: Settings mapped to the engine options they set.
+POOL_OPTIONS = {
+    "DB_POOL_SIZE": "pool_size",
+    "DB_MAX_OVERFLOW": "max_overflow",
+    "DB_POOL_TIMEOUT": "pool_timeout",
+    "DB_POOL_RECYCLE": "pool_recycle",
+    "DB_POOL_PRE_PING": "pool_pre_ping",
+}
+
+
+def gevent_wait_callback(connection, timeout=None):
+    """Wait for psycopg2 ``connection`` by yielding to the gevent hub."""
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import OperationalError, extensions
+
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def make_green():
+    """Make psycopg2 cooperate with gevent, for every connection of the process."""
+    from psycopg2 import extensions
+
+    extensions.set_wait_callback(gevent_wait_callback)
+
+
+@dataclass
+class PoolMetrics:
+    """Checkouts of one pool since it was created."""
+
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    peak_checked_out: int = 0
+
+    def record(self, seconds, checked_out, timed_out=False):
+        """Count a checkout that waited ``seconds``."""
+        self.checkouts += 1
+        self.timeouts += timed_out
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        self.peak_checked_out = max(self.peak_checked_out, checked_out)
+
+
+class MeteredQueuePool(QueuePool):
+    """Queue pool timing how long each checkout waits for a connection.
+
+    The wait is also added to ``g.db_pool_wait`` when checking out in an app
+    context, so it can be reported per request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create instance."""
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        """Check out a connection, timing the wait."""
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self._record(time.perf_counter() - started, timed_out=True)
+            raise
+        self._record(time.perf_counter() - started)
+        return connection
+
+    def _record(self, seconds, timed_out=False):
+        """Count a checkout in the pool's and the request's metrics."""
+        self.metrics.record(seconds, self.checkedout(), timed_out)
+        if has_app_context():
+            g.db_pool_wait = g.get("db_pool_wait", 0.0) + seconds
+
+    @property
+    def capacity(self):
+        """Most connections the pool opens, None if unlimited."""
+        if self._max_overflow < 0:
+            return None
+        return self.size() + self._max_overflow
+
+    @property
+    def saturation(self):
+        """Share of :attr:`capacity` checked out, None if unlimited."""
+        capacity = self.capacity
+        return self.checkedout() / capacity if capacity else None
+
+    def stats(self):
+        """Return the pool's state and metrics as a dict."""
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "capacity": self.capacity,
+            "saturation": self.saturation,
+            **self.metrics.__dict__,
+        }
+
+
+def engine_options(config):
+    """Return the engine options set by the ``DB_POOL_*`` settings of ``config``.
+
+    In-memory SQLite databases live in their one connection and get no pool.
+    """
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    options = {"poolclass": MeteredQueuePool}
+    for setting, option in POOL_OPTIONS.items():
+        if config.get(setting) is not None:
+            options[option] = config[setting]
+    return options
+
+
+class PoolMonitor:
+    """Configure the engine's pool and report its waits per request.
+
+    Initialize it before Flask-SQLAlchemy, which creates the engines.
+    """
+
+    def __init__(self, app=None):
+        """Create instance."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set the engine options and register the request hook."""
+        app.config.setdefault("DB_POOL_WAIT_WARNING_MS", 100)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            **engine_options(app.config),
+            **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+        }
+        green = app.config.get("DB_GREEN")
+        if green is None:
+            green = monkey.is_module_patched("socket")
+        driver = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_driver_name()
+        if green and driver == "psycopg2":
+            make_green()
+        app.after_request(self._report)
+
+    @staticmethod
+    def _report(response):
+        """Send the request's connection wait, logging it when slow."""
+        waited = g.pop("db_pool_wait", None)
+        if waited is None:
+            return response
+        response.headers.add("Server-Timing", f"db-pool;dur={waited * 1000:.2f}")
+        if waited * 1000 > current_app.config["DB_POOL_WAIT_WARNING_MS"]:
+            from app.extensions import db
+
+            current_app.logger.warning(
+                f"{request.endpoint} waited {waited * 1000:.2f} ms for a database "
+                f"connection: {db.engine.pool.stats()}"
+            )
+        return response
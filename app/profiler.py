@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Per-request SQL query profiling.
+
+Flask-SQLAlchemy records every query of a request when
+``SQLALCHEMY_RECORD_QUERIES`` is on. :class:`QueryProfiler` sums them up after
+each request: query count, database time and statements repeated with
+different parameters, the usual sign of an N+1 lazy load. The profile is sent
+as a ``Server-Timing`` header, logged, and checked against a query budget.
+
+Settings:
+
+* ``QUERY_BUDGET``: most queries a request may run, None for no limit.
+* ``QUERY_REPEAT_LIMIT``: most times a request may run the same statement.
+* ``QUERY_BUDGET_RAISE``: raise :class:`QueryBudgetExceeded` instead of
+  logging a warning when a request is over budget, for tests.
+
+Views can override the budget with :func:`query_budget`.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict
+
+from flask import current_app, g, request
+from flask_sqlalchemy.record_queries import get_recorded_queries
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a request runs more queries than its budget allows."""
+
+
+def fingerprint(statement):
+    """Return ``statement`` with literals, placeholders and whitespace normalized.
+
+    Statements differing only in their parameters share a fingerprint.
+    """
+    statement = re.sub(r"%\(\w+\)s|:\w+|\$\d+|%s", "?", statement)
+    statement = _LITERALS.sub("?", statement)
+    statement = _PLACEHOLDER_LISTS.sub("(?)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+@dataclass
+class QueryProfile:
+    """Queries run while handling one request."""
+
+    endpoint: str = ""
+    count: int = 0
+    seconds: float = 0.0
+    repeats: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def from_queries(cls, endpoint, queries):
+        """Profile a list of Flask-SQLAlchemy query records."""
+        counts = Counter(fingerprint(query.statement) for query in queries)
+        return cls(
+            endpoint=endpoint or "",
+            count=len(queries),
+            seconds=sum(query.duration for query in queries),
+            repeats={
+                statement: count for statement, count in counts.items() if count > 1
+            },
+        )
+
+    @property
+    def max_repeats(self):
+        """Runs of the most repeated statement."""
+        return max(self.repeats.values(), default=1 if self.count else 0)
+
+    def server_timing(self):
+        """Return the profile as a ``Server-Timing`` metric."""
+        return f'db;dur={self.seconds * 1000:.2f};desc="{self.count} queries"'
+
+    def log_line(self):
+        """Return the profile as a ``key=value`` log line."""
+        return (
+            f"endpoint={self.endpoint} queries={self.count} "
+            f"db_ms={self.seconds * 1000:.2f} max_repeats={self.max_repeats}"
+        )
+
+
+def query_budget(max_queries=None, max_repeats=None):
+    """Override the query budget of a view.
+
+    Apply it below ``route`` and ``login_required``, right on the view function.
+    """
+
+    def decorator(view):
+        view.query_budget = (max_queries, max_repeats)
+        return view
+
+    return decorator
+
+
+class QueryProfiler:
+    """Profile the queries of every request."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the request hooks."""
+        app.config.setdefault("QUERY_BUDGET", None)
+        app.config.setdefault("QUERY_REPEAT_LIMIT", None)
+        app.config.setdefault("QUERY_BUDGET_RAISE", False)
+        if not app.config.get("SQLALCHEMY_RECORD_QUERIES"):
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    @staticmethod
+    def _start():
+        """Remember where the queries of this request start.
+
+        Tests reuse one app context, and its recorded queries, for many requests.
+        """
+        g.query_profile_start = len(get_recorded_queries())
+
+    def _finish(self, response):
+        """Profile the request's queries, report them and enforce the budget."""
+        start = g.pop("query_profile_start", 0)
+        queries = get_recorded_queries()[start:]
+        profile = QueryProfile.from_queries(request.endpoint, queries)
+        g.query_profile = profile
+        response.headers.add("Server-Timing", profile.server_timing())
+        current_app.logger.info(f"Query profile: {profile.log_line()}")
+        self.check_budget(profile)
+        return response
+
+    @staticmethod
+    def budget(endpoint):
+        """Return the ``(max_queries, max_repeats)`` budget of an endpoint."""
+        config = current_app.config
+        max_queries, max_repeats = config["QUERY_BUDGET"], config["QUERY_REPEAT_LIMIT"]
+        view = current_app.view_functions.get(endpoint)
+        override_queries, override_repeats = getattr(view, "query_budget", (None, None))
+        if override_queries is not None:
+            max_queries = override_queries
+        if override_repeats is not None:
+            max_repeats = override_repeats
+        return max_queries, max_repeats
+
+    def check_budget(self, profile):
+        """Warn, or raise when configured to, about a request over budget."""
+        max_queries, max_repeats = self.budget(profile.endpoint)
+        problems = []
+        if max_queries is not None and profile.count > max_queries:
+            problems.append(f"{profile.count} queries, budget {max_queries}")
+        if max_repeats is not None and profile.max_repeats > max_repeats:
+            statement, count = max(profile.repeats.items(), key=lambda item: item[1])
+            problems.append(f"{count} runs of {statement!r}, limit {max_repeats}")
+        if not problems:
+            return
+        message = f"{profile.endpoint} over query budget: {'; '.join(problems)}"
+        if current_app.config["QUERY_BUDGET_RAISE"]:
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
@@ -2,6 +2,7 @@
 """Public section, including homepage and signup."""
 from flask import (
     Blueprint,
+    after_this_request,
     current_app,
     flash,
     redirect,
@@ -10,8 +11,9 @@ from flask import (
     url_for,
 )
 from flask_login import login_required, login_user, logout_user
+from sqlalchemy.exc import IntegrityError
 
-from app.extensions import login_manager
+from app.extensions import bcrypt, db, login_manager
 from app.public.forms import LoginForm
 from app.user.forms import RegisterForm
 from app.user.models import User
@@ -23,7 +25,7 @@ blueprint = Blueprint("public", __name__, static_folder="../static")
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by ID."""
-    return User.get_by_id(int(user_id))
+    return User.get_cached(user_id)
 
 
 @blueprint.route("/", methods=["GET", "POST"])
@@ -35,6 +37,8 @@ def home():
     if request.method == "POST":
         if form.validate_on_submit():
             login_user(form.user)
+            if bcrypt.needs_rehash(form.user.password):
+                _upgrade_password_after_request(form.user, form.password.data)
             flash("You are logged in.", "success")
             redirect_url = request.args.get("next") or url_for("user.members")
             return redirect(redirect_url)
@@ -43,6 +47,16 @@ def home():
     return render_template("public/home.html", form=form)
 
 
+def _upgrade_password_after_request(user, password):
+    """Re-hash a verified password with the configured cost once the view returns."""
+
+    @after_this_request
+    def upgrade(response):
+        user.upgrade_password(password)
+        db.session.commit()
+        return response
+
+
 @blueprint.route("/logout/")
 @login_required
 def logout():
@@ -57,14 +71,21 @@ def register():
     """Register new user."""
     form = RegisterForm(request.form)
     if form.validate_on_submit():
-        User.create(
-            username=form.username.data,
-            email=form.email.data,
-            password=form.password.data,
-            active=True,
-        )
-        flash("Thank you for registering. You can now log in.", "success")
-        return redirect(url_for("public.home"))
+        try:
+            User.create(
+                username=form.username.data,
+                email=form.email.data,
+                password=form.password.data,
+                active=True,
+            )
+        except IntegrityError:
+            # A concurrent sign-up took the username or email since validation.
+            db.session.rollback()
+            form.validate_unique()
+            flash_errors(form)
+        else:
+            flash("Thank you for registering. You can now log in.", "success")
+            return redirect(url_for("public.home"))
     else:
         flash_errors(form)
     return render_template("public/register.html", form=form)
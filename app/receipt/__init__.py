@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+"""The receipt module, including receipt models and the import pipeline."""
+from . import merchants, models, rollups, search, tasks  # noqa
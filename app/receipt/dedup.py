@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Duplicate receipt detection at import.
+
+Bank exports overlap and get uploaded again, and every duplicate receipt would
+be stored, indexed and aggregated twice. Each imported receipt therefore gets
+a fingerprint: a hash of its merchant, total, currency, purchase time rounded
+down to :data:`BUCKET_SECONDS` and its line items. A unique index on
+``(user_id, fingerprint)`` keeps a user from having the same receipt twice,
+and the importer inserts with ``ON CONFLICT DO NOTHING`` on it.
+
+To skip duplicates before they reach the database, each import run loads the
+user's fingerprints into a :class:`BloomFilter` once. Receipts the filter has
+never seen are certainly new; only those it may have seen are looked up, with
+one query per batch.
+"""
+import hashlib
+import math
+from datetime import timezone
+
+from sqlalchemy import func, select
+
+from app.database import DEFAULT_CHUNK_SIZE, db
+from app.utils import chunked
+
+from .models import Receipt
+
+#: Purchase times within the same bucket of this many seconds are the same.
+BUCKET_SECONDS = 60
+
+#: Receipts an import run is expected to add on top of the user's existing ones.
+RUN_CAPACITY = 100_000
+
+#: False positive rate of the filter at capacity.
+ERROR_RATE = 0.01
+
+_SEPARATOR = "\x1f"
+
+
+def _number(value):
+    """Format a decimal the same however many trailing zeros it was given with."""
+    return format(value.normalize(), "f")
+
+
+def fingerprint(receipt, items):
+    """Return the fingerprint of a normalized receipt and its line items.
+
+    Line items are hashed in sorted order, and their categories, which
+    exports disagree on, are left out.
+    """
+    purchased_at = receipt["purchased_at"].replace(tzinfo=timezone.utc)
+    lines = sorted(
+        _SEPARATOR.join(
+            (
+                item["description"].casefold(),
+                _number(item["quantity"]),
+                _number(item["amount"]),
+            )
+        )
+        for item in items
+    )
+    parts = (
+        receipt["merchant"].casefold(),
+        _number(receipt["total"]),
+        receipt.get("currency") or "",
+        str(int(purchased_at.timestamp()) // BUCKET_SECONDS),
+        hashlib.sha256("\n".join(lines).encode()).hexdigest(),
+    )
+    return hashlib.sha256(_SEPARATOR.join(parts).encode()).hexdigest()
+
+
+class BloomFilter:
+    """Set of strings answering "maybe present" or "certainly absent".
+
+    :param capacity: Number of items the filter is sized for.
+    :param error_rate: False positive rate once ``capacity`` items are added.
+    """
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        """Create instance."""
+        capacity = max(capacity, 1)
+        self.size = max(
+            64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        """Return the bit positions of ``key``, by double hashing one digest."""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Add ``key`` to the set."""
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        """Return False if ``key`` was certainly never added."""
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class Deduplicator:
+    """Drops the receipts of an import run that the user already has.
+
+    :param user_id: Owner of the imported receipts.
+    :param capacity: Receipts the run is expected to add.
+    """
+
+    def __init__(self, user_id, capacity=RUN_CAPACITY):
+        """Create instance, loading the user's fingerprints into the filter."""
+        self.user_id = user_id
+        owned = (Receipt.user_id == user_id, Receipt.fingerprint.is_not(None))
+        existing = db.session.scalar(select(func.count()).where(*owned))
+        self.bloom = BloomFilter(existing + capacity)
+        #: Fingerprints looked up in the database, a measure of the filter's use.
+        self.lookups = 0
+        for key in db.session.scalars(
+            select(Receipt.fingerprint)
+            .where(*owned)
+            .execution_options(yield_per=DEFAULT_CHUNK_SIZE)
+        ):
+            self.bloom.add(key)
+
+    def _stored(self, keys):
+        """Return which of ``keys`` the user has receipts with."""
+        self.lookups += len(keys)
+        stored = set()
+        for chunk in chunked(sorted(keys), DEFAULT_CHUNK_SIZE):
+            stored.update(
+                db.session.scalars(
+                    select(Receipt.fingerprint).where(
+                        Receipt.user_id == self.user_id,
+                        Receipt.fingerprint.in_(chunk),
+                    )
+                )
+            )
+        return stored
+
+    def filter(self, batch):
+        """Return the new receipts of a batch, each with its fingerprint set.
+
+        :param batch: ``(receipt, items)`` pairs of normalized column values.
+        """
+        batch = [
+            (dict(receipt, fingerprint=fingerprint(receipt, items)), items)
+            for receipt, items in batch
+        ]
+        maybe = {
+            receipt["fingerprint"]
+            for receipt, _ in batch
+            if receipt["fingerprint"] in self.bloom
+        }
+        seen = self._stored(maybe) if maybe else set()
+        fresh = []
+        for receipt, items in batch:
+            key = receipt["fingerprint"]
+            if key not in seen:
+                seen.add(key)
+                self.bloom.add(key)
+                fresh.append((receipt, items))
+        return fresh
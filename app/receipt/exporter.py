@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Streaming receipt export.
+
+The mirror image of :mod:`app.receipt.importer`: rows flow from a server-side
+cursor (``yield_per``) through a chain of generators -- read, encode,
+optionally gzip -- in chunks of about :data:`BUFFER_SIZE` bytes, so memory use
+stays flat however many years of history are exported.
+
+Three datasets can be exported, each as CSV or NDJSON:
+
+* ``receipts``, in the importer's formats: CSV with one line item per row and
+  the receipt columns repeated, NDJSON with one receipt per line and its line
+  items in an ``items`` list. Exports can be imported again.
+* ``categories`` and ``merchants``, the daily spend rollups.
+
+Rows come in the order of the indexes they are read from, ``purchased_at``
+then ``id`` for receipts and the primary key for the rollups, so exports of
+the same data are identical.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+from functools import partial
+from itertools import groupby
+
+from sqlalchemy import select
+
+from app.database import db
+
+from .importer import ITEM_FIELDS, RECEIPT_FIELDS
+from .models import DailyCategorySpend, DailyMerchantSpend, LineItem, Receipt
+
+#: Rows fetched from the database cursor at a time.
+YIELD_PER = 1000
+
+#: Bytes of encoded output collected before a chunk is yielded.
+BUFFER_SIZE = 64 * 1024
+
+FORMATS = ("csv", "ndjson")
+MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def read_receipts(user_id, start=None, end=None):
+    """Yield the receipts of a user purchased in ``[start, end)`` with their items."""
+    receipts, items = Receipt.__table__, LineItem.__table__
+    clauses = [receipts.c.user_id == user_id]
+    if start is not None:
+        clauses.append(receipts.c.purchased_at >= datetime.combine(start, time.min))
+    if end is not None:
+        clauses.append(receipts.c.purchased_at < datetime.combine(end, time.min))
+    rows = db.session.execute(
+        select(
+            receipts.c.id,
+            receipts.c.external_id,
+            receipts.c.merchant,
+            receipts.c.purchased_at,
+            receipts.c.total,
+            receipts.c.currency,
+            receipts.c.notes,
+            items.c.description,
+            items.c.category,
+            items.c.quantity,
+            items.c.amount,
+        )
+        .select_from(receipts.outerjoin(items, items.c.receipt_id == receipts.c.id))
+        .where(*clauses)
+        .order_by(receipts.c.purchased_at, receipts.c.id, items.c.id)
+        .execution_options(yield_per=YIELD_PER)
+    )
+    for _, group in groupby(rows, key=lambda row: row.id):
+        group = list(group)
+        first = group[0]
+        yield {
+            # Receipts entered by hand have no external id; their own id
+            # keeps their line items together in CSV.
+            "receipt_id": first.external_id or str(first.id),
+            "merchant": first.merchant,
+            "purchased_at": first.purchased_at,
+            "total": first.total,
+            "currency": first.currency,
+            "notes": first.notes,
+            "items": [
+                {field: getattr(row, field) for field in ITEM_FIELDS}
+                for row in group
+                if row.description is not None
+            ],
+        }
+
+
+def read_rollup(model, key, count, user_id, start=None, end=None):
+    """Yield the rollup rows of a user for days in ``[start, end)``, oldest first."""
+    table = model.__table__
+    clauses = [table.c.user_id == user_id]
+    if start is not None:
+        clauses.append(table.c.day >= start)
+    if end is not None:
+        clauses.append(table.c.day < end)
+    rows = db.session.execute(
+        select(table.c.day, table.c[key], table.c.amount, table.c[count])
+        .where(*clauses)
+        .order_by(table.c.day, table.c[key])
+        .execution_options(yield_per=YIELD_PER)
+    )
+    for row in rows:
+        yield row._asdict()
+
+
+#: CSV columns and reader of each dataset.
+DATASETS = {
+    "receipts": (RECEIPT_FIELDS + ITEM_FIELDS, read_receipts),
+    "categories": (
+        ("day", "category", "amount", "item_count"),
+        partial(read_rollup, DailyCategorySpend, "category", "item_count"),
+    ),
+    "merchants": (
+        ("day", "merchant", "amount", "receipt_count"),
+        partial(read_rollup, DailyMerchantSpend, "merchant", "receipt_count"),
+    ),
+}
+
+
+def _value(value):
+    """Return a column value in its export representation."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _drain(buffer, force=False):
+    """Return and clear the contents of ``buffer`` once it is full, or if forced."""
+    if not force and buffer.tell() < BUFFER_SIZE:
+        return b""
+    data = buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def encode_csv(fields, records):
+    """Yield CSV chunks of records, one row per line item of records that have them."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields, extrasaction="ignore")
+    writer.writeheader()
+    for record in records:
+        for item in record.get("items") or [{}]:
+            writer.writerow(
+                {key: _value(value) for key, value in {**record, **item}.items()}
+            )
+        data = _drain(buffer)
+        if data:
+            yield data
+    yield _drain(buffer, force=True)
+
+
+def encode_ndjson(fields, records):
+    """Yield NDJSON chunks of records, one per line."""
+    buffer = io.StringIO()
+    for record in records:
+        buffer.write(json.dumps(record, default=_value, separators=(",", ":")))
+        buffer.write("\n")
+        data = _drain(buffer)
+        if data:
+            yield data
+    yield _drain(buffer, force=True)
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson}
+
+
+def gzipped(chunks, level=6):
+    """Gzip a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(user_id, dataset="receipts", fmt="csv", start=None, end=None, gzip=False):
+    """Yield a user's ``dataset`` for ``[start, end)`` as chunks of ``fmt`` bytes.
+
+    Nothing is read until the first chunk is requested, and the database
+    cursor stays open until the last one is.
+    """
+    fields, read = DATASETS[dataset]
+    chunks = ENCODERS[fmt](fields, read(user_id, start, end))
+    return gzipped(chunks) if gzip else chunks
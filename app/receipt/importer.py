@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""Streaming receipt import pipeline.
+
+Records flow through a chain of generators -- read, normalize, batch, insert --
+so memory use is bounded by the batch size instead of the size of the file.
+
+Two input formats are understood:
+
+* CSV, one line item per row, with the receipt columns repeated on each row.
+  Consecutive rows sharing a ``receipt_id`` belong to the same receipt.
+* JSONL, one receipt per line with its line items in an ``items`` list.
+
+Receipts the user already has are skipped, see :mod:`app.receipt.dedup`.
+"""
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from itertools import groupby
+
+from flask import current_app
+
+from app.database import db
+from app.utils import chunked
+
+from .dedup import Deduplicator
+from .merchants import resolve_receipts
+from .models import LineItem, Receipt
+
+#: Receipts inserted (and committed) together.
+DEFAULT_BATCH_SIZE = 500
+
+RECEIPT_FIELDS = (
+    "receipt_id",
+    "merchant",
+    "purchased_at",
+    "total",
+    "currency",
+    "notes",
+)
+ITEM_FIELDS = ("description", "category", "quantity", "amount")
+
+CENTS = Decimal("0.01")
+
+
+class InvalidRecord(ValueError):
+    """Raised when an input record cannot be imported."""
+
+
+@dataclass
+class ImportStats:
+    """Counters collected while importing a file."""
+
+    path: str = ""
+    receipts: int = 0
+    line_items: int = 0
+    rejected: int = 0
+    duplicates: int = 0
+    elapsed: float = 0.0
+    error: str = ""
+
+    @property
+    def rows(self):
+        """Number of receipts and line items written."""
+        return self.receipts + self.line_items
+
+    @property
+    def rows_per_sec(self):
+        """Write throughput."""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @classmethod
+    def combine(cls, results, elapsed):
+        """Merge the stats of several files into one, timed by wall clock."""
+        total = cls(path=f"{len(results)} files", elapsed=elapsed)
+        for stats in results:
+            total.receipts += stats.receipts
+            total.line_items += stats.line_items
+            total.rejected += stats.rejected
+            total.duplicates += stats.duplicates
+        return total
+
+    def summary(self):
+        """Return a one-line human readable summary."""
+        if self.error:
+            return f"{self.path or '<stream>'}: FAILED {self.error}"
+        return (
+            f"{self.path or '<stream>'}: {self.receipts} receipts, "
+            f"{self.line_items} line items, {self.rejected} rejected, "
+            f"{self.duplicates} duplicates "
+            f"in {self.elapsed:.2f}s ({self.rows_per_sec:,.0f} rows/sec)"
+        )
+
+
+def read_csv(stream):
+    """Yield raw receipt records from a CSV stream of line item rows."""
+    rows = csv.DictReader(stream)
+    # Rows without a receipt_id are receipts of their own: a fresh object()
+    # never compares equal, so groupby starts a new group for each of them.
+    for _, group in groupby(rows, key=lambda row: row.get("receipt_id") or object()):
+        group = list(group)
+        record = {field: group[0].get(field) for field in RECEIPT_FIELDS}
+        record["items"] = [
+            {field: row.get(field) for field in ITEM_FIELDS}
+            for row in group
+            if row.get("description") or row.get("amount")
+        ]
+        yield record
+
+
+def read_jsonl(stream):
+    """Yield raw receipt records from a JSONL stream."""
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield InvalidRecord(f"line {number}: {error}")
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl, "ndjson": read_jsonl}
+
+#: App used by the current import worker process, see :func:`import_files`.
+_worker_app = None
+
+
+def detect_format(path):
+    """Guess the input format from the file extension."""
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    if extension not in READERS:
+        raise InvalidRecord(f"Cannot detect the format of {path!r}")
+    return extension
+
+
+def find_files(paths):
+    """Expand directories in ``paths`` into the export files they contain."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                candidate = os.path.join(path, name)
+                extension = os.path.splitext(name)[1].lstrip(".").lower()
+                if extension in READERS and os.path.isfile(candidate):
+                    yield candidate
+        else:
+            yield path
+
+
+def _text(value, max_length, required=False, field="value"):
+    """Collapse whitespace and truncate a text field."""
+    value = " ".join(str(value).split()) if value is not None else ""
+    if not value:
+        if required:
+            raise InvalidRecord(f"{field} is required")
+        return None
+    return value[:max_length]
+
+
+def _decimal(value, field, default=None):
+    """Parse a decimal field."""
+    if value is None or value == "":
+        if default is None:
+            raise InvalidRecord(f"{field} is required")
+        return default
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise InvalidRecord(f"{field} is not a number: {value!r}")
+    if not number.is_finite():
+        raise InvalidRecord(f"{field} is not a finite number: {value!r}")
+    return number
+
+
+def _timestamp(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime."""
+    if not value:
+        raise InvalidRecord("purchased_at is required")
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise InvalidRecord(f"purchased_at is not an ISO 8601 date: {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def normalize(record):
+    """Validate a raw record and return it as receipt and line item column values."""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise InvalidRecord(f"expected an object, got {type(record).__name__}")
+    raw_items = record.get("items") or []
+    if not isinstance(raw_items, list):
+        raise InvalidRecord(f"items is not a list: {raw_items!r}")
+    for item in raw_items:
+        if not isinstance(item, dict):
+            raise InvalidRecord(f"expected an item object, got {type(item).__name__}")
+    items = [
+        {
+            "description": _text(item.get("description"), 255, True, "description"),
+            "category": (_text(item.get("category"), 60) or "").lower() or None,
+            "quantity": _decimal(item.get("quantity"), "quantity", Decimal(1)),
+            "amount": _decimal(item.get("amount"), "amount").quantize(CENTS),
+        }
+        for item in raw_items
+    ]
+    total = _decimal(
+        record.get("total"),
+        "total",
+        sum((item["amount"] for item in items), Decimal(0)),
+    )
+    currency = _text(record.get("currency"), 3)
+    receipt = {
+        "external_id": _text(record.get("receipt_id"), 64),
+        "merchant": _text(record.get("merchant"), 120, True, "merchant"),
+        "purchased_at": _timestamp(record.get("purchased_at")),
+        "total": total.quantize(CENTS),
+        "currency": currency.upper() if currency else None,
+        "notes": _text(record.get("notes"), 10000),
+    }
+    return receipt, items
+
+
+def normalize_records(records, stats):
+    """Yield normalized records, counting and logging the rejected ones."""
+    for record in records:
+        try:
+            yield normalize(record)
+        except InvalidRecord as error:
+            stats.rejected += 1
+            current_app.logger.warning(f"Skipping receipt record: {error}")
+
+
+def insert_batch(batch, user_id, deduplicator):
+    """Insert a batch of normalized receipts with their line items in one transaction.
+
+    Duplicates are dropped first: those ``deduplicator`` knows of, then those
+    another import inserted meanwhile, by the unique fingerprint index.
+    Merchants are resolved to their canonical names the whole batch at once.
+    """
+    batch = deduplicator.filter(batch)
+    receipts = resolve_receipts(
+        [dict(receipt, user_id=user_id) for receipt, _ in batch]
+    )
+    rows = Receipt.bulk_create(
+        receipts,
+        commit=False,
+        returning=(Receipt.id, Receipt.fingerprint),
+        ignore_conflicts=("user_id", "fingerprint"),
+    )
+    ids = {row.fingerprint: row.id for row in rows}
+    line_items = [
+        dict(item, receipt_id=ids[receipt["fingerprint"]])
+        for receipt, items in batch
+        if receipt["fingerprint"] in ids
+        for item in items
+    ]
+    LineItem.bulk_create(line_items, commit=False)
+    db.session.commit()
+    return len(rows), len(line_items)
+
+
+def import_stream(stream, user_id, fmt, batch_size=DEFAULT_BATCH_SIZE, stats=None):
+    """Import receipts for ``user_id`` from a text stream in format ``fmt``."""
+    stats = stats or ImportStats()
+    started = time.perf_counter()
+    records = normalize_records(READERS[fmt](stream), stats)
+    deduplicator = Deduplicator(user_id)
+    for batch in chunked(records, batch_size):
+        receipts, line_items = insert_batch(batch, user_id, deduplicator)
+        stats.duplicates += len(batch) - receipts
+        stats.receipts += receipts
+        stats.line_items += line_items
+    stats.elapsed += time.perf_counter() - started
+    return stats
+
+
+def import_file(path, user_id, fmt=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Import receipts for ``user_id`` from the file at ``path``."""
+    fmt = fmt or detect_format(path)
+    with open(path, newline="", encoding="utf-8-sig") as stream:
+        return import_stream(
+            stream, user_id, fmt, batch_size, stats=ImportStats(path=path)
+        )
+
+
+def import_files(paths, user_id, fmt=None, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+    """Import many files, yielding the stats of each file as it completes.
+
+    With more than one worker the files are spread over a process pool, largest
+    first. Workers are spawned rather than forked and each one builds its own app
+    with :func:`~app.app.create_app`, so no database connection or pool is ever
+    shared between processes.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield _import_or_report(path, user_id, fmt, batch_size)
+        return
+
+    config_object = current_app.config.get("CONFIG_OBJECT")
+    if not isinstance(config_object, str):
+        config_object = "app.settings"
+    config = {"SQLALCHEMY_DATABASE_URI": current_app.config["SQLALCHEMY_DATABASE_URI"]}
+    paths = sorted(paths, key=os.path.getsize, reverse=True)
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(paths)) or 1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(config_object, config),
+    ) as pool:
+        futures = [
+            pool.submit(_import_worker, path, user_id, fmt, batch_size)
+            for path in paths
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _init_worker(config_object, config):
+    """Create the app of an import worker process."""
+    global _worker_app
+    from app.app import create_app
+
+    _worker_app = create_app(config_object, config)
+
+
+def _import_or_report(path, user_id, fmt, batch_size):
+    """Import one file, returning the error in its stats instead of raising it."""
+    try:
+        return import_file(path, user_id, fmt, batch_size)
+    except Exception as error:  # noqa: B902
+        db.session.rollback()
+        return ImportStats(path=path, error=f"{type(error).__name__}: {error}")
+
+
+def _import_worker(path, user_id, fmt, batch_size):
+    """Import one file inside a worker process."""
+    with _worker_app.app_context():
+        return _import_or_report(path, user_id, fmt, batch_size)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""Merchant name resolution.
+
+Receipts spell the same merchant many ways -- ``"STARBUCKS #1234 PRAGUE"``,
+``"Starbucks Coffee"`` -- and analytics need one name for all of them. The
+``merchants`` dictionary lists canonical names, and ``merchant_aliases`` other
+spellings of them.
+
+Each worker loads the dictionary into a :class:`MerchantIndex` once, so
+resolving a receipt never queries the database. Names are first reduced to a
+key of lowercase words without numbers or punctuation. A trie over the words
+of the keys then finds the longest name or alias the key starts with, so
+store numbers and locations after the name do not matter. Keys the trie does
+not know are matched against a BK-tree by edit distance, which catches typos.
+
+Commits changing the dictionary store a new version in the ``cache``
+extension; workers notice within ``CACHE_SYNC_INTERVAL`` and reload.
+"""
+import re
+import uuid
+from itertools import chain
+
+from flask import current_app
+from sqlalchemy import event, func, select
+
+from app.database import DEFAULT_CHUNK_SIZE, db
+from app.extensions import cache
+
+from .models import Merchant, MerchantAlias, Receipt
+
+#: Cache key of the dictionary version the indexes are built from.
+VERSION_KEY = "merchants:version"
+
+#: Most words of a merchant string looked at.
+MAX_WORDS = 6
+
+_NOISE = re.compile(r"\d+|[^\w\s]|_")
+_CHANGED = "merchant_dictionary_changed"
+
+
+def normalize_key(name):
+    """Return the lookup key of a merchant name: lowercase words only."""
+    return " ".join(_NOISE.sub(" ", name.lower()).split()[:MAX_WORDS])
+
+
+def max_distance(key):
+    """Return the most typos a key of this length may contain and still match."""
+    if len(key) < 5:
+        return 0
+    return 1 if len(key) < 9 else 2
+
+
+def edit_distance(a, b):
+    """Return the Levenshtein distance between ``a`` and ``b``."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+class WordTrie:
+    """Trie over the words of keys, finding the longest key a string starts with."""
+
+    def __init__(self):
+        """Create instance."""
+        self.root = {}
+
+    def insert(self, key, value):
+        """Map ``key`` to ``value``."""
+        node = self.root
+        for word in key.split():
+            node = node.setdefault(word, {})
+        node[None] = value
+
+    def longest_prefix(self, key):
+        """Return the value of the longest key ``key`` starts with, or None."""
+        node, found = self.root, None
+        for word in key.split():
+            node = node.get(word)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+
+class BKTree:
+    """Burkhard-Keller tree finding the nearest key by edit distance."""
+
+    def __init__(self):
+        """Create instance."""
+        self.root = None
+
+    def insert(self, key, value):
+        """Map ``key`` to ``value``."""
+        if self.root is None:
+            self.root = (key, value, {})
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(key, node[0])
+            if distance == 0:
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, value, {})
+                return
+            node = child
+
+    def nearest(self, key, limit):
+        """Return the value of the nearest key at most ``limit`` away, or None.
+
+        Ties go to the alphabetically first key, so results are stable.
+        """
+        if self.root is None:
+            return None
+        best = (limit + 1, "", None)
+        stack = [self.root]
+        while stack:
+            node_key, value, children = stack.pop()
+            distance = edit_distance(key, node_key)
+            if (distance, node_key) < best[:2]:
+                best = (distance, node_key, value)
+            # Keys within best[0] of ``key`` sit within that of this distance.
+            stack.extend(
+                child
+                for edge, child in children.items()
+                if distance - best[0] <= edge <= distance + best[0]
+            )
+        return best[2] if best[0] <= limit else None
+
+
+class MerchantIndex:
+    """In-memory index of the merchant dictionary.
+
+    :param entries: ``(name or alias, merchant_id, canonical name)`` tuples.
+    :param version: Dictionary version the entries were loaded at.
+    """
+
+    def __init__(self, entries, version=None):
+        """Create instance."""
+        self.version = version
+        self.trie = WordTrie()
+        self.tree = BKTree()
+        self.size = 0
+        for spelling, merchant_id, name in entries:
+            key = normalize_key(spelling)
+            if key:
+                self.trie.insert(key, (merchant_id, name))
+                self.tree.insert(key, (merchant_id, name))
+                self.size += 1
+
+    def resolve(self, raw):
+        """Return the ``(merchant_id, name)`` of a raw merchant string, or None."""
+        key = normalize_key(raw)
+        if not key:
+            return None
+        found = self.trie.longest_prefix(key)
+        if found is not None:
+            return found
+        # Typos: try the whole key, then ever fewer of its leading words.
+        words = key.split()
+        for count in range(len(words), 0, -1):
+            candidate = " ".join(words[:count])
+            found = self.tree.nearest(candidate, max_distance(candidate))
+            if found is not None:
+                return found
+        return None
+
+    def resolve_many(self, raws):
+        """Return a dict of each distinct raw merchant string to its resolution."""
+        resolved = {}
+        for raw in raws:
+            if raw not in resolved:
+                resolved[raw] = self.resolve(raw)
+        return resolved
+
+
+def load_index(version=None):
+    """Load the merchant dictionary into a :class:`MerchantIndex`."""
+    names = (
+        (name, merchant_id, name)
+        for merchant_id, name in db.session.execute(select(Merchant.id, Merchant.name))
+    )
+    aliases = db.session.execute(
+        select(MerchantAlias.alias, Merchant.id, Merchant.name).join(
+            Merchant, MerchantAlias.merchant_id == Merchant.id
+        )
+    )
+    return MerchantIndex(chain(names, aliases), version)
+
+
+def get_index():
+    """Return the app's merchant index, reloading it if the dictionary changed."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Lost or never set; whichever worker stores one first wins.
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=0)
+        version = cache.get(VERSION_KEY)
+    index = current_app.extensions.get("merchant_index")
+    if index is None or index.version != version:
+        index = load_index(version)
+        current_app.extensions["merchant_index"] = index
+    return index
+
+
+def resolve_receipts(receipts):
+    """Set the canonical merchant of receipt column value dicts, in place.
+
+    ``merchant`` is replaced by the canonical name of the merchant it resolves
+    to, with the original kept in ``raw_merchant``.
+    """
+    resolved = get_index().resolve_many(receipt["merchant"] for receipt in receipts)
+    for receipt in receipts:
+        raw = receipt["merchant"]
+        merchant_id, name = resolved[raw] or (None, raw)
+        receipt.update(merchant=name, merchant_id=merchant_id, raw_merchant=raw)
+    return receipts
+
+
+def apply(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Resolve the merchants of stored receipts again, e.g. after adding aliases.
+
+    Receipts are walked in id order, one chunk per transaction. Returns the
+    number of receipts whose merchant changed.
+    """
+    index = get_index()
+    raw = func.coalesce(Receipt.raw_merchant, Receipt.merchant)
+    changed, last_id = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(Receipt.id, raw, Receipt.merchant, Receipt.merchant_id)
+            .where(Receipt.id > last_id)
+            .order_by(Receipt.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return changed
+        last_id = rows[-1][0]
+        changes = []
+        for receipt_id, raw_merchant, *current in rows:
+            resolved_id, name = index.resolve(raw_merchant) or (None, raw_merchant)
+            if [name, resolved_id] != current:
+                changes.append(
+                    {
+                        "id": receipt_id,
+                        "merchant": name,
+                        "merchant_id": resolved_id,
+                        "raw_merchant": raw_merchant,
+                    }
+                )
+        changed += Receipt.bulk_update(changes, chunk_size=chunk_size)
+
+
+def mark_changed(session=None):
+    """Publish a new dictionary version when the transaction commits."""
+    session = session or db.session
+    session.info[_CHANGED] = True
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_changes(session, flush_context):
+    """Notice ORM writes to the dictionary."""
+    if any(
+        isinstance(obj, (Merchant, MerchantAlias))
+        for obj in chain(session.new, session.dirty, session.deleted)
+    ):
+        mark_changed(session)
+
+
+@event.listens_for(db.session, "after_commit")
+def _publish_changes(session):
+    """Have every worker reload its index."""
+    if session.info.pop(_CHANGED, False):
+        cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=0)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_changes(session):
+    """Keep the version of a rolled back transaction."""
+    session.info.pop(_CHANGED, None)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Receipt models."""
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Model, TableModel, db, reference_col, relationship
+
+#: Rollup key of line items without a category.
+UNCATEGORIZED = "uncategorized"
+
+
+class Receipt(TableModel):
+    """A purchase receipt owned by a user."""
+
+    __tablename__ = "receipts"
+    __table_args__ = (
+        db.Index("ix_receipts_user_id_purchased_at", "user_id", "purchased_at"),
+        db.Index("ix_receipts_user_id_created_at_id", "user_id", "created_at", "id"),
+        db.Index("ix_receipts_created_at", "created_at"),
+        db.Index(
+            "ix_receipts_user_id_fingerprint", "user_id", "fingerprint", unique=True
+        ),
+    )
+    # Rollups need the previous owner and day of a moved receipt, so changing
+    # these loads their old value (active_history) even when expired.
+    user_id: Mapped[int] = reference_col(
+        "users", column_kwargs={"active_history": True}
+    )
+    user = relationship("User", backref="receipts")
+    external_id: Mapped[Optional[str]] = mapped_column(
+        db.String(64), nullable=True, index=True
+    )
+    merchant: Mapped[str] = mapped_column(db.String(120), nullable=False)
+    # Set on import when the merchant resolves to a dictionary entry, in which
+    # case ``merchant`` holds its canonical name and ``raw_merchant`` the input.
+    merchant_id: Mapped[Optional[int]] = reference_col(
+        "merchants",
+        nullable=True,
+        foreign_key_kwargs={"ondelete": "SET NULL"},
+        column_kwargs={"index": True},
+    )
+    raw_merchant: Mapped[Optional[str]] = mapped_column(db.String(120), nullable=True)
+    purchased_at: Mapped[datetime] = mapped_column(nullable=False, active_history=True)
+    total: Mapped[Decimal] = mapped_column(db.Numeric(12, 2), nullable=False)
+    currency: Mapped[Optional[str]] = mapped_column(db.String(3), nullable=True)
+    notes: Mapped[Optional[str]] = mapped_column(db.Text, nullable=True)
+    # Set on import, see :mod:`app.receipt.dedup`; receipts entered by hand
+    # have none and are never considered duplicates.
+    fingerprint: Mapped[Optional[str]] = mapped_column(db.String(64), nullable=True)
+    line_items = relationship(
+        "LineItem", back_populates="receipt", cascade="all, delete-orphan"
+    )
+
+    @classmethod
+    def _bulk_written(cls, rows):
+        """Mark the rollup days and search documents of bulk written receipts as stale."""
+        from . import search
+        from .rollups import mark_receipts_stale, mark_stale
+
+        mark_stale(
+            (row["user_id"], row["purchased_at"])
+            for row in rows
+            if "user_id" in row and "purchased_at" in row
+        )
+        mark_receipts_stale(
+            row["id"] for row in rows if "id" in row and "purchased_at" not in row
+        )
+        search.mark_stale(row["id"] for row in rows if "id" in row)
+        search.mark_users_stale(
+            row["user_id"] for row in rows if "id" not in row and "user_id" in row
+        )
+
+    @classmethod
+    def _bulk_upserting(cls, rows, index_elements):
+        """Mark the rollup days and search documents of receipts about to be overwritten."""
+        from . import search
+        from .rollups import mark_receipts_stale
+
+        ids = db.session.scalars(
+            db.select(cls.id).where(cls._bulk_conflicts(rows, index_elements))
+        ).all()
+        mark_receipts_stale(ids)
+        search.mark_stale(ids)
+
+    @classmethod
+    def _bulk_deleting(cls, ids):
+        """Mark the rollup days and search documents of receipts about to be deleted."""
+        from . import search
+        from .rollups import mark_receipts_stale
+
+        mark_receipts_stale(ids)
+        search.mark_stale(ids)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Receipt({self.merchant!r}, {self.purchased_at:%Y-%m-%d})>"
+
+
+class Merchant(TableModel):
+    """A canonical merchant that raw merchant strings resolve to.
+
+    See :mod:`app.receipt.merchants` for how names and aliases are matched.
+    """
+
+    __tablename__ = "merchants"
+    name: Mapped[str] = mapped_column(db.String(120), unique=True, nullable=False)
+    aliases = relationship(
+        "MerchantAlias", back_populates="merchant", cascade="all, delete-orphan"
+    )
+
+    @classmethod
+    def _bulk_written(cls, rows):
+        """Refresh the merchant indexes of all workers on commit."""
+        from .merchants import mark_changed
+
+        mark_changed()
+
+    @classmethod
+    def _bulk_deleting(cls, ids):
+        """Refresh the merchant indexes of all workers on commit."""
+        from .merchants import mark_changed
+
+        mark_changed()
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Merchant({self.name!r})>"
+
+
+class MerchantAlias(TableModel):
+    """Another spelling of a merchant's name, e.g. ``"sbux"`` for Starbucks."""
+
+    __tablename__ = "merchant_aliases"
+    merchant_id: Mapped[int] = reference_col(
+        "merchants",
+        foreign_key_kwargs={"ondelete": "CASCADE"},
+        column_kwargs={"index": True},
+    )
+    merchant = relationship("Merchant", back_populates="aliases")
+    alias: Mapped[str] = mapped_column(db.String(120), unique=True, nullable=False)
+
+    @classmethod
+    def _bulk_written(cls, rows):
+        """Refresh the merchant indexes of all workers on commit."""
+        from .merchants import mark_changed
+
+        mark_changed()
+
+    @classmethod
+    def _bulk_deleting(cls, ids):
+        """Refresh the merchant indexes of all workers on commit."""
+        from .merchants import mark_changed
+
+        mark_changed()
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<MerchantAlias({self.alias!r})>"
+
+
+class LineItem(TableModel):
+    """A single line of a receipt."""
+
+    __tablename__ = "line_items"
+    __table_args__ = (db.Index("ix_line_items_created_at", "created_at"),)
+    receipt_id: Mapped[int] = reference_col(
+        "receipts",
+        foreign_key_kwargs={"ondelete": "CASCADE"},
+        column_kwargs={"index": True, "active_history": True},
+    )
+    receipt = relationship("Receipt", back_populates="line_items")
+    description: Mapped[str] = mapped_column(db.String(255), nullable=False)
+    category: Mapped[Optional[str]] = mapped_column(db.String(60), nullable=True)
+    quantity: Mapped[Decimal] = mapped_column(
+        db.Numeric(10, 3), nullable=False, default=1
+    )
+    amount: Mapped[Decimal] = mapped_column(db.Numeric(12, 2), nullable=False)
+
+    @classmethod
+    def _bulk_written(cls, rows):
+        """Mark the rollup days and search documents of the items' receipts as stale."""
+        from . import search
+        from .rollups import mark_receipts_stale
+
+        receipt_ids = {row["receipt_id"] for row in rows if "receipt_id" in row}
+        mark_receipts_stale(receipt_ids)
+        search.mark_stale(receipt_ids)
+
+    @classmethod
+    def _bulk_upserting(cls, rows, index_elements):
+        """Mark the rollup days and search documents of the receipts items leave."""
+        from . import search
+        from .rollups import mark_receipts_stale
+
+        receipt_ids = db.session.scalars(
+            db.select(cls.receipt_id)
+            .where(cls._bulk_conflicts(rows, index_elements))
+            .distinct()
+        ).all()
+        mark_receipts_stale(receipt_ids)
+        search.mark_stale(receipt_ids)
+
+    @classmethod
+    def _bulk_deleting(cls, ids):
+        """Mark the rollup days and search documents of the deleted items' receipts."""
+        from . import search
+        from .rollups import mark_receipts_stale
+
+        receipt_ids = db.session.scalars(
+            db.select(cls.receipt_id).where(cls.id.in_(ids)).distinct()
+        ).all()
+        mark_receipts_stale(receipt_ids)
+        search.mark_stale(receipt_ids)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<LineItem({self.description!r})>"
+
+
+class DailyCategorySpend(Model):
+    """Line item spend of a user per day and category.
+
+    Maintained by :mod:`app.receipt.rollups`; never write to it directly.
+    """
+
+    __tablename__ = "daily_category_spend"
+    user_id: Mapped[int] = reference_col("users", column_kwargs={"primary_key": True})
+    day: Mapped[date] = mapped_column(primary_key=True)
+    category: Mapped[str] = mapped_column(db.String(60), primary_key=True)
+    amount: Mapped[Decimal] = mapped_column(db.Numeric(14, 2), nullable=False)
+    item_count: Mapped[int] = mapped_column(nullable=False)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<DailyCategorySpend({self.day}, {self.category!r})>"
+
+
+class DailyMerchantSpend(Model):
+    """Receipt totals of a user per day and merchant.
+
+    Maintained by :mod:`app.receipt.rollups`; never write to it directly.
+    """
+
+    __tablename__ = "daily_merchant_spend"
+    user_id: Mapped[int] = reference_col("users", column_kwargs={"primary_key": True})
+    day: Mapped[date] = mapped_column(primary_key=True)
+    merchant: Mapped[str] = mapped_column(db.String(120), primary_key=True)
+    amount: Mapped[Decimal] = mapped_column(db.Numeric(14, 2), nullable=False)
+    receipt_count: Mapped[int] = mapped_column(nullable=False)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<DailyMerchantSpend({self.day}, {self.merchant!r})>"
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Daily spend rollups.
+
+``daily_category_spend`` and ``daily_merchant_spend`` hold per user and day
+aggregates, so dashboards read O(days) rows instead of scanning line items.
+
+Writes never patch the aggregates with deltas. Every write marks the
+``(user_id, day)`` pairs it touches as stale -- ORM flushes through the
+``after_flush`` session event, the bulk helpers through
+``CRUDMixin._bulk_written``/``_bulk_deleting`` -- and right before the
+transaction commits the stale days are recomputed from the raw rows.
+
+On PostgreSQL the recompute holds a transaction-scoped advisory lock per user,
+so concurrent workers writing receipts of the same user serialize, and the one
+committing last always recomputes over every committed row. Every refresh also
+holds a shared lock on the whole namespace, which a full :func:`rebuild` takes
+exclusively. SQLite serializes writers on its own.
+"""
+from datetime import datetime, timedelta
+from itertools import chain, groupby
+
+from sqlalchemy import event, func, inspect, select, text
+
+from app.database import db
+
+from .models import (
+    UNCATEGORIZED,
+    DailyCategorySpend,
+    DailyMerchantSpend,
+    LineItem,
+    Receipt,
+)
+
+#: First argument of ``pg_advisory_xact_lock`` for rollup locks, "ROLL".
+LOCK_NAMESPACE = 0x524F4C4C
+
+#: Second argument of the lock over all users; no user has this id.
+ALL_USERS = 0
+
+#: Receipt and line item attributes the rollups depend on.
+RECEIPT_FIELDS = ("user_id", "purchased_at", "merchant", "total")
+LINE_ITEM_FIELDS = ("receipt_id", "category", "amount")
+
+_STALE_DAYS = "stale_rollup_days"
+
+
+def _day(value):
+    """Return the date of a datetime, or ``value`` if it already is one."""
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _midnight(day):
+    """Return the datetime starting ``day``."""
+    return datetime.combine(day, datetime.min.time())
+
+
+def mark_stale(keys, session=None):
+    """Mark ``(user_id, day)`` pairs to be recomputed when the transaction commits."""
+    session = session or db.session
+    stale = session.info.setdefault(_STALE_DAYS, set())
+    stale.update((user_id, _day(day)) for user_id, day in keys)
+
+
+def mark_receipts_stale(receipt_ids, session=None):
+    """Mark the days of the given receipts to be recomputed on commit."""
+    receipt_ids = list(receipt_ids)
+    if not receipt_ids:
+        return
+    session = session or db.session
+    receipts = Receipt.__table__
+    rows = session.connection().execute(
+        select(receipts.c.user_id, receipts.c.purchased_at).where(
+            receipts.c.id.in_(receipt_ids)
+        )
+    )
+    mark_stale(rows, session)
+
+
+def _day_ranges(days):
+    """Merge sorted days into half-open ``[start, end)`` runs of consecutive days."""
+    days = sorted(set(days))
+    start = previous = None
+    for day in days:
+        if previous is not None and day != previous + timedelta(days=1):
+            yield start, previous + timedelta(days=1)
+            start = None
+        start = start or day
+        previous = day
+    if start is not None:
+        yield start, previous + timedelta(days=1)
+
+
+def _receipt_filter(user_id=None, start=None, end=None):
+    """Return the clauses selecting receipts of a user and date range."""
+    receipts = Receipt.__table__
+    clauses = []
+    if user_id is not None:
+        clauses.append(receipts.c.user_id == user_id)
+    if start is not None:
+        clauses.append(receipts.c.purchased_at >= _midnight(start))
+    if end is not None:
+        clauses.append(receipts.c.purchased_at < _midnight(end))
+    return clauses
+
+
+def _category_query(*clauses):
+    """Aggregate line items per user, day and category."""
+    receipts, items = Receipt.__table__, LineItem.__table__
+    day = func.date(receipts.c.purchased_at)
+    category = func.coalesce(items.c.category, UNCATEGORIZED)
+    return (
+        select(
+            receipts.c.user_id,
+            day,
+            category,
+            func.sum(items.c.amount),
+            func.count(items.c.id),
+        )
+        .select_from(items.join(receipts, items.c.receipt_id == receipts.c.id))
+        .where(*clauses)
+        .group_by(receipts.c.user_id, day, category)
+    )
+
+
+def _merchant_query(*clauses):
+    """Aggregate receipt totals per user, day and merchant."""
+    receipts = Receipt.__table__
+    day = func.date(receipts.c.purchased_at)
+    return (
+        select(
+            receipts.c.user_id,
+            day,
+            receipts.c.merchant,
+            func.sum(receipts.c.total),
+            func.count(receipts.c.id),
+        )
+        .where(*clauses)
+        .group_by(receipts.c.user_id, day, receipts.c.merchant)
+    )
+
+
+def _recompute(connection, user_id=None, start=None, end=None):
+    """Replace the rollups of a user and date range with freshly aggregated rows."""
+    clauses = _receipt_filter(user_id, start, end)
+    for model, query, key, count in (
+        (DailyCategorySpend, _category_query, "category", "item_count"),
+        (DailyMerchantSpend, _merchant_query, "merchant", "receipt_count"),
+    ):
+        table = model.__table__
+        stale = table.delete()
+        if user_id is not None:
+            stale = stale.where(table.c.user_id == user_id)
+        if start is not None:
+            stale = stale.where(table.c.day >= start, table.c.day < end)
+        connection.execute(stale)
+        connection.execute(
+            table.insert().from_select(
+                ["user_id", "day", key, "amount", count], query(*clauses)
+            )
+        )
+
+
+def _lock(connection, key, shared=False):
+    """Take a rollup advisory lock until the transaction ends."""
+    if connection.dialect.name == "postgresql":
+        function = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+        connection.execute(
+            text(f"SELECT {function}(:namespace, :key)"),
+            {"namespace": LOCK_NAMESPACE, "key": key},
+        )
+
+
+def _lock_user(connection, user_id):
+    """Serialize rollup maintenance of ``user_id`` until the transaction ends.
+
+    The lock over all users is taken first, shared, so a full rebuild waits
+    for per-user work and the other way round.
+    """
+    _lock(connection, ALL_USERS, shared=True)
+    _lock(connection, user_id)
+
+
+def refresh(connection, keys):
+    """Recompute the rollups of the given ``(user_id, day)`` pairs."""
+    # Users are locked in a stable order so concurrent refreshes cannot deadlock.
+    for user_id, user_keys in groupby(sorted(set(keys)), key=lambda key: key[0]):
+        _lock_user(connection, user_id)
+        for start, end in _day_ranges(day for _, day in user_keys):
+            _recompute(connection, user_id, start, end)
+
+
+def rebuild(user_id=None):
+    """Recompute all rollups, or those of one user, from scratch."""
+    connection = db.session.connection()
+    if user_id is None:
+        _lock(connection, ALL_USERS)
+    else:
+        _lock_user(connection, user_id)
+    _recompute(connection, user_id)
+    db.session.commit()
+
+
+def daily_totals(user_id, start, end):
+    """Return ``(day, amount)`` rows of a user's spend per day in ``[start, end)``."""
+    return db.session.execute(
+        select(DailyCategorySpend.day, func.sum(DailyCategorySpend.amount))
+        .where(
+            DailyCategorySpend.user_id == user_id,
+            DailyCategorySpend.day >= start,
+            DailyCategorySpend.day < end,
+        )
+        .group_by(DailyCategorySpend.day)
+        .order_by(DailyCategorySpend.day)
+    ).all()
+
+
+def category_totals(user_id, start, end):
+    """Return ``(category, amount, item_count)`` rows of a user in ``[start, end)``."""
+    amount = func.sum(DailyCategorySpend.amount)
+    return db.session.execute(
+        select(
+            DailyCategorySpend.category, amount, func.sum(DailyCategorySpend.item_count)
+        )
+        .where(
+            DailyCategorySpend.user_id == user_id,
+            DailyCategorySpend.day >= start,
+            DailyCategorySpend.day < end,
+        )
+        .group_by(DailyCategorySpend.category)
+        .order_by(amount.desc())
+    ).all()
+
+
+def merchant_totals(user_id, start, end, limit=10):
+    """Return the top ``(merchant, amount, receipt_count)`` rows of a user in ``[start, end)``."""
+    amount = func.sum(DailyMerchantSpend.amount)
+    return db.session.execute(
+        select(
+            DailyMerchantSpend.merchant,
+            amount,
+            func.sum(DailyMerchantSpend.receipt_count),
+        )
+        .where(
+            DailyMerchantSpend.user_id == user_id,
+            DailyMerchantSpend.day >= start,
+            DailyMerchantSpend.day < end,
+        )
+        .group_by(DailyMerchantSpend.merchant)
+        .order_by(amount.desc())
+        .limit(limit)
+    ).all()
+
+
+def _previous_keys(receipt):
+    """Return the ``(user_id, day)`` pairs a modified receipt belonged to before."""
+    attrs = inspect(receipt).attrs
+    user_ids = attrs.user_id.history.deleted or [receipt.user_id]
+    timestamps = attrs.purchased_at.history.deleted or [receipt.purchased_at]
+    return [(user_id, timestamp) for user_id in user_ids for timestamp in timestamps]
+
+
+def _is_modified(obj, fields):
+    """Return whether any of ``fields`` of a dirty object changed."""
+    attrs = inspect(obj).attrs
+    return any(attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_stale_days(session, flush_context):
+    """Mark the days touched by ORM changes as stale."""
+    keys, receipt_ids = [], set()
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, Receipt):
+            keys.append((obj.user_id, obj.purchased_at))
+        elif isinstance(obj, LineItem):
+            receipt_ids.add(obj.receipt_id)
+    for obj in session.dirty:
+        if isinstance(obj, Receipt) and _is_modified(obj, RECEIPT_FIELDS):
+            keys.append((obj.user_id, obj.purchased_at))
+            keys.extend(_previous_keys(obj))
+        elif isinstance(obj, LineItem) and _is_modified(obj, LINE_ITEM_FIELDS):
+            receipt_ids.add(obj.receipt_id)
+            receipt_ids.update(inspect(obj).attrs.receipt_id.history.deleted)
+    if keys:
+        mark_stale(keys, session)
+    mark_receipts_stale(receipt_ids - {None}, session)
+
+
+@event.listens_for(db.session, "before_commit")
+def _refresh_stale_days(session):
+    """Recompute the stale days inside the committing transaction."""
+    session.flush()
+    stale = session.info.pop(_STALE_DAYS, None)
+    if stale:
+        refresh(session.connection(), stale)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_stale_days(session):
+    """Drop the stale days of a rolled back transaction."""
+    session.info.pop(_STALE_DAYS, None)
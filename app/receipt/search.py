@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""Full-text search of receipts.
+
+``receipt_search`` holds one document per receipt: its merchant, the
+descriptions of its line items and its notes. On PostgreSQL the document is a
+weighted ``tsvector`` behind a GIN index; on SQLite it is an FTS5 table. The
+table is created by ``db.create_all()`` and the migrations.
+
+The index is maintained like the rollups: ORM flushes mark the receipts they
+touch through the ``after_flush`` session event, the bulk helpers through
+``CRUDMixin._bulk_written``/``_bulk_upserting``/``_bulk_deleting``, and right
+before the transaction commits the marked receipts are reindexed from the raw
+rows. Receipts bulk inserted without their ids are found by owner instead.
+
+:func:`search` matches any of the words of a query, each as a prefix, ranks
+the receipts by relevance and pages through them on ``(score, id)``.
+"""
+import re
+from itertools import chain
+
+from sqlalchemy import (
+    DDL,
+    bindparam,
+    column,
+    event,
+    func,
+    inspect,
+    literal_column,
+    select,
+    table,
+    text,
+    tuple_,
+)
+
+from app.database import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidCursor,
+    Page,
+    db,
+    decode_cursor,
+    encode_cursor,
+)
+from app.utils import chunked
+
+from .models import LineItem, Receipt
+
+#: Receipt and line item attributes the search documents depend on.
+RECEIPT_FIELDS = ("user_id", "merchant", "notes")
+LINE_ITEM_FIELDS = ("receipt_id", "description")
+
+#: Most words of a query that are searched for.
+MAX_TERMS = 8
+
+#: PostgreSQL text search configuration of the documents and queries.
+TEXT_SEARCH_CONFIG = "english"
+
+_WORDS = re.compile(r"[^\W_]+")
+_STALE_RECEIPTS = "stale_search_receipts"
+_STALE_USERS = "stale_search_users"
+
+_SCHEMA = {
+    "postgresql": (
+        "CREATE TABLE IF NOT EXISTS receipt_search ("
+        "receipt_id INTEGER PRIMARY KEY REFERENCES receipts (id) ON DELETE CASCADE, "
+        "user_id INTEGER NOT NULL, "
+        "document TSVECTOR NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS ix_receipt_search_document "
+        "ON receipt_search USING GIN (document)",
+        "CREATE INDEX IF NOT EXISTS ix_receipt_search_user_id "
+        "ON receipt_search (user_id)",
+    ),
+    "sqlite": (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS receipt_search "
+        "USING fts5(merchant, descriptions, notes, user_id UNINDEXED)",
+    ),
+}
+
+# Documents of the receipts selected by ``{where}``, ready to insert.
+_INDEX = {
+    "postgresql": f"""
+        INSERT INTO receipt_search (receipt_id, user_id, document)
+        SELECT r.id, r.user_id,
+            setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', r.merchant), 'A')
+            || setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce((
+                SELECT string_agg(i.description, ' ')
+                FROM line_items i WHERE i.receipt_id = r.id
+            ), '')), 'B')
+            || setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(r.notes, '')), 'C')
+        FROM receipts r WHERE {{where}}
+    """,
+    "sqlite": """
+        INSERT INTO receipt_search (rowid, merchant, descriptions, notes, user_id)
+        SELECT r.id, r.merchant, coalesce((
+                SELECT group_concat(i.description, ' ')
+                FROM line_items i WHERE i.receipt_id = r.id
+            ), ''), coalesce(r.notes, ''), r.user_id
+        FROM receipts r WHERE {where}
+    """,
+}
+
+_KEY = {"postgresql": "receipt_id", "sqlite": "rowid"}
+
+
+def _attach_schema():
+    """Create and drop ``receipt_search`` along with the other tables."""
+    for dialect, statements in _SCHEMA.items():
+        for statement in statements:
+            event.listen(
+                db.metadata, "after_create", DDL(statement).execute_if(dialect=dialect)
+            )
+        event.listen(
+            db.metadata,
+            "before_drop",
+            DDL("DROP TABLE IF EXISTS receipt_search").execute_if(dialect=dialect),
+        )
+
+
+_attach_schema()
+
+
+def mark_stale(receipt_ids, session=None):
+    """Mark receipts to be reindexed when the transaction commits."""
+    session = session or db.session
+    session.info.setdefault(_STALE_RECEIPTS, set()).update(receipt_ids)
+
+
+def mark_users_stale(user_ids, session=None):
+    """Mark users whose receipts were inserted without their ids being known.
+
+    Their receipts missing from the index are indexed when the transaction commits.
+    """
+    session = session or db.session
+    session.info.setdefault(_STALE_USERS, set()).update(user_ids)
+
+
+def reindex(connection, receipt_ids):
+    """Replace the documents of the given receipts, dropping those of deleted ones."""
+    dialect = connection.dialect.name
+    if dialect not in _INDEX:
+        return
+    key = _KEY[dialect]
+    ids = bindparam("ids", expanding=True)
+    for chunk in chunked(sorted(receipt_ids), DEFAULT_CHUNK_SIZE):
+        connection.execute(
+            text(f"DELETE FROM receipt_search WHERE {key} IN :ids").bindparams(ids),
+            {"ids": chunk},
+        )
+        connection.execute(
+            text(_INDEX[dialect].format(where="r.id IN :ids")).bindparams(ids),
+            {"ids": chunk},
+        )
+
+
+def index_missing(connection, user_ids=None):
+    """Index the receipts of the given users, or of everyone, missing from the index."""
+    dialect = connection.dialect.name
+    if dialect not in _INDEX:
+        return
+    where = f"r.id NOT IN (SELECT {_KEY[dialect]} FROM receipt_search)"
+    if user_ids is None:
+        connection.execute(text(_INDEX[dialect].format(where=where)))
+        return
+    statement = text(
+        _INDEX[dialect].format(where=f"r.user_id IN :user_ids AND {where}")
+    ).bindparams(bindparam("user_ids", expanding=True))
+    for chunk in chunked(sorted(user_ids), DEFAULT_CHUNK_SIZE):
+        connection.execute(statement, {"user_ids": chunk})
+
+
+def rebuild():
+    """Reindex every receipt from scratch."""
+    connection = db.session.connection()
+    connection.execute(text("DELETE FROM receipt_search"))
+    index_missing(connection)
+    db.session.commit()
+
+
+def terms(query):
+    """Return the words of ``query`` that are searched for."""
+    return _WORDS.findall(query.lower())[:MAX_TERMS]
+
+
+def _match(dialect, words):
+    """Return the search table, its receipt id, the match clause and the score."""
+    if dialect == "postgresql":
+        index = table("receipt_search", column("receipt_id"), column("user_id"))
+        tsquery = func.to_tsquery(
+            TEXT_SEARCH_CONFIG, " | ".join(f"{word}:*" for word in words)
+        )
+        document = literal_column("receipt_search.document")
+        return (
+            index,
+            index.c.receipt_id,
+            document.op("@@")(tsquery),
+            func.ts_rank(document, tsquery),
+        )
+    if dialect == "sqlite":
+        index = table("receipt_search", column("rowid"), column("user_id"))
+        fts = literal_column("receipt_search")
+        return (
+            index,
+            index.c.rowid,
+            fts.op("MATCH")(" OR ".join(f'"{word}"*' for word in words)),
+            # bm25 ranks best matches lowest; merchants weigh most, notes least.
+            -func.bm25(fts, 10.0, 5.0, 1.0),
+        )
+    raise NotImplementedError(f"Receipt search does not support {dialect}")
+
+
+def search(user_id, query, cursor=None, per_page=DEFAULT_PAGE_SIZE):
+    """Return a page of the receipts of ``user_id`` matching ``query``, best first.
+
+    Each word of ``query`` matches as a prefix, and receipts matching any of
+    them are returned, those matching more words, or in their merchant, first.
+
+    :param cursor: ``next_cursor`` of the previous page, if any.
+    :param per_page: Page size, capped at :data:`MAX_PAGE_SIZE`.
+    :raises InvalidCursor: If ``cursor`` was not made by this function.
+    """
+    words = terms(query)
+    if not words:
+        return Page([], None)
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+    search_table, receipt_id, match, score = _match(
+        db.session.get_bind().dialect.name, words
+    )
+    score = score.label("score")
+    statement = (
+        select(Receipt, score)
+        .join(search_table, receipt_id == Receipt.id)
+        .where(search_table.c.user_id == user_id, match)
+    )
+    if cursor:
+        try:
+            last_score, last_id = decode_cursor(cursor)
+        except (TypeError, ValueError) as error:
+            raise InvalidCursor(cursor) from error
+        if not isinstance(last_score, (int, float)):
+            raise InvalidCursor(cursor)
+        if not isinstance(last_id, int) or isinstance(last_id, bool):
+            raise InvalidCursor(cursor)
+        statement = statement.where(
+            tuple_(score.element, Receipt.id) < tuple_(last_score, last_id)
+        )
+    rows = db.session.execute(
+        statement.order_by(score.desc(), Receipt.id.desc()).limit(per_page + 1)
+    ).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor((rows[-1].score, rows[-1].Receipt.id))
+    return Page([row.Receipt for row in rows], next_cursor)
+
+
+def _is_modified(obj, fields):
+    """Return whether any of ``fields`` of a dirty object changed."""
+    attrs = inspect(obj).attrs
+    return any(attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_stale_receipts(session, flush_context):
+    """Mark the receipts whose documents ORM changes touched."""
+    receipt_ids = set()
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, Receipt):
+            receipt_ids.add(obj.id)
+        elif isinstance(obj, LineItem):
+            receipt_ids.add(obj.receipt_id)
+    for obj in session.dirty:
+        if isinstance(obj, Receipt) and _is_modified(obj, RECEIPT_FIELDS):
+            receipt_ids.add(obj.id)
+        elif isinstance(obj, LineItem) and _is_modified(obj, LINE_ITEM_FIELDS):
+            receipt_ids.add(obj.receipt_id)
+            receipt_ids.update(inspect(obj).attrs.receipt_id.history.deleted)
+    receipt_ids.discard(None)
+    if receipt_ids:
+        mark_stale(receipt_ids, session)
+
+
+@event.listens_for(db.session, "before_commit")
+def _reindex_stale_receipts(session):
+    """Reindex the marked receipts inside the committing transaction."""
+    session.flush()
+    receipt_ids = session.info.pop(_STALE_RECEIPTS, None)
+    user_ids = session.info.pop(_STALE_USERS, None)
+    if receipt_ids:
+        reindex(session.connection(), receipt_ids)
+    if user_ids:
+        index_missing(session.connection(), user_ids)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_stale_receipts(session):
+    """Drop the marks of a rolled back transaction."""
+    session.info.pop(_STALE_RECEIPTS, None)
+    session.info.pop(_STALE_USERS, None)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Receipt processing run by ``flask worker``, see :mod:`app.jobs.queue`."""
+import os
+import uuid
+
+from flask import current_app
+
+from app.jobs.queue import enqueue, task
+
+from . import rollups
+from .importer import detect_format, import_file
+
+
+def save_upload(file, user_id):
+    """Save an uploaded export file and queue its import.
+
+    :param file: A :class:`~werkzeug.datastructures.FileStorage`.
+    :raises InvalidRecord: If the format cannot be told from the file name.
+    :returns: The queued :class:`~app.jobs.models.Job`.
+    """
+    fmt = detect_format(file.filename)
+    directory = current_app.config["UPLOAD_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid.uuid4().hex}.{fmt}")
+    file.save(path)
+    return enqueue(
+        "receipts.import",
+        {"path": path, "user_id": user_id, "fmt": fmt, "filename": file.filename},
+    )
+
+
+@task("receipts.import")
+def import_upload(payload):
+    """Import an uploaded export file, then delete it.
+
+    A retried import skips the receipts an earlier attempt stored as
+    duplicates. A missing file was imported by an attempt whose worker died
+    before marking the job done.
+    """
+    path = payload["path"]
+    if not os.path.exists(path):
+        current_app.logger.warning(f"Upload {path} is gone, assuming it was imported")
+        return None
+    stats = import_file(path, payload["user_id"], payload.get("fmt"))
+    os.remove(path)
+    return {
+        "receipts": stats.receipts,
+        "line_items": stats.line_items,
+        "rejected": stats.rejected,
+        "duplicates": stats.duplicates,
+    }
+
+
+@task("rollups.rebuild", batched=True, priority=10)
+def rebuild_rollups(payloads):
+    """Recompute the rollups of the users a batch of jobs asks for, once each.
+
+    A job without a ``user_id`` rebuilds those of every user.
+    """
+    user_ids = {payload.get("user_id") for payload in payloads}
+    if None in user_ids:
+        rollups.rebuild()
+        return None
+    for user_id in sorted(user_ids):
+        rollups.rebuild(user_id)
+    return None
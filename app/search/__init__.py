@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+"""The search module, searching the receipts of the current user."""
+from . import views  # noqa
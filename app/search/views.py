@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Search views."""
+from flask import Blueprint, abort, render_template, request
+from flask_login import current_user, login_required
+
+from app.database import DEFAULT_PAGE_SIZE, InvalidCursor
+from app.receipt.search import search as search_receipts
+
+blueprint = Blueprint(
+    "search", __name__, url_prefix="/search", static_folder="../static"
+)
+
+
+@blueprint.route("/")
+@login_required
+def receipts():
+    """Search the receipts of the current user, best matches first."""
+    query = request.args.get("q", "").strip()
+    try:
+        page = search_receipts(
+            current_user.id,
+            query,
+            request.args.get("cursor"),
+            request.args.get("per_page", DEFAULT_PAGE_SIZE, type=int),
+        )
+    except InvalidCursor:
+        abort(400)
+    return render_template("search/receipts.html", page=page, query=query)
@@ -6,6 +6,9 @@ Most configuration is set via environment variables.
 For local development, use a .env file to set
 environment variables.
 """
+import os
+import tempfile
+
 from environs import Env
 
 env = Env()
@@ -17,10 +20,48 @@ SQLALCHEMY_DATABASE_URI = env.str("DATABASE_URL")
 SECRET_KEY = env.str("SECRET_KEY")
 SEND_FILE_MAX_AGE_DEFAULT = env.int("SEND_FILE_MAX_AGE_DEFAULT")
 BCRYPT_LOG_ROUNDS = env.int("BCRYPT_LOG_ROUNDS", default=13)
+BCRYPT_THREADPOOL_SIZE = env.int("BCRYPT_THREADPOOL_SIZE", default=4)
 DEBUG_TB_ENABLED = DEBUG
 DEBUG_TB_INTERCEPT_REDIRECTS = False
-CACHE_TYPE = (
-    "flask_caching.backends.SimpleCache"  # Can be "MemcachedCache", "RedisCache", etc.
+CACHE_TYPE = env.str("CACHE_TYPE", default="app.cache.TieredCache")
+# Cache shared by all workers behind the in-process tier of TieredCache.
+CACHE_L2_TYPE = env.str("CACHE_L2_TYPE", default="FileSystemCache")
+CACHE_DIR = env.str(
+    "CACHE_DIR", default=os.path.join(tempfile.gettempdir(), "app-cache")
+)
+CACHE_MEMCACHED_SERVERS = env.list("CACHE_MEMCACHED_SERVERS", default=[])
+CACHE_THRESHOLD = env.int("CACHE_THRESHOLD", default=10000)
+CACHE_DEFAULT_TIMEOUT = env.int("CACHE_DEFAULT_TIMEOUT", default=300)
+CACHE_L1_SIZE = env.int("CACHE_L1_SIZE", default=1024)
+CACHE_L1_TIMEOUT = env.int("CACHE_L1_TIMEOUT", default=30)
+CACHE_SYNC_INTERVAL = env.float("CACHE_SYNC_INTERVAL", default=1.0)
+USER_CACHE_TIMEOUT = env.int("USER_CACHE_TIMEOUT", default=300)
+# Columnar receipt snapshots for offline analytics, see app.analytics.snapshot.
+SNAPSHOT_DIR = env.str(
+    "SNAPSHOT_DIR",
+    default=os.path.normpath(
+        os.path.join(os.path.dirname(__file__), os.pardir, "snapshots")
+    ),
+)
+# Uploaded export files wait here for ``flask worker``; see app.jobs.queue.
+UPLOAD_DIR = env.str(
+    "UPLOAD_DIR", default=os.path.join(tempfile.gettempdir(), "app-uploads")
 )
+JOB_TIMEOUT = env.int("JOB_TIMEOUT", default=30 * 60)
+LOG_LEVEL = env.str("LOG_LEVEL", default=None)
+LOG_FORMAT = env.str("LOG_FORMAT", default="json")
+LOG_INFO_SAMPLE_RATE = env.float("LOG_INFO_SAMPLE_RATE", default=1.0)
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 SQLALCHEMY_RECORD_QUERIES = True
+# Connections per gunicorn worker; see app/pool.py.
+DB_POOL_SIZE = env.int("DB_POOL_SIZE", default=5)
+DB_MAX_OVERFLOW = env.int("DB_MAX_OVERFLOW", default=10)
+DB_POOL_TIMEOUT = env.float("DB_POOL_TIMEOUT", default=30)
+DB_POOL_RECYCLE = env.int("DB_POOL_RECYCLE", default=1800)
+DB_POOL_PRE_PING = env.bool("DB_POOL_PRE_PING", default=True)
+DB_POOL_WAIT_WARNING_MS = env.float("DB_POOL_WAIT_WARNING_MS", default=100)
+DB_GREEN = env.bool("DB_GREEN", default=None)
+SQLALCHEMY_RAISE_ON_LAZY_LOAD = env.bool("SQLALCHEMY_RAISE_ON_LAZY_LOAD", default=False)
+# Requests running more queries, or repeating a statement more often, are logged.
+QUERY_BUDGET = env.int("QUERY_BUDGET", default=30)
+QUERY_REPEAT_LIMIT = env.int("QUERY_REPEAT_LIMIT", default=5)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Startup time of the app factory.
+
+Every gunicorn worker imports the app and runs :func:`~app.app.create_app`
+when it boots or is recycled. :func:`measure` does the same in a fresh
+interpreter under ``python -X importtime`` and reports where the time went.
+"""
+import os
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import List
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+#: Child process script; prints the seconds create_app took after the imports.
+_SCRIPT = """\
+import time
+started = time.perf_counter()
+from app.app import create_app
+imported = time.perf_counter()
+create_app({config_object!r})
+print(imported - started, time.perf_counter() - imported)
+"""
+
+
+@dataclass
+class ImportTime:
+    """Time spent importing one module, in microseconds."""
+
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+@dataclass
+class StartupReport:
+    """Where the time of a cold app start went."""
+
+    import_seconds: float
+    create_seconds: float
+    imports: List[ImportTime]
+
+    @property
+    def total_seconds(self):
+        """Import and app creation time together."""
+        return self.import_seconds + self.create_seconds
+
+    def slowest(self, limit=20, depth=None):
+        """Return the imports with the highest cumulative time.
+
+        :param depth: Only count imports this deep, 0 being the ones made by
+            the app itself, so nested imports are not counted twice.
+        """
+        imports = [
+            entry for entry in self.imports if depth is None or entry.depth <= depth
+        ]
+        return sorted(imports, key=lambda entry: -entry.cumulative_us)[:limit]
+
+
+def parse_importtime(lines):
+    """Parse ``python -X importtime`` output into :class:`ImportTime` entries."""
+    imports = []
+    for line in lines:
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append(
+                ImportTime(module, int(self_us), int(cumulative_us), len(indent) // 2)
+            )
+    return imports
+
+
+def measure(config_object, cwd=None):
+    """Start the app in a fresh interpreter and return its :class:`StartupReport`."""
+    script = _SCRIPT.format(config_object=config_object)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=cwd or os.getcwd(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_seconds, create_seconds = map(float, result.stdout.split()[-2:])
+    return StartupReport(
+        import_seconds, create_seconds, parse_importtime(result.stderr.splitlines())
+    )
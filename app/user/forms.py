@@ -1,13 +1,34 @@
 # -*- coding: utf-8 -*-
 """User forms."""
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from wtforms import PasswordField, StringField
 from wtforms.validators import DataRequired, Email, EqualTo, Length
 
 from .models import User
 
 
-class RegisterForm(FlaskForm):
+class UniqueUserMixin:
+    """Validates that the username and email of a form are not taken."""
+
+    #: User being edited, whose own username and email do not conflict.
+    user = None
+
+    def validate_unique(self):
+        """Check the username and email with one query, flagging taken fields."""
+        conflicts = User.find_conflicts(
+            username=self.username.data,
+            email=self.email.data,
+            exclude_id=self.user.id if self.user else None,
+        )
+        if "username" in conflicts:
+            self.username.errors.append("Username already registered")
+        if "email" in conflicts:
+            self.email.errors.append("Email already registered")
+        return not conflicts
+
+
+class RegisterForm(UniqueUserMixin, FlaskForm):
     """Register form."""
 
     username = StringField(
@@ -34,18 +55,10 @@ class RegisterForm(FlaskForm):
         initial_validation = super(RegisterForm, self).validate()
         if not initial_validation:
             return False
-        user = User.query.filter_by(username=self.username.data).first()
-        if user:
-            self.username.errors.append("Username already registered")
-            return False
-        user = User.query.filter_by(email=self.email.data).first()
-        if user:
-            self.email.errors.append("Email already registered")
-            return False
-        return True
+        return self.validate_unique()
 
 
-class EditProfileForm(FlaskForm):
+class EditProfileForm(UniqueUserMixin, FlaskForm):
     """Edit profile form."""
 
     username = StringField(
@@ -57,3 +70,27 @@ class EditProfileForm(FlaskForm):
     )
     first_name = StringField("First Name", validators=[DataRequired()])
     last_name = StringField("Last Name", validators=[DataRequired()])
+
+    def __init__(self, *args, user=None, **kwargs):
+        """Create instance for editing ``user``."""
+        super(EditProfileForm, self).__init__(*args, **kwargs)
+        self.user = user
+
+    def validate(self, **kwargs):
+        """Validate the form."""
+        initial_validation = super(EditProfileForm, self).validate()
+        if not initial_validation:
+            return False
+        return self.validate_unique()
+
+
+class UploadForm(FlaskForm):
+    """Receipt export upload form."""
+
+    file = FileField(
+        "Export file",
+        validators=[
+            FileRequired(),
+            FileAllowed(["csv", "jsonl", "ndjson"], "CSV or JSONL exports only"),
+        ],
+    )
@@ -1,11 +1,29 @@
 # -*- coding: utf-8 -*-
 """User models."""
+import gevent
+from flask import current_app
 from flask_login import UserMixin
+from sqlalchemy import event, or_, select, update
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.orm import Mapped, make_transient_to_detached, mapped_column
 
 from app.database import Column, TableModel, db, reference_col, relationship
-from app.extensions import bcrypt
+from app.extensions import bcrypt, cache
+
+#: Columns of a user kept in the identity cache; the password hash never is.
+CACHED_COLUMNS = (
+    "id",
+    "username",
+    "email",
+    "first_name",
+    "last_name",
+    "active",
+    "is_admin",
+    "created_at",
+    "updated_at",
+)
+
+_STALE_USERS = "stale_cached_users"
 
 
 class Role(TableModel):
@@ -14,7 +32,7 @@ class Role(TableModel):
     __tablename__ = "roles"
     name: Mapped[str] = Column(db.String(80), unique=True, nullable=False)
     user_id: Mapped[int] = reference_col("users", nullable=True)
-    user = relationship("User", backref="roles")
+    user = relationship("User", backref="roles", lazy="joined")
 
     def __init__(self, name, **kwargs):
         """Create instance."""
@@ -29,6 +47,7 @@ class User(UserMixin, TableModel):
     """A user of the app."""
 
     __tablename__ = "users"
+    __table_args__ = (db.Index("ix_users_created_at_id", "created_at", "id"),)
     username: Mapped[str] = mapped_column(db.String(80), unique=True, nullable=False)
     email: Mapped[str] = mapped_column(db.String(80), unique=True, nullable=False)
     _password = mapped_column("password", db.LargeBinary(128), nullable=True)
@@ -51,6 +70,102 @@ class User(UserMixin, TableModel):
         """Check password."""
         return bcrypt.check_password_hash(self._password, value)
 
+    def upgrade_password(self, value):
+        """Re-hash the verified password ``value`` with ``BCRYPT_LOG_ROUNDS``.
+
+        Under gevent the hash is computed and committed in a background
+        greenlet, so the response does not wait for it; otherwise it is written
+        in the current transaction, for the caller to commit.
+        """
+        if not bcrypt.offloading:
+            self.replace_password_hash(self.id, value, self._password)
+            return
+        app = current_app._get_current_object()
+        gevent.spawn(_upgrade_in_background, app, self.id, value, self._password)
+
+    @classmethod
+    def replace_password_hash(cls, user_id, value, old_hash):
+        """Store a fresh hash of ``value`` unless the password changed meanwhile.
+
+        The caller commits.
+        """
+        result = db.session.execute(
+            update(cls)
+            .where(cls.id == user_id, cls._password == old_hash)
+            .values({cls._password: bcrypt.generate_password_hash(value)}),
+            execution_options={"synchronize_session": False},
+        )
+        invalidate_cached([user_id])
+        return result.rowcount == 1
+
+    @classmethod
+    def find_conflicts(cls, username=None, email=None, exclude_id=None):
+        """Return which of ``username`` and ``email`` other users already have.
+
+        Both are looked up with a single query.
+        """
+        clauses = []
+        if username is not None:
+            clauses.append(cls.username == username)
+        if email is not None:
+            clauses.append(cls.email == email)
+        if not clauses:
+            return set()
+        query = select(cls.username, cls.email).where(or_(*clauses))
+        if exclude_id is not None:
+            query = query.where(cls.id != exclude_id)
+        conflicts = set()
+        for row in db.session.execute(query):
+            if username is not None and row.username == username:
+                conflicts.add("username")
+            if email is not None and row.email == email:
+                conflicts.add("email")
+        return conflicts
+
+    @staticmethod
+    def cache_key(user_id):
+        """Key of a user in the identity cache."""
+        return f"user:{int(user_id)}"
+
+    @classmethod
+    def get_cached(cls, user_id):
+        """Get user by ID, through the identity cache.
+
+        Cached users are merged into the session without querying, so an
+        authenticated request only hits the database for what it actually uses.
+        Columns left out of the cache, like the password hash, load on access.
+        """
+        key = cls.cache_key(user_id)
+        values = cache.get(key)
+        if values is not None:
+            user = cls(**values)
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+        user = cls.get_by_id(user_id)
+        if user is not None:
+            values = {name: getattr(user, name) for name in CACHED_COLUMNS}
+            cache.set(key, values, timeout=current_app.config["USER_CACHE_TIMEOUT"])
+        return user
+
+    @classmethod
+    def _bulk_written(cls, rows):
+        """Drop bulk written users from the identity cache on commit."""
+        invalidate_cached(row["id"] for row in rows if "id" in row)
+
+    @classmethod
+    def _bulk_upserting(cls, rows, index_elements):
+        """Drop the users about to be overwritten from the identity cache on commit."""
+        invalidate_cached(
+            db.session.scalars(
+                select(cls.id).where(cls._bulk_conflicts(rows, index_elements))
+            )
+        )
+
+    @classmethod
+    def _bulk_deleting(cls, ids):
+        """Drop bulk deleted users from the identity cache on commit."""
+        invalidate_cached(ids)
+
     @property
     def full_name(self):
         """Full user name."""
@@ -59,3 +174,47 @@ class User(UserMixin, TableModel):
     def __repr__(self):
         """Represent instance as a unique string."""
         return f"<User({self.username!r})>"
+
+
+def invalidate_cached(user_ids, session=None):
+    """Drop users from the identity cache once the transaction commits."""
+    session = session or db.session
+    session.info.setdefault(_STALE_USERS, set()).update(user_ids)
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_stale_users(session, flush_context):
+    """Remember the users changed by ORM writes."""
+    invalidate_cached(
+        (
+            obj.id
+            for obj in (*session.new, *session.dirty, *session.deleted)
+            if isinstance(obj, User) and obj.id is not None
+        ),
+        session,
+    )
+
+
+@event.listens_for(db.session, "after_commit")
+def _drop_stale_users(session):
+    """Drop the users changed by the committed transaction from the cache."""
+    stale = session.info.pop(_STALE_USERS, None)
+    if stale:
+        cache.delete_many(*(User.cache_key(user_id) for user_id in stale))
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_stale_users(session):
+    """Keep the cache of a rolled back transaction."""
+    session.info.pop(_STALE_USERS, None)
+
+
+def _upgrade_in_background(app, user_id, value, old_hash):
+    """Upgrade a password hash in its own app context and session."""
+    with app.app_context():
+        try:
+            User.replace_password_hash(user_id, value, old_hash)
+            db.session.commit()
+        except Exception:  # noqa: B902
+            db.session.rollback()
+            app.logger.exception(f"Could not upgrade the password hash of {user_id}")
@@ -1,11 +1,26 @@
 # -*- coding: utf-8 -*-
 """User views."""
-from flask import Blueprint, flash, redirect, render_template, request, url_for
+from datetime import date
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
 from flask_login import current_user, login_required
+from sqlalchemy.exc import IntegrityError
 
+from app.database import DEFAULT_PAGE_SIZE, InvalidCursor, db
+from app.receipt.models import Receipt
 from app.utils import flash_errors
 
-from .forms import EditProfileForm
+from .forms import EditProfileForm, UploadForm
 from .models import User
 
 blueprint = Blueprint("user", __name__, url_prefix="/users", static_folder="../static")
@@ -15,30 +30,113 @@ blueprint = Blueprint("user", __name__, url_prefix="/users", static_folder="../s
 @login_required
 def members():
     """List members."""
-    return render_template("users/members.html")
+    page = _seek(User)
+    return render_template("users/members.html", page=page)
+
+
+@blueprint.route("/receipts")
+@login_required
+def receipts():
+    """List the receipts of the current user."""
+    page = _seek(Receipt, Receipt.query.filter_by(user_id=current_user.id))
+    return render_template("users/receipts.html", page=page)
+
+
+def _seek(model, query=None):
+    """Return the page of ``model`` records selected by the request's query string."""
+    try:
+        return model.seek(
+            request.args.get("cursor"),
+            request.args.get("per_page", DEFAULT_PAGE_SIZE, type=int),
+            query,
+        )
+    except InvalidCursor:
+        abort(400)
+
+
+@blueprint.route("/receipts/upload", methods=["GET", "POST"])
+@login_required
+def upload():
+    """Upload a receipt export, imported in the background by ``flask worker``."""
+    form = UploadForm()
+    if form.validate_on_submit():
+        from app.receipt.tasks import save_upload
+
+        save_upload(form.file.data, current_user.id)
+        flash("Your file is being imported; its receipts will show up shortly.")
+        return redirect(url_for("user.receipts"))
+    if request.method == "POST":
+        flash_errors(form)
+    return render_template("users/upload.html", form=form)
+
+
+@blueprint.route("/export/<dataset>.<fmt>")
+@login_required
+def export(dataset, fmt):
+    """Stream the current user's receipts or rollups as a CSV or NDJSON download.
+
+    ``start`` and ``end`` ISO dates narrow the export down to ``[start, end)``.
+    The body is gzipped on the fly for clients that accept it.
+    """
+    from app.receipt import exporter
+
+    if dataset not in exporter.DATASETS or fmt not in exporter.FORMATS:
+        abort(404)
+    try:
+        start, end = (
+            date.fromisoformat(request.args[arg]) if request.args.get(arg) else None
+            for arg in ("start", "end")
+        )
+    except ValueError:
+        abort(400)
+    gzip = bool(request.accept_encodings["gzip"])
+    chunks = exporter.export(current_user.id, dataset, fmt, start, end, gzip)
+    response = Response(stream_with_context(chunks), mimetype=exporter.MIMETYPES[fmt])
+    response.headers["Content-Disposition"] = f'attachment; filename="{dataset}.{fmt}"'
+    if gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 @blueprint.route("/profile")
 @login_required
 def user():
     """List user detail."""
-    user = User.get_by_id(current_user.id)
-    return render_template("users/user.html", user=user)
+    return render_template("users/user.html", user=current_user)
+
+
+@blueprint.route("/analytics")
+@login_required
+def analytics():
+    """Show spend statistics."""
+    from app.analytics.engine import load_spend_frame, summarize
+
+    window = min(max(request.args.get("window", 7, type=int), 1), 90)
+    summary = summarize(load_spend_frame(current_user.id), window=window)
+    return render_template("users/analytics.html", summary=summary, window=window)
 
 
 @blueprint.route("/edit_profile", methods=["GET", "POST"])
 @login_required
 def edit_profile():
     """Edit profile."""
-    form = EditProfileForm()
+    form = EditProfileForm(user=current_user)
     if form.validate_on_submit():
         current_user.username = form.username.data
         current_user.email = form.email.data
         current_user.first_name = form.first_name.data
         current_user.last_name = form.last_name.data
-        User.update(current_user)
-        flash("Your changes have been saved.")
-        return redirect(url_for("user.user", id=current_user.id))
+        try:
+            User.update(current_user)
+        except IntegrityError:
+            # Another request took the username or email since validation.
+            db.session.rollback()
+            form.validate_unique()
+            flash_errors(form)
+        else:
+            flash("Your changes have been saved.")
+            return redirect(url_for("user.user", id=current_user.id))
     elif request.method == "GET":
         form.username.data = current_user.username
         form.email.data = current_user.email
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 """Helper utilities and decorators."""
+from itertools import islice
+
 from flask import flash
 
 
@@ -8,3 +10,13 @@ def flash_errors(form, category="warning"):
     for field, errors in form.errors.items():
         for error in errors:
             flash(f"{getattr(form, field).label.text} - {error}", category)
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,76 @@
+"""Add receipts and line items
+
+Revision ID: 3f2b9c1d7e40
+Revises: 663c79d7be3b
+Create Date: 2026-10-17 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f2b9c1d7e40"
+down_revision = "663c79d7be3b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "receipts",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("external_id", sa.String(length=64), nullable=True),
+        sa.Column("merchant", sa.String(length=120), nullable=False),
+        sa.Column("purchased_at", sa.DateTime(), nullable=False),
+        sa.Column("total", sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.Column("currency", sa.String(length=3), nullable=True),
+        sa.Column("notes", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_receipts_external_id"), ["external_id"], unique=False
+        )
+        batch_op.create_index(
+            "ix_receipts_user_id_purchased_at",
+            ["user_id", "purchased_at"],
+            unique=False,
+        )
+
+    op.create_table(
+        "line_items",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("receipt_id", sa.Integer(), nullable=False),
+        sa.Column("description", sa.String(length=255), nullable=False),
+        sa.Column("category", sa.String(length=60), nullable=True),
+        sa.Column("quantity", sa.Numeric(precision=10, scale=3), nullable=False),
+        sa.Column("amount", sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["receipt_id"], ["receipts.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    with op.batch_alter_table("line_items", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_line_items_receipt_id"), ["receipt_id"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("line_items", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_line_items_receipt_id"))
+
+    op.drop_table("line_items")
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.drop_index("ix_receipts_user_id_purchased_at")
+        batch_op.drop_index(batch_op.f("ix_receipts_external_id"))
+
+    op.drop_table("receipts")
@@ -0,0 +1,50 @@
+"""Add daily spend rollups
+
+Revision ID: 8d4e6a2b51c9
+Revises: 3f2b9c1d7e40
+Create Date: 2026-10-17 11:02:17.640318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8d4e6a2b51c9"
+down_revision = "3f2b9c1d7e40"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "daily_category_spend",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("category", sa.String(length=60), nullable=False),
+        sa.Column("amount", sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column("item_count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("user_id", "day", "category"),
+    )
+    op.create_table(
+        "daily_merchant_spend",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("merchant", sa.String(length=120), nullable=False),
+        sa.Column("amount", sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column("receipt_count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("user_id", "day", "merchant"),
+    )
+
+
+def downgrade():
+    op.drop_table("daily_merchant_spend")
+    op.drop_table("daily_category_spend")
@@ -0,0 +1,30 @@
+"""Add receipt fingerprints for duplicate detection
+
+Revision ID: a7d3e5c91b28
+Revises: f3c1a9d2b457
+Create Date: 2026-10-17 18:24:37.118250
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a7d3e5c91b28"
+down_revision = "f3c1a9d2b457"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("fingerprint", sa.String(length=64), nullable=True))
+        batch_op.create_index(
+            "ix_receipts_user_id_fingerprint", ["user_id", "fingerprint"], unique=True
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.drop_index("ix_receipts_user_id_fingerprint")
+        batch_op.drop_column("fingerprint")
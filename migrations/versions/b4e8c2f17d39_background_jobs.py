@@ -0,0 +1,74 @@
+"""Add the background job queue
+
+Revision ID: b4e8c2f17d39
+Revises: a7d3e5c91b28
+Create Date: 2026-10-17 19:42:08.503117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b4e8c2f17d39"
+down_revision = "a7d3e5c91b28"
+branch_labels = None
+depends_on = None
+
+
+def _utcnow():
+    """Return the current UTC time expression of the connected database."""
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sa.text("(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))")
+    if dialect == "postgresql":
+        return sa.text("TIMEZONE('utc', CURRENT_TIMESTAMP)")
+    return sa.text("CURRENT_TIMESTAMP")
+
+
+def _timestamps():
+    """Return the timestamp columns every table model has."""
+    return (
+        sa.Column("created_at", sa.DateTime(), server_default=_utcnow(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), server_default=_utcnow(), nullable=False),
+    )
+
+
+def upgrade():
+    op.create_table(
+        "jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=80), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("state", sa.String(length=16), nullable=False),
+        sa.Column("priority", sa.Integer(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("max_attempts", sa.Integer(), nullable=False),
+        sa.Column("run_at", sa.DateTime(), nullable=False),
+        sa.Column("locked_by", sa.String(length=120), nullable=True),
+        sa.Column("locked_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("wait_ms", sa.Float(), nullable=True),
+        sa.Column("run_ms", sa.Float(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("result", sa.JSON(), nullable=True),
+        *_timestamps(),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    with op.batch_alter_table("jobs", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_jobs_state_priority_run_at_id",
+            ["state", "priority", "run_at", "id"],
+            unique=False,
+        )
+        batch_op.create_index(
+            batch_op.f("ix_jobs_updated_at"), ["updated_at"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("jobs", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_jobs_updated_at"))
+        batch_op.drop_index("ix_jobs_state_priority_run_at_id")
+
+    op.drop_table("jobs")
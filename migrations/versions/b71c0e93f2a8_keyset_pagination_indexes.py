@@ -0,0 +1,38 @@
+"""Add keyset pagination indexes
+
+Revision ID: b71c0e93f2a8
+Revises: 8d4e6a2b51c9
+Create Date: 2026-10-17 13:40:05.118730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b71c0e93f2a8"
+down_revision = "8d4e6a2b51c9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_users_created_at_id", ["created_at", "id"], unique=False
+        )
+
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_receipts_user_id_created_at_id",
+            ["user_id", "created_at", "id"],
+            unique=False,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.drop_index("ix_receipts_user_id_created_at_id")
+
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.drop_index("ix_users_created_at_id")
@@ -0,0 +1,69 @@
+"""Default timestamps in the database and index them
+
+Revision ID: c4a9e2f17d35
+Revises: b71c0e93f2a8
+Create Date: 2026-10-17 14:05:41.502113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c4a9e2f17d35"
+down_revision = "b71c0e93f2a8"
+branch_labels = None
+depends_on = None
+
+TABLES = ("roles", "users", "receipts", "line_items")
+
+
+def _utcnow():
+    """Return the current UTC time expression of the connected database."""
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sa.text("(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))")
+    if dialect == "postgresql":
+        return sa.text("TIMEZONE('utc', CURRENT_TIMESTAMP)")
+    return sa.text("CURRENT_TIMESTAMP")
+
+
+def upgrade():
+    utcnow = _utcnow()
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(
+                "created_at", existing_type=sa.DateTime(), server_default=utcnow
+            )
+            batch_op.alter_column(
+                "updated_at", existing_type=sa.DateTime(), server_default=utcnow
+            )
+            batch_op.create_index(
+                f"ix_{table}_updated_at", ["updated_at"], unique=False
+            )
+
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.create_index("ix_receipts_created_at", ["created_at"], unique=False)
+
+    with op.batch_alter_table("line_items", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_line_items_created_at", ["created_at"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("line_items", schema=None) as batch_op:
+        batch_op.drop_index("ix_line_items_created_at")
+
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.drop_index("ix_receipts_created_at")
+
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f"ix_{table}_updated_at")
+            batch_op.alter_column(
+                "updated_at", existing_type=sa.DateTime(), server_default=None
+            )
+            batch_op.alter_column(
+                "created_at", existing_type=sa.DateTime(), server_default=None
+            )
@@ -0,0 +1,65 @@
+"""Add the receipt full-text search index
+
+Revision ID: e2b7d4f8a613
+Revises: c4a9e2f17d35
+Create Date: 2026-10-17 16:12:08.204417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e2b7d4f8a613"
+down_revision = "c4a9e2f17d35"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        op.execute(
+            "CREATE TABLE receipt_search ("
+            "receipt_id INTEGER PRIMARY KEY REFERENCES receipts (id) ON DELETE CASCADE, "
+            "user_id INTEGER NOT NULL, "
+            "document TSVECTOR NOT NULL)"
+        )
+        op.execute(
+            """
+            INSERT INTO receipt_search (receipt_id, user_id, document)
+            SELECT r.id, r.user_id,
+                setweight(to_tsvector('english', r.merchant), 'A')
+                || setweight(to_tsvector('english', coalesce((
+                    SELECT string_agg(i.description, ' ')
+                    FROM line_items i WHERE i.receipt_id = r.id
+                ), '')), 'B')
+                || setweight(to_tsvector('english', coalesce(r.notes, '')), 'C')
+            FROM receipts r
+            """
+        )
+        op.execute(
+            "CREATE INDEX ix_receipt_search_document "
+            "ON receipt_search USING GIN (document)"
+        )
+        op.execute("CREATE INDEX ix_receipt_search_user_id ON receipt_search (user_id)")
+    elif dialect == "sqlite":
+        op.execute(
+            "CREATE VIRTUAL TABLE receipt_search "
+            "USING fts5(merchant, descriptions, notes, user_id UNINDEXED)"
+        )
+        op.execute(
+            """
+            INSERT INTO receipt_search (rowid, merchant, descriptions, notes, user_id)
+            SELECT r.id, r.merchant, coalesce((
+                    SELECT group_concat(i.description, ' ')
+                    FROM line_items i WHERE i.receipt_id = r.id
+                ), ''), coalesce(r.notes, ''), r.user_id
+            FROM receipts r
+            """
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ("postgresql", "sqlite"):
+        op.execute("DROP TABLE receipt_search")
@@ -0,0 +1,94 @@
+"""Add the merchant dictionary
+
+Revision ID: f3c1a9d2b457
+Revises: e2b7d4f8a613
+Create Date: 2026-10-17 17:31:52.660913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f3c1a9d2b457"
+down_revision = "e2b7d4f8a613"
+branch_labels = None
+depends_on = None
+
+
+def _utcnow():
+    """Return the current UTC time expression of the connected database."""
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sa.text("(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))")
+    if dialect == "postgresql":
+        return sa.text("TIMEZONE('utc', CURRENT_TIMESTAMP)")
+    return sa.text("CURRENT_TIMESTAMP")
+
+
+def _timestamps():
+    """Return the timestamp columns every table model has."""
+    return (
+        sa.Column("created_at", sa.DateTime(), server_default=_utcnow(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), server_default=_utcnow(), nullable=False),
+    )
+
+
+def upgrade():
+    op.create_table(
+        "merchants",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=120), nullable=False),
+        *_timestamps(),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+    )
+    with op.batch_alter_table("merchants", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_merchants_updated_at"), ["updated_at"], unique=False
+        )
+
+    op.create_table(
+        "merchant_aliases",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("merchant_id", sa.Integer(), nullable=False),
+        sa.Column("alias", sa.String(length=120), nullable=False),
+        *_timestamps(),
+        sa.ForeignKeyConstraint(["merchant_id"], ["merchants.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("alias"),
+    )
+    with op.batch_alter_table("merchant_aliases", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_merchant_aliases_merchant_id"), ["merchant_id"], unique=False
+        )
+        batch_op.create_index(
+            batch_op.f("ix_merchant_aliases_updated_at"), ["updated_at"], unique=False
+        )
+
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("merchant_id", sa.Integer(), nullable=True))
+        batch_op.add_column(
+            sa.Column("raw_merchant", sa.String(length=120), nullable=True)
+        )
+        batch_op.create_index(
+            batch_op.f("ix_receipts_merchant_id"), ["merchant_id"], unique=False
+        )
+        batch_op.create_foreign_key(
+            "fk_receipts_merchant_id_merchants",
+            "merchants",
+            ["merchant_id"],
+            ["id"],
+            ondelete="SET NULL",
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("receipts", schema=None) as batch_op:
+        batch_op.drop_constraint("fk_receipts_merchant_id_merchants", type_="foreignkey")
+        batch_op.drop_index(batch_op.f("ix_receipts_merchant_id"))
+        batch_op.drop_column("raw_merchant")
+        batch_op.drop_column("merchant_id")
+
+    op.drop_table("merchant_aliases")
+    op.drop_table("merchants")
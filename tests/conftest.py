@@ -2,8 +2,10 @@
 """Defines fixtures available to all tests."""
 
 import logging
+from contextlib import contextmanager
 
 import pytest
+from sqlalchemy import event
 from webtest import TestApp
 
 from app.app import create_app
@@ -51,3 +53,61 @@ def user(db):
     user = UserFactory(password="myprecious")
     db.session.commit()
     return user
+
+
+class QueryCapture:
+    """SQL statements, and rows fetched by the ORM, while capturing."""
+
+    def __init__(self):
+        """Create instance."""
+        self.statements = []
+        self.rows = 0
+
+    @property
+    def count(self):
+        """Number of statements executed."""
+        return len(self.statements)
+
+    def record_statement(self, conn, cursor, statement, parameters, context, many):
+        """Record a statement sent to the database."""
+        self.statements.append(statement)
+
+    def record_rows(self, orm_execute_state):
+        """Count the rows of an ORM result, which is buffered to do so."""
+        frozen = orm_execute_state.invoke_statement().freeze()
+        self.rows += len(frozen.data)
+        return frozen()
+
+    def assert_budget(self, queries=None, rows=None):
+        """Fail when more statements ran, or more rows were fetched, than allowed."""
+        listing = "\n".join(self.statements)
+        if queries is not None:
+            assert (
+                self.count <= queries
+            ), f"{self.count} queries, budget {queries}:\n{listing}"
+        if rows is not None:
+            assert self.rows <= rows, f"{self.rows} rows, budget {rows}:\n{listing}"
+
+
+@pytest.fixture
+def count_queries(db):
+    """Return a context manager capturing the queries run through ``db``.
+
+    Objects loaded before the capture starts are detached from the session.
+    """
+
+    @contextmanager
+    def capture():
+        # Requests in tests share one session. Start from an empty identity map,
+        # like a real request would, so repeated loads show up as queries.
+        db.session.expunge_all()
+        queries = QueryCapture()
+        event.listen(db.engine, "before_cursor_execute", queries.record_statement)
+        event.listen(db.session, "do_orm_execute", queries.record_rows)
+        try:
+            yield queries
+        finally:
+            event.remove(db.engine, "before_cursor_execute", queries.record_statement)
+            event.remove(db.session, "do_orm_execute", queries.record_rows)
+
+    return capture
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 """Factories to help in tests."""
-from factory import Sequence
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from factory import LazyAttribute, Sequence, SubFactory
 from factory.alchemy import SQLAlchemyModelFactory
 
 from app.database import db
+from app.receipt.models import LineItem, Receipt
 from app.user.models import User
 
 
@@ -28,3 +32,32 @@ class UserFactory(BaseFactory):
         """Factory configuration."""
 
         model = User
+
+
+class ReceiptFactory(BaseFactory):
+    """Receipt factory."""
+
+    user = SubFactory(UserFactory)
+    external_id = Sequence(lambda n: f"r{n}")
+    merchant = Sequence(lambda n: f"Merchant {n % 50}")
+    purchased_at = Sequence(lambda n: datetime(2024, 1, 1) + timedelta(hours=7 * n))
+    total = Sequence(lambda n: Decimal(n % 9000) / 100 + 1)
+
+    class Meta:
+        """Factory configuration."""
+
+        model = Receipt
+
+
+class LineItemFactory(BaseFactory):
+    """Line item factory."""
+
+    receipt = SubFactory(ReceiptFactory)
+    description = Sequence(lambda n: f"Product {n}")
+    category = Sequence(lambda n: ("groceries", "dining", "transport", None)[n % 4])
+    amount = LazyAttribute(lambda item: item.receipt.total)
+
+    class Meta:
+        """Factory configuration."""
+
+        model = LineItem
@@ -8,6 +8,14 @@ BCRYPT_LOG_ROUNDS = (
     4  # For faster tests; needs at least 4 to avoid "ValueError: Invalid rounds"
 )
 DEBUG_TB_ENABLED = False
-CACHE_TYPE = "flask_caching.backends.SimpleCache"  # Can be "memcached", "redis", etc.
+CACHE_TYPE = "app.cache.TieredCache"
+CACHE_L2_TYPE = "SimpleCache"  # Stands in for a cache shared between workers
+CACHE_SYNC_INTERVAL = 0
+USER_CACHE_TIMEOUT = 300
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+SQLALCHEMY_RECORD_QUERIES = True
+QUERY_BUDGET = 30
+QUERY_REPEAT_LIMIT = 5
+QUERY_BUDGET_RAISE = True  # Fail tests of views running N+1 queries
 WTF_CSRF_ENABLED = False  # Allows form testing
+SQLALCHEMY_RAISE_ON_LAZY_LOAD = True  # Relationships must be loaded up front
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Analytics engine tests."""
+import math
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app.analytics import benchmark, engine
+
+from .factories import LineItemFactory
+
+
+def make_frame(items):
+    """Build a frame from ``(cents, timestamp, category)`` tuples."""
+    amounts, timestamps, categories = zip(*items)
+    names, codes = np.unique(np.array(categories, dtype=object), return_inverse=True)
+    return engine.SpendFrame(
+        np.array(amounts, dtype=np.int64),
+        np.array(timestamps, dtype="datetime64[s]"),
+        codes.astype(np.int32),
+        names,
+    )
+
+
+FRAME_ITEMS = [
+    (1000, "2024-01-30T10:00:00", "dining"),
+    (500, "2024-01-30T18:00:00", "groceries"),
+    (2500, "2024-02-01T09:00:00", "groceries"),
+    (3100, "2024-03-15T12:00:00", "travel"),
+]
+
+
+class TestEngine:
+    """Vectorized statistics."""
+
+    def test_daily_totals_fill_gaps(self):
+        """Days without spend are included with a zero total."""
+        days, totals = engine.daily_totals(make_frame(FRAME_ITEMS))
+        assert days[0] == np.datetime64("2024-01-30")
+        assert len(days) == 46
+        assert totals[:3].tolist() == [1500, 0, 2500]
+
+    def test_moving_average(self):
+        """The trailing window is shorter at the start."""
+        assert engine.moving_average([2, 4, 6, 8], 2).tolist() == [2, 3, 5, 7]
+
+    def test_month_over_month(self):
+        """Changes relative to the previous month; NaN without a base."""
+        change = engine.month_over_month([100, 150, 0, 50])
+        assert math.isnan(change[0]) and math.isnan(change[3])
+        assert change[1:3].tolist() == [0.5, -1.0]
+
+    def test_summarize(self):
+        """Summaries are expressed in currency units."""
+        summary = engine.summarize(make_frame(FRAME_ITEMS), percentiles=(50,))
+        assert summary.total == 71.0
+        assert summary.item_count == 4
+        assert summary.percentiles == {50: 17.5}
+        assert summary.months == [date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)]
+        assert summary.monthly_totals == [15.0, 25.0, 31.0]
+        assert summary.categories == [
+            ("travel", 31.0),
+            ("groceries", 30.0),
+            ("dining", 10.0),
+        ]
+
+    def test_summarize_empty(self):
+        """An empty frame summarizes to zeros."""
+        assert engine.summarize(engine.SpendFrame.empty()).total == 0.0
+
+
+@pytest.mark.usefixtures("db")
+class TestLoading:
+    """Loading frames from the database."""
+
+    def test_load_spend_frame(self, user):
+        """Line items of the user are loaded as cents, ordered by time."""
+        LineItemFactory.create_batch(6, receipt__user=user)
+        LineItemFactory()
+        frame = engine.load_spend_frame(user.id)
+        assert len(frame) == 6
+        assert frame.amounts.dtype == np.int64
+        assert np.all(np.diff(frame.timestamps.astype(np.int64)) >= 0)
+        assert "uncategorized" in frame.categories.tolist()
+
+    def test_matches_naive_implementation(self, user):
+        """The engine agrees with plain iteration over ORM objects."""
+        benchmark.seed(user.id, 500)
+        summary = engine.summarize(engine.load_spend_frame(user.id))
+        naive = benchmark.naive_summary(user.id)
+        assert summary.total == pytest.approx(naive["total"])
+        assert summary.moving_average == pytest.approx(naive["moving_average"])
+        assert dict(summary.categories) == pytest.approx(dict(naive["categories"]))
+        np.testing.assert_allclose(summary.month_over_month, naive["month_over_month"])
+
+    def test_benchmark_command(self, app):
+        """The benchmark runs on a scratch database and reports a speedup."""
+        result = app.test_cli_runner().invoke(
+            args=["analytics", "benchmark", "--line-items", "200"]
+        )
+        assert result.exit_code == 0, result.output
+        assert "speedup" in result.output
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Hot path benchmark tests."""
+import json
+
+import pytest
+
+from app.bench import IncomparableRuns, compare
+
+
+def _report(**medians):
+    """Return a report with the given median timings."""
+    return {
+        "results": {name: {"median_ms": median} for name, median in medians.items()}
+    }
+
+
+def test_compare():
+    """Medians slower than the threshold are regressions."""
+    baseline = _report(login=100.0, profile=10.0, removed=1.0)
+    current = _report(login=119.0, profile=13.0, added=5.0)
+    assert compare(baseline, current, threshold=0.2) == [("profile", 10.0, 13.0)]
+    assert compare(baseline, current, threshold=0.5) == []
+
+
+def test_compare_refuses_other_data_sets():
+    """Runs on another database or data size are not compared."""
+    baseline = dict(_report(login=100.0), database="sqlite", users=10)
+    with pytest.raises(IncomparableRuns, match="users 10 != 20"):
+        compare(baseline, dict(_report(login=100.0), database="sqlite", users=20))
+
+
+class TestBenchCommand:
+    """The bench command."""
+
+    def test_writes_results(self, app, tmp_path):
+        """A run times every hot path and stores the results."""
+        output = tmp_path / "bench.json"
+        result = app.test_cli_runner().invoke(
+            args=["bench", "-u", "3", "-n", "30", "-r", "2", "-o", str(output)]
+        )
+        assert result.exit_code == 0, result.output
+        report = json.loads(output.read_text())
+        assert report["database"] == "sqlite"
+        assert set(report["results"]) == {
+            "login",
+            "register",
+            "profile",
+            "crud_create",
+            "analytics_summary",
+            "rollup_totals",
+        }
+        assert report["results"]["login"]["runs"] == 2
+
+    def test_flags_regressions(self, app, tmp_path):
+        """Runs slower than the baseline fail."""
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps(_report(login=0.0001)))
+        result = app.test_cli_runner().invoke(
+            args=["bench", "-u", "2", "-n", "10", "-r", "1", "-b", str(baseline)]
+        )
+        assert result.exit_code == 1
+        assert "REGRESSION login" in result.output
+
+    def test_refuses_mismatched_baseline(self, app, tmp_path):
+        """A baseline of another data set is reported instead of compared."""
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps(dict(_report(login=0.0001), users=1000)))
+        result = app.test_cli_runner().invoke(
+            args=["bench", "-u", "2", "-n", "10", "-r", "1", "-b", str(baseline)]
+        )
+        assert result.exit_code == 1
+        assert "Baseline not comparable: users 1000 != 2" in result.output
+        assert "REGRESSION" not in result.output
+
+    def test_rejects_empty_runs(self, app):
+        """At least one user and one run are needed."""
+        result = app.test_cli_runner().invoke(args=["bench", "-u", "0"])
+        assert result.exit_code == 2
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Two-tier cache tests."""
+import threading
+
+import pytest
+from flask_caching.backends import FileSystemCache, SimpleCache
+
+from app.app import create_app
+from app.cache import LOG_KEY, SEQUENCE_KEY, TieredCache
+from app.extensions import cache
+
+
+@pytest.fixture
+def shared():
+    """Cache shared between two worker processes."""
+    return SimpleCache(threshold=1000)
+
+
+@pytest.fixture
+def workers(shared):
+    """Two workers with their own L1 in front of the shared cache."""
+    return (
+        TieredCache(shared, sync_interval=0),
+        TieredCache(shared, sync_interval=0),
+    )
+
+
+class TestTieredCache:
+    """Tiered cache."""
+
+    def test_app_uses_tiered_cache(self, app):
+        """The app cache is configured from the settings."""
+        backend = app.extensions["cache"][cache]
+        assert isinstance(backend, TieredCache)
+        assert isinstance(backend.l2, SimpleCache)
+
+    def test_reads_served_from_l1(self, shared, workers):
+        """Hits do not reach the shared cache."""
+        first, _ = workers
+        first.set("key", "value")
+        shared.delete("key")
+        assert first.get("key") == "value"
+
+    def test_miss_fills_l1(self, shared, workers):
+        """Values found in the shared cache are kept locally."""
+        first, second = workers
+        first.set("key", "value")
+        assert second.get("key") == "value"
+        shared.delete("key")
+        assert second.get("key") == "value"
+
+    def test_l1_returns_copies(self, workers):
+        """Mutating a cached value does not change the cache."""
+        first, _ = workers
+        first.set("key", ["value"])
+        first.get("key").append("other")
+        assert first.get("key") == ["value"]
+
+    def test_set_invalidates_other_workers(self, workers):
+        """A write in one worker drops stale copies in the others."""
+        first, second = workers
+        first.set("key", "old")
+        assert second.get("key") == "old"
+        first.set("key", "new")
+        assert second.get("key") == "new"
+
+    def test_delete_invalidates_other_workers(self, workers):
+        """A delete in one worker reaches the others."""
+        first, second = workers
+        first.set("key", "value")
+        assert second.get("key") == "value"
+        first.delete("key")
+        assert second.get("key") is None
+
+    def test_clear_invalidates_other_workers(self, workers):
+        """Clearing the cache empties every worker."""
+        first, second = workers
+        first.set("key", "value")
+        assert second.get("key") == "value"
+        first.clear()
+        assert second.get("key") is None
+
+    def test_log_gap_drops_l1(self, shared, workers):
+        """Missing log entries drop the whole L1."""
+        first, second = workers
+        second.set("other", "value")
+        first.set("key", "value")
+        assert second.get("key") == "value"
+        first.set("key", "new")
+        shared.delete(LOG_KEY.format(shared.get("tiered-cache:sequence")))
+        shared.set("other", "changed")
+        assert second.get("other") == "changed"
+
+    def test_long_gap_drops_l1(self, shared):
+        """More entries than L1 holds drop it without reading the log."""
+        writer = TieredCache(shared, sync_interval=0)
+        reader = TieredCache(shared, l1_size=2, sync_interval=0)
+        reader.set("key", "value")
+        for n in range(3):
+            writer.delete(f"other{n}")
+
+        def no_log_reads(*keys):
+            raise AssertionError("the log should not be read")
+
+        shared.get_many = no_log_reads
+        shared.set("key", "changed")
+        assert reader.get("key") == "changed"
+
+    def test_concurrent_writers_get_distinct_entries(self, tmp_path):
+        """Writers sharing a cache directory never claim the same log entry."""
+        shared = FileSystemCache(str(tmp_path), threshold=0)
+        workers = [
+            TieredCache(FileSystemCache(str(tmp_path), threshold=0)) for _ in range(3)
+        ]
+
+        def publish(worker, n):
+            for i in range(25):
+                worker.delete(f"key-{n}-{i}")
+
+        threads = [
+            threading.Thread(target=publish, args=(worker, n))
+            for n, worker in enumerate(workers * 2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert shared.get(SEQUENCE_KEY) == 150
+        logged = shared.get_many(*(LOG_KEY.format(n) for n in range(1, 151)))
+        assert sorted(logged) == sorted(
+            f"key-{n}-{i}" for n in range(6) for i in range(25)
+        )
+
+    def test_sync_interval(self, shared):
+        """Invalidations are read at most once per sync interval."""
+        first = TieredCache(shared, sync_interval=0)
+        second = TieredCache(shared, sync_interval=3600)
+        first.set("key", "old")
+        assert second.get("key") == "old"
+        first.set("key", "new")
+        assert second.get("key") == "old"
+        second.sync(force=True)
+        assert second.get("key") == "new"
+
+    def test_lru_eviction(self, shared):
+        """The least recently used entries are evicted from L1."""
+        worker = TieredCache(shared, l1_size=2, sync_interval=0)
+        for key in ("a", "b", "c"):
+            worker.set(key, key)
+        assert list(worker._l1) == ["b", "c"]
+        worker.get("b")
+        worker.set("d", "d")
+        assert list(worker._l1) == ["b", "d"]
+
+    def test_l1_timeout(self, shared):
+        """Entries expire from L1 after the L1 timeout."""
+        worker = TieredCache(shared, l1_timeout=0, sync_interval=0)
+        worker.set("key", "value")
+        shared.set("key", "changed")
+        assert worker.get("key") == "changed"
+
+    def test_counters(self, workers):
+        """Counters live in the shared cache."""
+        first, second = workers
+        assert first.inc("counter") == 1
+        assert second.inc("counter", 2) == 3
+        assert first.dec("counter") == 2
+        assert second.get("counter") == 2
+
+    def test_filesystem_l2(self, tmp_path):
+        """Workers of the same host can share a cache directory."""
+        config = {"CACHE_L2_TYPE": "FileSystemCache", "CACHE_DIR": str(tmp_path)}
+        first = create_app("tests.settings", config)
+        second = create_app("tests.settings", config)
+        first_cache = first.extensions["cache"][cache]
+        second_cache = second.extensions["cache"][cache]
+        first_cache.set("key", "old")
+        assert second_cache.get("key") == "old"
+        first_cache.set("key", "new")
+        assert second_cache.get("key") == "new"
@@ -1,11 +1,25 @@
 # -*- coding: utf-8 -*-
 """Database unit tests."""
+import datetime as dt
+
 import pytest
 from flask_login import UserMixin
 from sqlalchemy import text
 from sqlalchemy.orm.exc import ObjectDeletedError
 
-from app.database import Column, TableModel, db
+from app.database import (
+    Column,
+    InvalidCursor,
+    LazyLoadError,
+    TableModel,
+    db,
+    decode_cursor,
+    encode_cursor,
+    relationship,
+)
+from app.user.models import Role, User
+
+from .factories import LineItemFactory
 
 
 class ExampleUserModel(UserMixin, TableModel):
@@ -67,3 +81,255 @@ class TestTableModel:
     def test_get_by_id_wrong_type(self):
         """Test get_by_id returns None for non-numeric argument."""
         assert ExampleUserModel.get_by_id("xyz") is None
+
+
+@pytest.mark.usefixtures("db")
+class TestBulkOperations:
+    """CRUDMixin bulk API tests."""
+
+    def test_bulk_create_from_dicts(self):
+        """Insert dict records in several chunks."""
+        records = ({"username": f"u{i}", "email": f"u{i}@bar.com"} for i in range(5))
+        assert ExampleUserModel.bulk_create(records, chunk_size=2) == 5
+        assert ExampleUserModel.query.count() == 5
+
+    def test_bulk_create_from_instances(self):
+        """Insert model instances without adding them to the session."""
+        users = [ExampleUserModel(f"u{i}", f"u{i}@bar.com") for i in range(3)]
+        assert ExampleUserModel.bulk_create(users) == 3
+        assert {user.username for user in ExampleUserModel.query} == {"u0", "u1", "u2"}
+
+    def test_bulk_create_returning(self):
+        """Return the requested columns in input order."""
+        rows = ExampleUserModel.bulk_create(
+            [
+                {"username": "b", "email": "b@bar.com"},
+                {"username": "a", "email": "a@bar.com"},
+            ],
+            returning=(ExampleUserModel.id, ExampleUserModel.username),
+        )
+        assert [row.username for row in rows] == ["b", "a"]
+        assert ExampleUserModel.get_by_id(rows[0].id).username == "b"
+
+    def test_bulk_create_ignore_conflicts(self):
+        """Skip rows conflicting with existing ones, counting only inserted rows."""
+        ExampleUserModel.create(username="foo", email="foo@bar.com")
+        records = [
+            {"username": "foo", "email": "other@bar.com"},
+            {"username": "bar", "email": "bar@bar.com"},
+        ]
+        assert ExampleUserModel.bulk_create(records, ignore_conflicts=["username"]) == 1
+        rows = ExampleUserModel.bulk_create(
+            records + [{"username": "baz", "email": "baz@bar.com"}],
+            returning=(ExampleUserModel.username,),
+            ignore_conflicts=["username"],
+        )
+        assert [row.username for row in rows] == ["baz"]
+        assert ExampleUserModel.query.filter_by(username="foo").one().email == (
+            "foo@bar.com"
+        )
+
+    def test_bulk_upsert(self):
+        """Update existing rows and insert new ones."""
+        user = ExampleUserModel.create(username="foo", email="foo@bar.com")
+        count = ExampleUserModel.bulk_upsert(
+            [
+                {"id": user.id, "username": "foo", "email": "new@bar.com"},
+                {"username": "bar", "email": "bar@bar.com"},
+            ],
+            index_elements=["username"],
+        )
+        assert count == 2
+        db.session.expire_all()
+        assert ExampleUserModel.get_by_id(user.id).email == "new@bar.com"
+        assert ExampleUserModel.query.count() == 2
+
+    def test_bulk_upsert_mixed_keys(self):
+        """Each record updates the columns it gives, whatever the other records give."""
+        User.create(username="foo", email="foo@bar.com", first_name="Foo")
+        User.create(username="bar", email="bar@bar.com")
+        User.bulk_upsert(
+            [
+                {"username": "foo", "email": "foo@baz.com"},
+                {"username": "bar", "email": "bar@baz.com", "first_name": "Bar"},
+            ],
+            index_elements=["username"],
+        )
+        db.session.expire_all()
+        users = {user.username: user for user in User.query}
+        assert users["foo"].email == "foo@baz.com"
+        assert users["foo"].first_name == "Foo"
+        assert users["bar"].first_name == "Bar"
+
+    def test_bulk_upsert_unknown_column(self):
+        """Keys that are not columns are rejected up front."""
+        with pytest.raises(ValueError, match="Unknown ExampleUserModel columns: nope"):
+            ExampleUserModel.bulk_upsert([{"username": "foo", "nope": 1}])
+
+    def test_bulk_update(self):
+        """Update rows by primary key, each with the columns it gives."""
+        first, second = ExampleUserModel.bulk_create(
+            [{"username": f"u{i}", "email": f"u{i}@bar.com"} for i in range(2)],
+            returning=(ExampleUserModel.id,),
+        )
+        count = ExampleUserModel.bulk_update(
+            [
+                {"id": first.id, "username": "a"},
+                {"id": second.id, "email": "b@bar.com"},
+            ]
+        )
+        assert count == 2
+        assert {(user.username, user.email) for user in ExampleUserModel.query} == {
+            ("a", "u0@bar.com"),
+            ("u1", "b@bar.com"),
+        }
+
+    def test_bulk_delete(self):
+        """Delete by instance and by primary key."""
+        users = [
+            ExampleUserModel.create(username=f"u{i}", email=f"u{i}@bar.com")
+            for i in range(3)
+        ]
+        assert ExampleUserModel.bulk_delete([users[0], users[1].id]) == 2
+        assert [user.username for user in ExampleUserModel.query] == ["u2"]
+
+    def test_bulk_without_commit(self, db):
+        """Rows are rolled back when the caller does not commit."""
+        ExampleUserModel.bulk_create(
+            [{"username": "foo", "email": "foo@bar.com"}], commit=False
+        )
+        db.session.rollback()
+        assert ExampleUserModel.query.count() == 0
+
+
+@pytest.mark.usefixtures("db")
+class TestKeysetPagination:
+    """TableModel.seek tests."""
+
+    def test_walks_all_pages_newest_first(self):
+        """Following next_cursor visits every record exactly once."""
+        ExampleUserModel.bulk_create(
+            {"username": f"u{i}", "email": f"u{i}@bar.com"} for i in range(7)
+        )
+        seen, cursor = [], None
+        while True:
+            page = ExampleUserModel.seek(cursor, per_page=3)
+            seen.extend(user.username for user in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        assert seen == [f"u{i}" for i in reversed(range(7))]
+
+    def test_filtered_query_and_page_size_cap(self):
+        """The given query is paginated and page sizes are bounded."""
+        ExampleUserModel.bulk_create(
+            {"username": f"u{i}", "email": f"u{i}@bar.com"} for i in range(3)
+        )
+        query = ExampleUserModel.query.filter(ExampleUserModel.username != "u1")
+        page = ExampleUserModel.seek(per_page=0, query=query)
+        assert [user.username for user in page.items] == ["u2"]
+        assert ExampleUserModel.seek(query=query, per_page=10**6).next_cursor is None
+
+    @pytest.mark.parametrize(
+        "cursor",
+        [
+            "garbage!",
+            encode_cursor([1]),
+            "e30",
+            encode_cursor(["2024-01-02T03:04:00", "5"]),
+            encode_cursor(["2024-01-02T03:04:00", 5.5]),
+            encode_cursor(["2024-01-02T03:04:00", None]),
+        ],
+    )
+    def test_invalid_cursor(self, cursor):
+        """Cursors not made by seek are rejected."""
+        with pytest.raises(InvalidCursor):
+            ExampleUserModel.seek(cursor)
+
+
+@pytest.mark.usefixtures("db")
+class TestTimestamps:
+    """Database side timestamps and TableModel.between tests."""
+
+    def test_server_defaults(self):
+        """Timestamps are set by the database, in UTC, when not given."""
+        before = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+        user = ExampleUserModel.create(username="foo", email="foo@bar.com")
+        assert before - dt.timedelta(seconds=1) <= user.created_at
+        assert user.updated_at >= user.created_at
+
+    def test_update_refreshes_updated_at(self):
+        """Updating a record moves updated_at forward, but not created_at."""
+        start = dt.datetime(2024, 1, 1)
+        user = ExampleUserModel.create(username="foo", email="foo@bar.com")
+        user.update(created_at=start, updated_at=start)
+        user.update(email="new@bar.com")
+        assert user.created_at == start
+        assert user.updated_at > start
+
+    def test_between_is_half_open(self):
+        """Records in [start, end) are returned oldest first."""
+        start = dt.datetime(2024, 1, 1)
+        ExampleUserModel.bulk_create(
+            {
+                "username": f"u{day}",
+                "email": f"u{day}@bar.com",
+                "created_at": start + dt.timedelta(days=day),
+            }
+            for day in reversed(range(4))
+        )
+        within = ExampleUserModel.between(
+            start + dt.timedelta(days=1), start + dt.timedelta(days=3)
+        )
+        assert [user.username for user in within] == ["u1", "u2"]
+        assert [user.username for user in ExampleUserModel.between(end=start)] == []
+        assert ExampleUserModel.between(start).count() == 4
+
+    def test_between_column_and_query(self):
+        """Another column and a filtered query can be given."""
+        start = dt.datetime(2024, 1, 1)
+        ExampleUserModel.bulk_create(
+            {
+                "username": f"u{day}",
+                "email": f"u{day}@bar.com",
+                "updated_at": start + dt.timedelta(days=day),
+            }
+            for day in range(3)
+        )
+        query = ExampleUserModel.query.filter(ExampleUserModel.username != "u1")
+        users = ExampleUserModel.between(
+            start, column=ExampleUserModel.updated_at, query=query
+        )
+        assert [user.username for user in users] == ["u0", "u2"]
+
+
+@pytest.mark.usefixtures("db")
+class TestLoading:
+    """Relationship loading strategies."""
+
+    def test_lazy_loads_raise_in_tests(self, user):
+        """Relationships not loaded up front fail loudly."""
+        Role.create(name="admin", user=user)
+        db.session.expire_all()
+        with pytest.raises(LazyLoadError, match="User.roles"):
+            User.query.one().roles
+
+    def test_loading_dotted_paths(self, user, count_queries):
+        """Nested relationships are loaded by the options of one query."""
+        LineItemFactory.create_batch(3, receipt__user=user)
+        db.session.commit()
+        with count_queries() as queries:
+            query = User.query.options(*User.loading("receipts.line_items"))
+            assert sum(len(r.line_items) for r in query.one().receipts) == 3
+        queries.assert_budget(queries=3)
+
+    def test_unknown_strategy(self):
+        """Typos in loading strategies fail when the model is defined."""
+        with pytest.raises(ValueError, match="Unknown loading strategy 'selectinn'"):
+            relationship("User", lazy="selectinn")
+
+
+def test_cursor_round_trip():
+    """Datetimes are encoded as ISO strings."""
+    cursor = encode_cursor((dt.datetime(2024, 1, 2, 3, 4), 5))
+    assert decode_cursor(cursor) == ["2024-01-02T03:04:00", 5]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Duplicate receipt detection tests."""
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app.database import db
+from app.receipt.dedup import BloomFilter, Deduplicator, fingerprint
+from app.receipt.importer import import_stream, insert_batch, normalize, read_csv
+from app.receipt.models import DailyMerchantSpend, Receipt
+
+from .factories import ReceiptFactory, UserFactory
+from .test_importer import CSV_EXPORT
+
+RECEIPT = {
+    "merchant": "Tesco",
+    "purchased_at": datetime(2024, 3, 2, 18, 0, 5),
+    "total": Decimal("3.40"),
+    "currency": "CZK",
+}
+ITEMS = [
+    {"description": "Milk", "quantity": Decimal(2), "amount": Decimal("2.40")},
+    {"description": "Bread", "quantity": Decimal(1), "amount": Decimal("1.00")},
+]
+
+
+class TestFingerprint:
+    """Fingerprints of normalized receipts."""
+
+    def test_stable(self):
+        """Item order, case, categories and seconds do not matter."""
+        same = fingerprint(
+            dict(RECEIPT, merchant="TESCO", purchased_at=datetime(2024, 3, 2, 18, 0)),
+            [
+                dict(ITEMS[1], description="BREAD", category="bakery"),
+                dict(ITEMS[0], quantity=Decimal("2.000")),
+            ],
+        )
+        assert same == fingerprint(RECEIPT, ITEMS)
+        assert len(same) == 64
+
+    @pytest.mark.parametrize(
+        "receipt, items",
+        [
+            (dict(RECEIPT, merchant="Lidl"), ITEMS),
+            (dict(RECEIPT, total=Decimal("3.41")), ITEMS),
+            (dict(RECEIPT, currency=None), ITEMS),
+            (dict(RECEIPT, purchased_at=datetime(2024, 3, 2, 18, 1)), ITEMS),
+            (RECEIPT, ITEMS[:1]),
+            (RECEIPT, [dict(ITEMS[0], amount=Decimal("2.41")), ITEMS[1]]),
+        ],
+    )
+    def test_distinguishes(self, receipt, items):
+        """Receipts differing in anything else get different fingerprints."""
+        assert fingerprint(receipt, items) != fingerprint(RECEIPT, ITEMS)
+
+
+class TestBloomFilter:
+    """The probabilistic prefilter."""
+
+    def test_no_false_negatives(self):
+        """Every added key is reported present."""
+        bloom = BloomFilter(1000)
+        keys = [f"key{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        assert all(key in bloom for key in keys)
+
+    def test_false_positive_rate(self):
+        """Keys never added are rarely reported present at capacity."""
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"key{i}")
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        assert false_positives < 300
+
+
+@pytest.mark.usefixtures("db")
+class TestDeduplication:
+    """Skipping receipts a user already has on import."""
+
+    def test_reimport_is_skipped(self, user):
+        """Importing the same export again adds nothing."""
+        first = import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        again = import_stream(io.StringIO(CSV_EXPORT), user.id, "csv", batch_size=1)
+        assert (first.receipts, first.duplicates) == (2, 0)
+        assert (again.receipts, again.line_items, again.duplicates) == (0, 0, 2)
+        assert Receipt.query.count() == 2
+        assert {row.receipt_count for row in DailyMerchantSpend.query} == {1}
+
+    def test_duplicates_within_a_file(self, user):
+        """A receipt repeated in one export is imported once."""
+        export = CSV_EXPORT + CSV_EXPORT.split("\n", 1)[1].replace("A", "B")
+        stats = import_stream(io.StringIO(export), user.id, "csv")
+        assert (stats.receipts, stats.line_items, stats.duplicates) == (2, 3, 2)
+
+    def test_other_users_are_not_duplicates(self, user):
+        """Fingerprints are unique per user."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        other = UserFactory()
+        db.session.commit()
+        stats = import_stream(io.StringIO(CSV_EXPORT), other.id, "csv")
+        assert stats.receipts == 2
+
+    def test_only_possible_duplicates_are_looked_up(self, user):
+        """New receipts pass the filter without a database lookup."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        deduplicator = Deduplicator(user.id)
+        batch = [(dict(RECEIPT, merchant=f"Shop {i}"), ITEMS) for i in range(100)]
+        assert len(deduplicator.filter(batch)) == 100
+        assert deduplicator.lookups < 10
+
+    def test_concurrent_import_conflicts_are_skipped(self, user):
+        """Receipts stored after the run loaded its filter are skipped by the index."""
+        deduplicator = Deduplicator(user.id)
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        batch = [normalize(record) for record in read_csv(io.StringIO(CSV_EXPORT))]
+        assert insert_batch(batch, user.id, deduplicator) == (0, 0)
+        assert Receipt.query.count() == 2
+
+    def test_receipts_without_fingerprint(self, user):
+        """Receipts entered by hand never conflict."""
+        ReceiptFactory(user=user, merchant="Tesco")
+        ReceiptFactory(user=user, merchant="Tesco")
+        db.session.commit()
+        assert Receipt.query.filter(Receipt.fingerprint.is_(None)).count() == 2
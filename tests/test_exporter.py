@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Receipt export tests."""
+import gzip
+import io
+import json
+from datetime import date
+
+import pytest
+
+from app.database import db
+from app.receipt import exporter
+from app.receipt.exporter import export
+from app.receipt.importer import import_stream
+
+from .factories import ReceiptFactory, UserFactory
+from .test_importer import CSV_EXPORT
+
+
+def exported(*args, **kwargs):
+    """Return a whole export as text."""
+    return b"".join(export(*args, **kwargs)).decode()
+
+
+@pytest.mark.usefixtures("db")
+class TestExport:
+    """Streaming a user's data out."""
+
+    def test_csv_round_trip(self, user):
+        """CSV exports hold one line item per row and import again as they were."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        text = exported(user.id)
+        assert text.splitlines()[1:] == [
+            "A1,Starbucks Prague,2024-03-01T08:15:00,7.50,CZK,,Latte,dining,1.000,4.50",
+            "A1,Starbucks Prague,2024-03-01T08:15:00,7.50,CZK,,Croissant,dining,"
+            "1.000,3.00",
+            "A2,Tesco,2024-03-02T16:00:00,2.40,,weekly shop,Milk,groceries,2.000,2.40",
+        ]
+        other = UserFactory()
+        db.session.commit()
+        stats = import_stream(io.StringIO(text), other.id, "csv")
+        assert (stats.receipts, stats.line_items, stats.rejected) == (2, 3, 0)
+        assert exported(other.id) == text
+
+    def test_ndjson(self, user):
+        """NDJSON exports hold one receipt per line with its items."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        records = [
+            json.loads(line)
+            for line in exported(user.id, fmt="ndjson").split("\n")[:-1]
+        ]
+        assert [record["receipt_id"] for record in records] == ["A1", "A2"]
+        assert records[0]["items"][1] == {
+            "description": "Croissant",
+            "category": "dining",
+            "quantity": "1.000",
+            "amount": "3.00",
+        }
+
+    def test_receipts_without_items(self, user):
+        """Receipts entered by hand are exported under their own id."""
+        receipt = ReceiptFactory(user=user, merchant="Kiosk", external_id=None)
+        receipt.save()
+        rows = exported(user.id).splitlines()
+        assert rows[1].startswith(f"{receipt.id},Kiosk,")
+        assert rows[1].endswith(",,,,")
+
+    def test_date_range(self, user):
+        """Only receipts and rollups of days in [start, end) are exported."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        march_2 = dict(start=date(2024, 3, 2), end=date(2024, 3, 3))
+        assert [line[:2] for line in exported(user.id, **march_2).splitlines()[1:]] == [
+            "A2"
+        ]
+        assert exported(user.id, "merchants", **march_2).splitlines() == [
+            "day,merchant,amount,receipt_count",
+            "2024-03-02,Tesco,2.40,1",
+        ]
+
+    def test_rollups(self, user):
+        """Daily category spend is exported in primary key order."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        assert exported(user.id, "categories").splitlines() == [
+            "day,category,amount,item_count",
+            "2024-03-01,dining,7.50,2",
+            "2024-03-02,groceries,2.40,1",
+        ]
+
+    def test_streams_in_chunks(self, user, monkeypatch):
+        """Output is yielded as the buffer fills, not all at the end."""
+        monkeypatch.setattr(exporter, "BUFFER_SIZE", 10)
+        ReceiptFactory.create_batch(5, user=user)
+        db.session.commit()
+        chunks = list(export(user.id))
+        # The header goes out with the first receipt, the last chunk is empty.
+        assert len(chunks) == 6
+        assert not chunks[-1]
+
+    def test_gzip(self, user):
+        """Gzipped exports decompress to the plain export."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        compressed = b"".join(export(user.id, gzip=True))
+        assert gzip.decompress(compressed).decode() == exported(user.id)
+
+    def test_export_command(self, app, user, tmp_path):
+        """The CLI writes the export, gzipped for .gz files."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        path = tmp_path / "receipts.ndjson.gz"
+        result = app.test_cli_runner().invoke(
+            args=["receipts", "export", "--user", user.username, "-o", str(path)]
+        )
+        assert result.exit_code == 0, result.output
+        assert gzip.decompress(path.read_bytes()).decode() == exported(
+            user.id, fmt="ndjson"
+        )
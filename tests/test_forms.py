@@ -2,7 +2,9 @@
 """Test forms."""
 
 from app.public.forms import LoginForm
-from app.user.forms import RegisterForm
+from app.user.forms import EditProfileForm, RegisterForm
+
+from .factories import UserFactory
 
 
 class TestRegisterForm:
@@ -29,6 +31,21 @@ class TestRegisterForm:
         assert form.validate() is False
         assert "Email already registered" in form.email.errors
 
+    def test_validate_both_already_registered(self, user):
+        """Both taken fields are reported at once."""
+        other = UserFactory()
+        other.save()
+        form = RegisterForm(
+            username=user.username,
+            email=other.email,
+            password="example",
+            confirm="example",
+        )
+
+        assert form.validate() is False
+        assert "Username already registered" in form.username.errors
+        assert "Email already registered" in form.email.errors
+
     def test_validate_success(self, db):
         """Register with success."""
         form = RegisterForm(
@@ -40,6 +57,35 @@ class TestRegisterForm:
         assert form.validate() is True
 
 
+class TestEditProfileForm:
+    """Edit profile form."""
+
+    def test_validate_keeps_own_username_and_email(self, user):
+        """The edited user's own values are not conflicts."""
+        form = EditProfileForm(
+            user=user,
+            username=user.username,
+            email=user.email,
+            first_name="First",
+            last_name="Last",
+        )
+        assert form.validate() is True
+
+    def test_validate_username_taken(self, user):
+        """Another user's username cannot be taken."""
+        other = UserFactory()
+        other.save()
+        form = EditProfileForm(
+            user=user,
+            username=other.username,
+            email=user.email,
+            first_name="First",
+            last_name="Last",
+        )
+        assert form.validate() is False
+        assert "Username already registered" in form.username.errors
+
+
 class TestLoginForm:
     """Login form."""
 
@@ -3,11 +3,18 @@
 
 See: http://webtest.readthedocs.org/
 """
+import gzip
+
+import pytest
 from flask import url_for
 
+from app.database import DEFAULT_PAGE_SIZE, encode_cursor
+from app.jobs.models import Job
+from app.jobs.queue import Worker
+from app.receipt.models import Receipt
 from app.user.models import User
 
-from .factories import UserFactory
+from .factories import LineItemFactory, ReceiptFactory, UserFactory
 
 
 class TestLoggingIn:
@@ -118,3 +125,288 @@ class TestRegistering:
         res = form.submit()
         # sees error
         assert "Username already registered" in res
+
+    def test_concurrent_registration(self, user, testapp, monkeypatch):
+        """A sign-up racing another one shows an error instead of failing."""
+        find_conflicts = User.find_conflicts
+        calls = []
+
+        def racing_find_conflicts(*args, **kwargs):
+            # The other sign-up commits right after this one validated.
+            calls.append(args)
+            return set() if len(calls) == 1 else find_conflicts(*args, **kwargs)
+
+        monkeypatch.setattr(User, "find_conflicts", racing_find_conflicts)
+        res = testapp.get(url_for("public.register"))
+        form = res.forms["registerForm"]
+        form["username"] = user.username
+        form["email"] = "foo@bar.com"
+        form["password"] = "secret"
+        form["confirm"] = "secret"
+        res = form.submit()
+        assert res.status_code == 200
+        assert "Username already registered" in res
+
+
+class TestAnalytics:
+    """Spend analytics page."""
+
+    def test_shows_monthly_and_category_totals(self, user, testapp):
+        """Logged in users see their spend statistics."""
+        LineItemFactory.create_batch(8, receipt__user=user)
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        res = form.submit().follow()
+        res = res.click("See your spending")
+        assert res.status_code == 200
+        assert "January 2024" in res
+        assert "groceries" in res
+
+
+class TestMembers:
+    """Keyset paginated listings."""
+
+    def test_members_are_paginated(self, user, testapp):
+        """The members page links to the next page through an opaque cursor."""
+        UserFactory.create_batch(4)
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        res = form.submit().follow()
+        res = testapp.get(url_for("user.members", per_page=3))
+        assert len(res.html.select("#members tr")) == 4
+        res = res.click("Next page")
+        assert len(res.html.select("#members tr")) == 3
+        assert "Next page" not in res
+
+    def test_invalid_cursor_is_a_bad_request(self, user, testapp):
+        """Tampered cursors are rejected."""
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit()
+        testapp.get(url_for("user.receipts", cursor="nope"), status=400)
+        cursor = encode_cursor(["2024-01-02T03:04:00", "1 OR 1=1"])
+        testapp.get(url_for("user.receipts", cursor=cursor), status=400)
+
+
+class TestSearch:
+    """Receipt search."""
+
+    def test_search_is_paginated(self, user, testapp):
+        """Results link to the next page, keeping the query."""
+        ReceiptFactory.create_batch(4, user=user, merchant="Coffee Place")
+        ReceiptFactory(user=user, merchant="Bakery").save()
+        TestQueryBudgets.login(user, testapp).submit()
+        res = testapp.get(url_for("search.receipts", q="coffee", per_page=3))
+        assert len(res.html.select("#results tr")) == 4
+        res = res.click("Next page")
+        assert len(res.html.select("#results tr")) == 2
+        assert "Next page" not in res
+
+    def test_invalid_cursor_is_a_bad_request(self, user, testapp):
+        """Tampered cursors are rejected."""
+        TestQueryBudgets.login(user, testapp).submit()
+        testapp.get(url_for("search.receipts", q="x", cursor="nope"), status=400)
+
+    def test_requires_login(self, testapp):
+        """Anonymous users cannot search."""
+        testapp.get(url_for("search.receipts", q="x"), status=401)
+
+
+class TestExport:
+    """Receipt and rollup downloads."""
+
+    def test_download_csv(self, user, testapp):
+        """The receipts page links to the CSV export of the user's receipts."""
+        ReceiptFactory(user=user, merchant="Bakery").save()
+        ReceiptFactory(user=UserFactory(), merchant="Elsewhere").save()
+        TestQueryBudgets.login(user, testapp).submit()
+        res = testapp.get(url_for("user.receipts")).click("CSV")
+        assert res.content_type == "text/csv"
+        assert res.headers["Content-Disposition"] == (
+            'attachment; filename="receipts.csv"'
+        )
+        assert "Bakery" in res
+        assert "Elsewhere" not in res
+
+    def test_gzip(self, app, user):
+        """Clients accepting gzip get the export compressed."""
+        ReceiptFactory(user=user, merchant="Bakery").save()
+        # WebTest decodes responses, so this uses Flask's client instead.
+        client = app.test_client()
+        client.post("/", data={"username": user.username, "password": "myprecious"})
+        res = client.get(
+            url_for("user.export", dataset="receipts", fmt="ndjson"),
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert res.headers["Content-Encoding"] == "gzip"
+        assert res.headers["Vary"] == "Accept-Encoding"
+        assert b'"merchant":"Bakery"' in gzip.decompress(res.data)
+
+    @pytest.mark.parametrize(
+        "dataset, fmt, query, status",
+        [
+            ("users", "csv", {}, 404),
+            ("receipts", "xlsx", {}, 404),
+            ("receipts", "csv", {"start": "last year"}, 400),
+        ],
+    )
+    def test_bad_requests(self, user, testapp, dataset, fmt, query, status):
+        """Unknown datasets and formats are not found, bad dates rejected."""
+        TestQueryBudgets.login(user, testapp).submit()
+        testapp.get(
+            url_for("user.export", dataset=dataset, fmt=fmt, **query), status=status
+        )
+
+    def test_requires_login(self, testapp):
+        """Anonymous users cannot export."""
+        testapp.get(url_for("user.export", dataset="receipts", fmt="csv"), status=401)
+
+
+class TestUpload:
+    """Receipt export uploads."""
+
+    def test_upload_is_imported_by_the_worker(self, app, user, testapp, tmp_path):
+        """Uploads only queue an import; the receipts appear once the worker ran."""
+        app.config["UPLOAD_DIR"] = str(tmp_path)
+        TestQueryBudgets.login(user, testapp).submit()
+        form = testapp.get(url_for("user.receipts")).click("Upload an export").form
+        form["file"] = (
+            "export.csv",
+            b"merchant,purchased_at,total\nBakery,2024-03-01T08:00:00,3.50\n",
+        )
+        res = form.submit().follow()
+        assert "being imported" in res
+        assert "No receipts yet." in res
+        assert Job.query.one().payload["filename"] == "export.csv"
+        Worker().run_once()
+        assert "Bakery" in testapp.get(url_for("user.receipts"))
+        assert Receipt.query.count() == 1
+        assert list(tmp_path.iterdir()) == []
+
+    def test_rejects_other_files(self, app, user, testapp, tmp_path):
+        """Only CSV and JSONL exports are accepted."""
+        app.config["UPLOAD_DIR"] = str(tmp_path)
+        TestQueryBudgets.login(user, testapp).submit()
+        form = testapp.get(url_for("user.upload")).form
+        form["file"] = ("photo.png", b"\x89PNG")
+        res = form.submit()
+        assert "CSV or JSONL exports only" in res
+        assert Job.query.count() == 0
+
+    def test_requires_login(self, testapp):
+        """Anonymous users cannot upload."""
+        testapp.get(url_for("user.upload"), status=401)
+
+
+class TestProfile:
+    """User profile."""
+
+    def test_edit_profile_taken_email(self, user, testapp):
+        """Taking another user's email shows an error."""
+        other = UserFactory()
+        other.save()
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit()
+        res = testapp.get(url_for("user.edit_profile"))
+        form = res.forms["updateForm"]
+        form["email"] = other.email
+        form["first_name"] = "First"
+        form["last_name"] = "Last"
+        res = form.submit()
+        assert "Email already registered" in res
+        assert User.get_by_id(user.id).email == user.email
+
+    def test_profile_shows_current_user(self, user, testapp):
+        """The profile renders the logged in user."""
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit()
+        res = testapp.get(url_for("user.user"))
+        assert f"User: {user.username}" in res
+        assert "Edit your profile" in res
+
+
+class TestQueryBudgets:
+    """Upper bounds on the queries each page runs."""
+
+    @staticmethod
+    def login(user, testapp):
+        """Log ``user`` in."""
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        return form
+
+    def test_home(self, user, testapp, count_queries):
+        """The home page does not query for anonymous users."""
+        with count_queries() as queries:
+            testapp.get("/")
+        queries.assert_budget(queries=0)
+
+    def test_register(self, user, testapp, count_queries):
+        """The registration form does not query."""
+        with count_queries() as queries:
+            testapp.get(url_for("public.register"))
+        queries.assert_budget(queries=0)
+
+    def test_login(self, user, testapp, count_queries):
+        """Logging in loads one user."""
+        form = self.login(user, testapp)
+        with count_queries() as queries:
+            form.submit()
+        queries.assert_budget(queries=1, rows=1)
+
+    def test_members(self, user, testapp, count_queries):
+        """The members page fetches one page of users with one query."""
+        UserFactory.create_batch(DEFAULT_PAGE_SIZE + 5)
+        self.login(user, testapp).submit()
+        with count_queries() as queries:
+            testapp.get(url_for("user.members"))
+        queries.assert_budget(queries=1, rows=DEFAULT_PAGE_SIZE + 1)
+
+    def test_search(self, user, testapp, count_queries):
+        """Searching fetches one page of receipts with one query."""
+        ReceiptFactory.create_batch(
+            DEFAULT_PAGE_SIZE + 5, user=user, merchant="Coffee Place"
+        )
+        self.login(user, testapp).submit()
+        with count_queries() as queries:
+            testapp.get(url_for("search.receipts", q="coffee"))
+        queries.assert_budget(queries=1, rows=DEFAULT_PAGE_SIZE + 1)
+
+    def test_export(self, user, testapp, count_queries):
+        """Exports stream every receipt and line item from one query."""
+        LineItemFactory.create_batch(DEFAULT_PAGE_SIZE + 5, receipt__user=user)
+        self.login(user, testapp).submit()
+        with count_queries() as queries:
+            testapp.get(url_for("user.export", dataset="receipts", fmt="csv"))
+        queries.assert_budget(queries=1, rows=DEFAULT_PAGE_SIZE + 5)
+
+    def test_upload(self, app, user, testapp, count_queries, tmp_path):
+        """Uploading queues the import with one insert and does not parse the file."""
+        app.config["UPLOAD_DIR"] = str(tmp_path)
+        self.login(user, testapp).submit()
+        form = testapp.get(url_for("user.upload")).form
+        form["file"] = ("export.csv", b"merchant,purchased_at,total\n" * 1000)
+        with count_queries() as queries:
+            form.submit()
+        queries.assert_budget(queries=1)
+
+    def test_profile(self, user, testapp, count_queries):
+        """The profile is rendered from the cached current user."""
+        self.login(user, testapp).submit()
+        with count_queries() as queries:
+            testapp.get(url_for("user.user"))
+        queries.assert_budget(queries=0)
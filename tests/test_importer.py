@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Receipt import pipeline tests."""
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app.receipt.importer import (
+    InvalidRecord,
+    import_file,
+    import_files,
+    import_stream,
+    normalize,
+    read_csv,
+)
+from app.receipt.models import LineItem, Receipt
+
+CSV_EXPORT = """receipt_id,merchant,purchased_at,total,currency,notes,description,category,quantity,amount
+A1,  Starbucks   Prague ,2024-03-01T08:15:00,7.50,czk,,Latte,Dining,1,4.50
+A1,  Starbucks   Prague ,2024-03-01T08:15:00,7.50,czk,,Croissant,Dining,1,3.00
+A2,Tesco,2024-03-02T18:00:00+02:00,,,weekly shop,Milk,groceries,2,2.40
+"""
+
+
+class TestNormalize:
+    """Record validation and normalization."""
+
+    def test_normalizes_receipt_fields(self):
+        """Whitespace, currency and timestamps are normalized."""
+        receipt, items = normalize(next(read_csv(io.StringIO(CSV_EXPORT))))
+        assert receipt["merchant"] == "Starbucks Prague"
+        assert receipt["currency"] == "CZK"
+        assert receipt["total"] == Decimal("7.50")
+        assert [item["category"] for item in items] == ["dining", "dining"]
+
+    def test_total_defaults_to_sum_of_items(self):
+        """A missing total is computed from the line items."""
+        receipt, _ = normalize(
+            {
+                "merchant": "Tesco",
+                "purchased_at": "2024-03-02",
+                "items": [{"description": "Milk", "amount": "1.20"}] * 2,
+            }
+        )
+        assert receipt["total"] == Decimal("2.40")
+
+    def test_converts_aware_timestamps_to_utc(self):
+        """Timezone-aware timestamps are stored as naive UTC."""
+        receipt, _ = normalize(
+            {"merchant": "Tesco", "purchased_at": "2024-03-02T18:00:00+02:00"}
+        )
+        assert receipt["purchased_at"] == datetime(2024, 3, 2, 16, 0)
+
+    @pytest.mark.parametrize(
+        "record",
+        [
+            {"purchased_at": "2024-03-02"},
+            {"merchant": "Tesco", "purchased_at": "yesterday"},
+            {
+                "merchant": "Tesco",
+                "purchased_at": "2024-03-02",
+                "items": [{"description": "Milk", "amount": "lots"}],
+            },
+            {"merchant": "Tesco", "purchased_at": "2024-03-02", "total": "Infinity"},
+            {"merchant": "Tesco", "purchased_at": "2024-03-02", "total": "NaN"},
+            {
+                "merchant": "Tesco",
+                "purchased_at": "2024-03-02",
+                "items": [{"description": "Milk", "amount": "-inf"}],
+            },
+            {"merchant": "Tesco", "purchased_at": "2024-03-02", "items": ["Milk"]},
+            {"merchant": "Tesco", "purchased_at": "2024-03-02", "items": "Milk"},
+            ["Tesco", "2024-03-02"],
+        ],
+    )
+    def test_rejects_invalid_records(self, record):
+        """Missing or malformed fields raise InvalidRecord."""
+        with pytest.raises(InvalidRecord):
+            normalize(record)
+
+
+@pytest.mark.usefixtures("db")
+class TestImport:
+    """Importing receipts into the database."""
+
+    def test_import_csv(self, user):
+        """Consecutive CSV rows are grouped into receipts."""
+        stats = import_stream(io.StringIO(CSV_EXPORT), user.id, "csv", batch_size=1)
+        assert (stats.receipts, stats.line_items, stats.rejected) == (2, 3, 0)
+        query = Receipt.query.options(*Receipt.loading("line_items"))
+        receipt = query.filter_by(external_id="A1").one()
+        assert receipt.user_id == user.id
+        assert sorted(item.description for item in receipt.line_items) == [
+            "Croissant",
+            "Latte",
+        ]
+
+    def test_import_jsonl_skips_invalid_lines(self, user):
+        """Bad records are counted and skipped without aborting the import."""
+        lines = [
+            json.dumps(
+                {
+                    "receipt_id": "B1",
+                    "merchant": "Lidl",
+                    "purchased_at": "2024-03-04T10:00:00",
+                    "items": [{"description": "Bread", "amount": 1.5}],
+                }
+            ),
+            "{not json",
+            json.dumps({"receipt_id": "B2", "purchased_at": "2024-03-04"}),
+        ]
+        stats = import_stream(io.StringIO("\n".join(lines)), user.id, "jsonl")
+        assert (stats.receipts, stats.line_items, stats.rejected) == (1, 1, 2)
+        assert LineItem.query.one().amount == Decimal("1.50")
+
+    def test_import_file(self, user, tmp_path):
+        """Files are read with the format detected from their extension."""
+        path = tmp_path / "export.csv"
+        path.write_text(CSV_EXPORT)
+        stats = import_file(str(path), user.id)
+        assert stats.path == str(path)
+        assert stats.rows == 5
+        assert Receipt.query.count() == 2
+
+    def test_import_files_reports_failures(self, user, tmp_path):
+        """A failing file is reported in its stats and the other files still import."""
+        good = tmp_path / "export.csv"
+        good.write_text(CSV_EXPORT)
+        missing = tmp_path / "missing.csv"
+        results = list(import_files([str(missing), str(good)], user.id))
+        assert results[0].path == str(missing)
+        assert results[0].error.startswith("FileNotFoundError")
+        assert not results[1].error
+        assert Receipt.query.count() == 2
+
+    def test_import_command(self, app, user, tmp_path):
+        """The CLI reports the number of imported rows."""
+        path = tmp_path / "export.csv"
+        path.write_text(CSV_EXPORT)
+        runner = app.test_cli_runner()
+        result = runner.invoke(
+            args=["receipts", "import", str(path), "--user", user.username]
+        )
+        assert result.exit_code == 0, result.output
+        assert "2 receipts, 3 line items, 0 rejected" in result.output
+
+    def test_import_command_unknown_user(self, app, db, tmp_path):
+        """An unknown owner is reported as a usage error."""
+        path = tmp_path / "export.csv"
+        path.write_text(CSV_EXPORT)
+        result = app.test_cli_runner().invoke(
+            args=["receipts", "import", str(path), "--user", "nobody"]
+        )
+        assert result.exit_code == 2
+        assert "Unknown user 'nobody'" in result.output
+
+
+class TestParallelImport:
+    """Importing a directory of files with a process pool."""
+
+    def test_import_files_with_workers(self, tmp_path):
+        """Each worker process writes its shard through its own engine."""
+        from app.app import create_app
+        from app.database import db
+        from app.receipt.importer import ImportStats, find_files, import_files
+
+        from .factories import UserFactory
+
+        app = create_app(
+            "tests.settings",
+            {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'receipts.db'}"},
+        )
+        exports = tmp_path / "exports"
+        exports.mkdir()
+        for month in range(1, 4):
+            (exports / f"2024-{month:02}.csv").write_text(
+                CSV_EXPORT.replace("A1", f"M{month}-1")
+                .replace("A2", f"M{month}-2")
+                .replace("2024-03", f"2024-{month:02}")
+            )
+        (exports / "README.txt").write_text("not an export")
+        with app.app_context():
+            db.create_all()
+            user = UserFactory()
+            db.session.commit()
+            paths = list(find_files([str(exports)]))
+            results = list(import_files(paths, user.id, workers=2))
+            total = ImportStats.combine(results, elapsed=1.0)
+            assert len(paths) == 3
+            assert sorted(stats.path for stats in results) == paths
+            assert not any(stats.error for stats in results)
+            assert (total.receipts, total.line_items) == (6, 9)
+            assert Receipt.query.count() == 6
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Background job queue tests."""
+from datetime import timedelta
+
+import pytest
+
+from app.database import db
+from app.jobs import queue
+from app.jobs.models import DONE, FAILED, QUEUED, RUNNING, Job
+from app.jobs.queue import Task, Worker, claim, enqueue
+from app.receipt.models import DailyCategorySpend, Receipt
+
+from .factories import LineItemFactory
+
+CSV = (
+    "receipt_id,merchant,purchased_at,total,description,amount\n"
+    "r1,Bakery,2024-03-01T08:00:00,3.50,Bread,3.50\n"
+    "r2,Grocer,2024-03-02T09:00:00,2.00,Milk,2.00\n"
+)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Register test tasks, returning the arguments each handler was called with."""
+    calls = {"echo": [], "batch": [], "fail": []}
+
+    def echo(payload):
+        calls["echo"].append(payload)
+        return {"echoed": payload.get("n")}
+
+    def batch(payloads):
+        calls["batch"].append(payloads)
+
+    def fail(payload):
+        calls["fail"].append(payload)
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(queue.TASKS, "test.echo", Task("test.echo", echo))
+    monkeypatch.setitem(
+        queue.TASKS, "test.batch", Task("test.batch", batch, batched=True)
+    )
+    monkeypatch.setitem(
+        queue.TASKS, "test.fail", Task("test.fail", fail, max_attempts=2)
+    )
+    return calls
+
+
+def states():
+    """Return the state of every job by id."""
+    db.session.expire_all()
+    return {job.id: job.state for job in Job.query.all()}
+
+
+@pytest.mark.usefixtures("db")
+class TestQueue:
+    """Queueing and claiming jobs."""
+
+    def test_unknown_task(self):
+        """Jobs of unregistered tasks are refused."""
+        with pytest.raises(ValueError):
+            enqueue("test.missing")
+
+    def test_claim_order(self, calls):
+        """Lower priorities, then jobs due earlier, are claimed first."""
+        late = enqueue("test.echo", priority=5)
+        first = enqueue("test.echo")
+        urgent = enqueue("test.echo", priority=-5)
+        enqueue("test.echo", delay=3600)
+        claimed = claim("w1", limit=10)
+        assert [job.id for job in claimed] == [urgent.id, first.id, late.id]
+        assert all(job.attempts == 1 for job in claimed)
+        assert claim("w2") == []
+
+    def test_claim_limit(self, calls):
+        """Claims take at most ``limit`` jobs and never the same one twice."""
+        for n in range(5):
+            enqueue("test.echo", {"n": n})
+        first, second = claim("w1", limit=3), claim("w2", limit=3)
+        assert (len(first), len(second)) == (3, 2)
+        assert not {job.id for job in first} & {job.id for job in second}
+        assert set(states().values()) == {RUNNING}
+
+
+@pytest.mark.usefixtures("db")
+class TestWorker:
+    """Running claimed jobs."""
+
+    def test_runs_jobs(self, calls):
+        """Handlers get the payload, and the job its result and timings."""
+        job = enqueue("test.echo", {"n": 1})
+        assert Worker().run_once() == 1
+        assert calls["echo"] == [{"n": 1}]
+        db.session.refresh(job)
+        assert (job.state, job.result, job.locked_by) == (DONE, {"echoed": 1}, None)
+        assert job.run_ms >= 0 and job.wait_ms >= 0
+        assert job.finished_at is not None
+
+    def test_batched(self, calls):
+        """Batched handlers get the payloads of all their claimed jobs at once."""
+        for n in range(3):
+            enqueue("test.batch", {"n": n})
+        enqueue("test.echo", {"n": 9})
+        Worker().run_once()
+        assert calls["batch"] == [[{"n": 0}, {"n": 1}, {"n": 2}]]
+        assert calls["echo"] == [{"n": 9}]
+        assert set(states().values()) == {DONE}
+
+    def test_retries_then_fails(self, calls):
+        """Failed jobs are retried after a backoff until out of attempts."""
+        job = enqueue("test.fail")
+        worker = Worker()
+        worker.run_once()
+        db.session.refresh(job)
+        assert (job.state, job.attempts) == (QUEUED, 1)
+        assert job.error == "RuntimeError: boom"
+        assert job.run_at - job.locked_at >= timedelta(seconds=queue.RETRY_DELAY)
+        assert worker.run_once() == 0
+        job.update(run_at=job.locked_at)
+        worker.run_once()
+        db.session.refresh(job)
+        assert (job.state, job.attempts) == (FAILED, 2)
+        assert len(calls["fail"]) == 2
+
+    def test_failure_is_rolled_back(self, calls, monkeypatch):
+        """What a failed handler wrote is not committed."""
+
+        def write_then_fail(payload):
+            LineItemFactory()
+            raise RuntimeError("boom")
+
+        monkeypatch.setitem(
+            queue.TASKS, "test.write", Task("test.write", write_then_fail)
+        )
+        enqueue("test.write")
+        Worker().run_once()
+        assert Receipt.query.count() == 0
+
+    def test_requeue_stale(self, calls):
+        """Jobs that lost their worker are queued again, or failed."""
+        lost = enqueue("test.echo")
+        spent = enqueue("test.echo")
+        spent.update(max_attempts=1)
+        claim("dead")
+        later = lost.locked_at + timedelta(seconds=61)
+        assert queue.requeue_stale(timeout=60, now=later) == (1, 1)
+        assert states() == {lost.id: QUEUED, spent.id: FAILED}
+
+    def test_stop_releases_claimed_jobs(self, calls):
+        """A stopping worker queues the jobs it has not started again."""
+        jobs = [enqueue("test.echo", {"n": n}) for n in range(3)]
+        worker = Worker()
+        queue.TASKS["test.echo"].func = lambda payload: worker.stop()
+        worker.run_once()
+        assert states() == {jobs[0].id: DONE, jobs[1].id: QUEUED, jobs[2].id: QUEUED}
+        db.session.refresh(jobs[1])
+        assert jobs[1].attempts == 0
+
+    def test_unknown_task_fails(self, calls):
+        """Jobs whose task this worker does not know fail like any other."""
+        job = enqueue("test.echo")
+        del queue.TASKS["test.echo"]
+        Worker().run_once()
+        db.session.refresh(job)
+        assert (job.state, job.error) == (
+            QUEUED,
+            "LookupError: Unknown task 'test.echo'",
+        )
+
+    def test_purge_and_stats(self, calls):
+        """Old finished jobs are purged; stats count jobs by task and state."""
+        done = enqueue("test.echo")
+        enqueue("test.echo", delay=60)
+        Worker().run_once()
+        rows = {(row.name, row.state): row.count for row in queue.stats()}
+        assert rows == {("test.echo", DONE): 1, ("test.echo", QUEUED): 1}
+        assert queue.purge(7) == 0
+        assert queue.purge(0, now=done.finished_at + timedelta(seconds=1)) == 1
+
+    def test_worker_command(self, app, calls):
+        """``flask worker --burst`` runs the due jobs and exits."""
+        enqueue("test.echo", {"n": 1})
+        result = app.test_cli_runner().invoke(args=["worker", "--burst"])
+        assert result.exit_code == 0, result.output
+        assert calls["echo"] == [{"n": 1}]
+        result = app.test_cli_runner().invoke(args=["jobs", "stats"])
+        assert "test.echo" in result.output
+
+
+@pytest.mark.usefixtures("db")
+class TestReceiptTasks:
+    """Receipt processing jobs."""
+
+    def test_import_upload(self, user, tmp_path):
+        """Uploaded files are imported, then deleted."""
+        path = tmp_path / "upload.csv"
+        path.write_text(CSV)
+        job = enqueue("receipts.import", {"path": str(path), "user_id": user.id})
+        Worker().run_once()
+        db.session.refresh(job)
+        assert job.state == DONE
+        assert job.result["receipts"] == 2
+        assert Receipt.query.filter_by(user_id=user.id).count() == 2
+        assert not path.exists()
+
+    def test_import_missing_upload(self, user, tmp_path):
+        """An upload already imported by a lost attempt is not an error."""
+        path = str(tmp_path / "gone.csv")
+        job = enqueue("receipts.import", {"path": path, "user_id": user.id})
+        Worker().run_once()
+        db.session.refresh(job)
+        assert (job.state, job.result) == (DONE, None)
+
+    def test_rebuild_rollups_in_background(self, app, user):
+        """Queued rollup rebuilds run once per user, in one batch."""
+        LineItemFactory(receipt__user=user, category="food")
+        db.session.commit()
+        DailyCategorySpend.query.delete()
+        db.session.commit()
+        for _ in range(2):
+            result = app.test_cli_runner().invoke(
+                args=["rollups", "rebuild", "-u", user.username, "--background"]
+            )
+            assert result.exit_code == 0, result.output
+        assert DailyCategorySpend.query.count() == 0
+        Worker().run_once()
+        assert DailyCategorySpend.query.count() == 1
+        assert set(states().values()) == {DONE}
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Structured logging tests."""
+import io
+import json
+import logging
+import sys
+
+import pytest
+from flask import current_app
+
+from app.logs import (
+    REQUEST_ID_HEADER,
+    BackgroundHandler,
+    JSONFormatter,
+    SamplingFilter,
+    create_handler,
+)
+
+
+class ListHandler(logging.Handler):
+    """Collect the records handed over by the background thread."""
+
+    def __init__(self):
+        """Create instance."""
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        """Keep the record."""
+        self.records.append(record)
+
+
+def _record(level=logging.INFO, message="hello"):
+    """Return a log record."""
+    return logging.LogRecord("app", level, __file__, 1, message, None, None)
+
+
+class TestBackgroundHandler:
+    """Queue handler writing in a background thread."""
+
+    def test_close_writes_queued_records(self):
+        """Every record queued before closing is written."""
+        target = ListHandler()
+        handler = BackgroundHandler(target)
+        for n in range(100):
+            handler.handle(_record(message=f"record {n}"))
+        handler.close()
+        assert len(target.records) == 100
+
+    def test_exceptions_are_formatted_before_queueing(self):
+        """Tracebacks cross the queue as text."""
+        target = ListHandler()
+        handler = BackgroundHandler(target)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = _record(logging.ERROR, "failed %s")
+            record.args, record.exc_info = ("x",), sys.exc_info()
+            handler.handle(record)
+        handler.close()
+        (record,) = target.records
+        assert record.msg == "failed x"
+        assert record.exc_info is None
+        assert "ValueError: boom" in record.exc_text
+
+
+class TestJSONRecords:
+    """JSON lines with request context."""
+
+    def test_request_fields(self, app, testapp):
+        """Records logged in a request carry its id, endpoint and latency."""
+        app.logger.setLevel(logging.INFO)
+        stream = io.StringIO()
+        handler = create_handler({"LOG_FORMAT": "json"}, stream)
+
+        @app.route("/log")
+        def log():
+            current_app.logger.addHandler(handler)
+            try:
+                current_app.logger.warning("from %s", "view")
+            finally:
+                current_app.logger.removeHandler(handler)
+            return "ok"
+
+        response = testapp.get("/log", headers={REQUEST_ID_HEADER: "abc123"})
+        handler.close()
+        entry = json.loads(stream.getvalue())
+        assert response.headers[REQUEST_ID_HEADER] == "abc123"
+        assert entry["message"] == "from view"
+        assert entry["level"] == "WARNING"
+        assert entry["request_id"] == "abc123"
+        assert entry["endpoint"] == "log"
+        assert entry["latency_ms"] >= 0
+        assert "user_id" not in entry
+
+    def test_generated_request_id(self, testapp):
+        """Requests without an id get one."""
+        response = testapp.get("/")
+        assert len(response.headers[REQUEST_ID_HEADER]) == 32
+
+    def test_exception(self):
+        """Tracebacks are kept in their own field."""
+        record = _record(logging.ERROR)
+        record.exc_text = "Traceback ..."
+        assert json.loads(JSONFormatter().format(record))["exception"] == (
+            "Traceback ..."
+        )
+
+
+@pytest.mark.parametrize(
+    "rate, level, passes",
+    [
+        (0.0, logging.INFO, False),
+        (0.0, logging.DEBUG, False),
+        (0.0, logging.WARNING, True),
+        (1.0, logging.INFO, True),
+    ],
+)
+def test_sampling(rate, level, passes):
+    """Info and debug records are sampled, warnings always written."""
+    assert SamplingFilter(rate).filter(_record(level)) is passes
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Merchant resolution tests."""
+import io
+import random
+import string
+
+import pytest
+
+from app.database import db
+from app.receipt import merchants
+from app.receipt.importer import import_stream
+from app.receipt.merchants import (
+    BKTree,
+    MerchantIndex,
+    edit_distance,
+    get_index,
+    normalize_key,
+)
+from app.receipt.models import DailyMerchantSpend, Merchant, MerchantAlias, Receipt
+
+from .factories import ReceiptFactory
+from .test_importer import CSV_EXPORT
+
+ENTRIES = [
+    ("Starbucks", 1, "Starbucks"),
+    ("Starbucks Coffee Company", 1, "Starbucks"),
+    ("sbux", 1, "Starbucks"),
+    ("Shell", 2, "Shell"),
+    ("Shell Select", 3, "Shell Select"),
+    ("Tesco", 4, "Tesco"),
+]
+
+
+def add_merchant(name, *aliases):
+    """Store a merchant with its aliases."""
+    merchant = Merchant(name=name)
+    db.session.add_all(
+        [
+            merchant,
+            *(MerchantAlias(merchant=merchant, alias=alias) for alias in aliases),
+        ]
+    )
+    db.session.commit()
+    return merchant
+
+
+@pytest.mark.parametrize(
+    "raw, key",
+    [
+        ("STARBUCKS #1234 PRAGUE", "starbucks prague"),
+        ("  Tesco-Express  ", "tesco express"),
+        ("a b c d e f g h", "a b c d e f"),
+        ("#42", ""),
+    ],
+)
+def test_normalize_key(raw, key):
+    """Keys are lowercase words without numbers or punctuation."""
+    assert normalize_key(raw) == key
+
+
+class TestMerchantIndex:
+    """Resolving raw merchant strings in memory."""
+
+    @pytest.mark.parametrize(
+        "raw, merchant_id",
+        [
+            ("STARBUCKS #1234 PRAGUE", 1),
+            ("Starbucks Coffee", 1),
+            ("SBUX 22", 1),
+            ("Shell 0042", 2),
+            ("SHELL SELECT Brno", 3),
+            ("Starbuks Praha", 1),
+            ("Tescp", 4),
+            ("Lidl", None),
+            ("Shel", None),
+            ("", None),
+        ],
+    )
+    def test_resolve(self, raw, merchant_id):
+        """Longest known prefix first, then the nearest name within a few typos."""
+        resolved = MerchantIndex(ENTRIES).resolve(raw)
+        assert (resolved[0] if resolved else None) == merchant_id
+
+    def test_resolve_many(self):
+        """Each distinct string is resolved once."""
+        resolved = MerchantIndex(ENTRIES).resolve_many(["Tesco", "Tesco", "Lidl"])
+        assert resolved == {"Tesco": (4, "Tesco"), "Lidl": None}
+
+    def test_bk_tree_matches_brute_force(self):
+        """The tree finds the nearest key a full scan would."""
+        generator = random.Random(7)
+        words = {
+            "".join(generator.choices(string.ascii_lowercase[:6], k=6))
+            for _ in range(300)
+        }
+        tree = BKTree()
+        for word in words:
+            tree.insert(word, word)
+        for _ in range(100):
+            query = "".join(generator.choices(string.ascii_lowercase[:6], k=6))
+            best = min((edit_distance(query, word), word) for word in words)
+            expected = best[1] if best[0] <= 2 else None
+            assert tree.nearest(query, 2) == expected
+
+
+@pytest.mark.usefixtures("db")
+class TestDictionary:
+    """The dictionary in the database and the per-app index."""
+
+    def test_index_reloads_on_commit(self):
+        """Committed dictionary changes reach the index, unchanged ones do not."""
+        index = get_index()
+        assert index.resolve("Starbucks") is None
+        assert get_index() is index
+        add_merchant("Starbucks", "sbux")
+        assert get_index().resolve("SBUX 1")[1] == "Starbucks"
+
+    def test_rollback_keeps_index(self):
+        """Rolled back dictionary changes publish nothing."""
+        index = get_index()
+        db.session.add(Merchant(name="Starbucks"))
+        db.session.flush()
+        db.session.rollback()
+        assert get_index() is index
+
+    def test_bulk_writes_reload(self):
+        """Dictionary rows written by the bulk helpers reach the index."""
+        get_index()
+        Merchant.bulk_create([{"name": "Tesco"}])
+        assert get_index().resolve("TESCO 12")[1] == "Tesco"
+
+    def test_import_resolves_merchants(self, user):
+        """Imported receipts get the canonical merchant, keeping the raw one."""
+        starbucks = add_merchant("Starbucks")
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        receipts = {receipt.external_id: receipt for receipt in Receipt.query}
+        assert (
+            receipts["A1"].merchant,
+            receipts["A1"].merchant_id,
+            receipts["A1"].raw_merchant,
+        ) == ("Starbucks", starbucks.id, "Starbucks Prague")
+        assert (receipts["A2"].merchant, receipts["A2"].merchant_id) == ("Tesco", None)
+
+    def test_apply(self, user):
+        """Stored receipts are resolved again, and their rollups follow."""
+        ReceiptFactory(user=user, merchant="STARBUCKS #1")
+        ReceiptFactory(user=user, merchant="Tesco").save()
+        starbucks = add_merchant("Starbucks")
+        assert merchants.apply(chunk_size=1) == 1
+        receipt = Receipt.query.filter_by(merchant_id=starbucks.id).one()
+        assert (receipt.merchant, receipt.raw_merchant) == ("Starbucks", "STARBUCKS #1")
+        assert {row.merchant for row in DailyMerchantSpend.query} == {
+            "Starbucks",
+            "Tesco",
+        }
+        assert merchants.apply() == 0
@@ -3,7 +3,9 @@
 import datetime as dt
 
 import pytest
+from sqlalchemy import event
 
+from app.extensions import cache
 from app.user.models import Role, User
 
 from .factories import UserFactory
@@ -51,6 +53,106 @@ class TestUser:
         assert user.check_password("foobarbaz123") is True
         assert user.check_password("barfoobaz") is False
 
+    def test_get_cached(self, db, monkeypatch):
+        """Cached users are merged into the session without a query."""
+        user = UserFactory(username="cached")
+        db.session.commit()
+        User.get_cached(user.id)
+        db.session.remove()
+
+        def no_query(record_id):
+            raise AssertionError("get_by_id should not be called")
+
+        monkeypatch.setattr(User, "get_by_id", no_query)
+        cached = User.get_cached(str(user.id))
+        assert cached.username == "cached"
+        assert cached in db.session
+
+    def test_cache_leaves_out_password(self, db):
+        """The password hash is not cached and loads when needed."""
+        user = UserFactory(password="myprecious")
+        db.session.commit()
+        User.get_cached(user.id)
+        assert "_password" not in cache.get(User.cache_key(user.id))
+        db.session.remove()
+        assert User.get_cached(user.id).check_password("myprecious")
+
+    def test_save_invalidates_cache(self, db):
+        """Updating a user drops it from the identity cache."""
+        user = UserFactory()
+        db.session.commit()
+        User.get_cached(user.id)
+        assert cache.get(User.cache_key(user.id)) is not None
+        user.update(first_name="Changed")
+        assert cache.get(User.cache_key(user.id)) is None
+        assert User.get_cached(user.id).first_name == "Changed"
+
+    def test_delete_invalidates_cache(self, db):
+        """Deleted users are no longer served from the cache."""
+        user = UserFactory()
+        db.session.commit()
+        user_id = user.id
+        User.get_cached(user_id)
+        user.delete()
+        assert User.get_cached(user_id) is None
+
+    def test_commit_invalidates_cache(self, db):
+        """Attribute changes drop the user from the cache once committed."""
+        user = UserFactory()
+        db.session.commit()
+        User.get_cached(user.id)
+        user.first_name = "Changed"
+        db.session.flush()
+        assert cache.get(User.cache_key(user.id)) is not None
+        db.session.commit()
+        assert cache.get(User.cache_key(user.id)) is None
+
+    def test_rollback_keeps_cache(self, db):
+        """Rolled back changes leave the cache alone."""
+        user = UserFactory()
+        db.session.commit()
+        User.get_cached(user.id)
+        user.first_name = "Changed"
+        db.session.flush()
+        db.session.rollback()
+        assert cache.get(User.cache_key(user.id)) is not None
+
+    def test_bulk_writes_invalidate_cache(self, db):
+        """bulk_upsert and bulk_delete drop the users they touch."""
+        user, other = UserFactory.create_batch(2)
+        db.session.commit()
+        User.get_cached(user.id)
+        User.get_cached(other.id)
+        User.bulk_upsert(
+            [{"username": user.username, "email": user.email, "first_name": "Bulk"}],
+            index_elements=["username"],
+        )
+        assert cache.get(User.cache_key(user.id)) is None
+        assert User.get_cached(user.id).first_name == "Bulk"
+        other_id = other.id
+        User.bulk_delete([other_id])
+        db.session.remove()
+        assert User.get_cached(other_id) is None
+
+    def test_find_conflicts(self, db):
+        """Taken usernames and emails are found with one query."""
+        user = UserFactory(username="taken", email="taken@example.com")
+        other = UserFactory(username="other", email="other@example.com")
+        db.session.commit()
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        conflicts = User.find_conflicts("taken", "other@example.com")
+        event.remove(db.engine, "before_cursor_execute", record)
+        assert conflicts == {"username", "email"}
+        assert len(statements) == 1
+        assert User.find_conflicts("free", "free@example.com") == set()
+        assert User.find_conflicts("taken", user.email, exclude_id=user.id) == set()
+        assert User.find_conflicts(other.username, user.email, user.id) == {"username"}
+
     def test_full_name(self):
         """User full name."""
         user = UserFactory(first_name="Foo", last_name="Bar")
@@ -63,7 +165,15 @@ class TestUser:
         user = UserFactory()
         user.roles.append(role)
         user.save()
-        assert role in user.roles
+        query = User.query.options(*User.loading("roles")).filter_by(id=user.id)
+        assert role in query.one().roles
+
+    def test_role_user_is_joined(self, db, count_queries):
+        """Roles come with their user in the same query."""
+        Role.create(name="admin", user=UserFactory(username="owner"))
+        with count_queries() as queries:
+            assert [role.user.username for role in Role.query.all()] == ["owner"]
+        queries.assert_budget(queries=1)
 
     def test_roles_repr(self):
         """Check __repr__ output for Role."""
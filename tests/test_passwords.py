@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Password hashing tests."""
+import gevent
+import pytest
+
+from app.extensions import bcrypt
+from app.passwords import OffloadedBcrypt, calibrate, hash_cost
+from app.user.models import User
+
+
+@pytest.fixture
+def offloaded(app):
+    """A bcrypt extension forced to offload into a single thread."""
+    app.config.update(BCRYPT_OFFLOAD=True, BCRYPT_THREADPOOL_SIZE=1)
+    return OffloadedBcrypt(app)
+
+
+class TestOffloadedBcrypt:
+    """Offloaded bcrypt."""
+
+    def test_inline_without_monkey_patching(self, app):
+        """Hashes run inline when gevent did not patch the process."""
+        bcrypt = OffloadedBcrypt(app)
+        assert not bcrypt.offloading
+        pw_hash = bcrypt.generate_password_hash("secret")
+        assert bcrypt.check_password_hash(pw_hash, "secret")
+        assert bcrypt.calls == 0
+
+    def test_offloaded_hash_and_check(self, offloaded):
+        """Hashes computed in the pool verify like inline ones."""
+        pw_hash = offloaded.generate_password_hash("secret")
+        assert offloaded.check_password_hash(pw_hash, "secret")
+        assert not offloaded.check_password_hash(pw_hash, "wrong")
+        stats = offloaded.stats()
+        assert stats["calls"] == 3
+        assert stats["in_flight"] == 0
+
+    def test_queue_depth(self, offloaded):
+        """Concurrent calls beyond the pool size queue up."""
+        greenlets = [
+            gevent.spawn(offloaded.generate_password_hash, "secret") for _ in range(3)
+        ]
+        gevent.joinall(greenlets, raise_error=True)
+        assert all(greenlet.value for greenlet in greenlets)
+        assert offloaded.max_queue_depth == 2
+        assert offloaded.queue_depth == 0
+
+
+class TestHashUpgrade:
+    """Password hash cost upgrades."""
+
+    def test_hash_cost(self):
+        """The cost is parsed from the hash."""
+        pw_hash = bcrypt.generate_password_hash("secret", rounds=5)
+        assert hash_cost(pw_hash) == 5
+        assert hash_cost(pw_hash.decode()) == 5
+        with pytest.raises(ValueError):
+            hash_cost(b"plain text")
+
+    @pytest.mark.parametrize("pw_hash", [None, b"", b"plain text", b"$argon2id$v=19$x"])
+    def test_needs_rehash_ignores_other_hashes(self, pw_hash):
+        """Missing and non-bcrypt hashes are never upgraded."""
+        assert not bcrypt.needs_rehash(pw_hash)
+
+    def test_check_password_does_not_write(self, user, db, monkeypatch):
+        """Checking a password leaves an outdated hash and the session alone."""
+        old_hash = user.password
+        monkeypatch.setattr(bcrypt, "_log_rounds", 5)
+        assert user.check_password("myprecious")
+        assert user.password == old_hash
+        assert not db.session.dirty
+
+    def test_upgrade_password(self, user, db, monkeypatch):
+        """Upgrading re-hashes with the configured cost in the caller's transaction."""
+        monkeypatch.setattr(bcrypt, "_log_rounds", 5)
+        assert bcrypt.needs_rehash(user.password)
+        user.upgrade_password("myprecious")
+        db.session.commit()
+        assert hash_cost(user.password) == 5
+        assert user.check_password("myprecious")
+
+    def test_changed_password_not_overwritten(self, user, db):
+        """An upgrade racing a password change does not undo the change."""
+        old_hash = user.password
+        user.update(password="changed")
+        assert not User.replace_password_hash(user.id, "myprecious", old_hash)
+        db.session.commit()
+        assert user.check_password("changed")
+
+    def test_login_upgrades_cost(self, user, testapp, monkeypatch):
+        """Logging in upgrades the hash of an active user."""
+        monkeypatch.setattr(bcrypt, "_log_rounds", 5)
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        assert form.submit().follow().status_code == 200
+        assert hash_cost(User.get_by_id(user.id).password) == 5
+
+
+def test_calibrate():
+    """Calibration stops at the first cost over the target."""
+    rounds, timings = calibrate(0.0, min_rounds=4, max_rounds=6, samples=1)
+    assert rounds == 4
+    assert [cost for cost, _ in timings] == [4]
+    rounds, timings = calibrate(60, min_rounds=4, max_rounds=5, samples=1)
+    assert rounds == 5
+    assert [cost for cost, _ in timings] == [4, 5]
+
+
+def test_calibrate_command(app):
+    """The calibrate command suggests a cost."""
+    result = app.test_cli_runner().invoke(
+        args=["passwords", "calibrate", "--target-ms", "1", "--max-rounds", "5"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Suggested: BCRYPT_LOG_ROUNDS=" in result.output
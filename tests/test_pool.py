@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Connection pool tests."""
+import logging
+
+import pytest
+from flask import g
+from psycopg2 import extensions
+from sqlalchemy import create_engine, exc, text
+
+from app.app import create_app
+from app.database import db
+from app.pool import MeteredQueuePool, engine_options, gevent_wait_callback
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Engine with a pool of one connection and no overflow."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=MeteredQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    yield engine
+    engine.dispose()
+
+
+class TestEngineOptions:
+    """Pool options read from the settings."""
+
+    def test_server_database(self):
+        """Pooled databases get the ``DB_POOL_*`` settings."""
+        config = {
+            "SQLALCHEMY_DATABASE_URI": "postgresql://localhost/app",
+            "DB_POOL_SIZE": 20,
+            "DB_MAX_OVERFLOW": 0,
+            "DB_POOL_PRE_PING": True,
+            "DB_POOL_RECYCLE": None,
+        }
+        assert engine_options(config) == {
+            "poolclass": MeteredQueuePool,
+            "pool_size": 20,
+            "max_overflow": 0,
+            "pool_pre_ping": True,
+        }
+
+    def test_in_memory_sqlite(self):
+        """In-memory databases keep their single connection."""
+        assert engine_options({"SQLALCHEMY_DATABASE_URI": "sqlite://"}) == {}
+
+    def test_explicit_engine_options_win(self, tmp_path):
+        """``SQLALCHEMY_ENGINE_OPTIONS`` overrides the pool settings."""
+        app = create_app(
+            "tests.settings",
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'app.db'}",
+                "DB_POOL_SIZE": 3,
+                "SQLALCHEMY_ENGINE_OPTIONS": {"pool_size": 7},
+            },
+        )
+        with app.app_context():
+            assert isinstance(db.engine.pool, MeteredQueuePool)
+            assert db.engine.pool.size() == 7
+
+
+class FakeConnection:
+    """psycopg2 connection going through the given poll states."""
+
+    def __init__(self, *states):
+        """Create instance."""
+        self.states = list(states)
+
+    def poll(self):
+        """Return the next state."""
+        return self.states.pop(0)
+
+    def fileno(self):
+        """Return a descriptor that is always ready."""
+        return 0
+
+
+class TestGreenPsycopg2:
+    """The gevent wait callback."""
+
+    @pytest.fixture
+    def wait_callback(self):
+        """Restore psycopg2's wait callback after the test."""
+        yield
+        extensions.set_wait_callback(None)
+
+    @pytest.mark.parametrize("green, installed", [(True, True), (False, False)])
+    def test_installed(self, wait_callback, green, installed):
+        """The callback is installed for psycopg2 databases when green."""
+        create_app(
+            "tests.settings",
+            {
+                "SQLALCHEMY_DATABASE_URI": "postgresql+psycopg2://localhost/app",
+                "DB_GREEN": green,
+            },
+        )
+        callback = extensions.get_wait_callback()
+        assert (callback is gevent_wait_callback) is installed
+
+    def test_polls_until_ready(self, monkeypatch):
+        """Connections are polled, waiting on the hub, until done."""
+        waits = []
+        monkeypatch.setattr(
+            "gevent.socket.wait_read", lambda fd, timeout: waits.append("read")
+        )
+        monkeypatch.setattr(
+            "gevent.socket.wait_write", lambda fd, timeout: waits.append("write")
+        )
+        connection = FakeConnection(
+            extensions.POLL_WRITE, extensions.POLL_READ, extensions.POLL_OK
+        )
+        gevent_wait_callback(connection)
+        assert waits == ["write", "read"]
+
+    def test_bad_state(self):
+        """Unknown poll results fail the query."""
+        with pytest.raises(Exception, match="Bad result from poll"):
+            gevent_wait_callback(FakeConnection(99))
+
+
+class TestMeteredQueuePool:
+    """Checkout waits and saturation."""
+
+    def test_checkouts(self, engine, app):
+        """Checkouts are counted, and their wait added to the request's."""
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            stats = engine.pool.stats()
+        assert stats["checkouts"] == 1
+        assert stats["checked_out"] == 1
+        assert stats["saturation"] == 1.0
+        assert stats["peak_checked_out"] == 1
+        assert g.db_pool_wait >= 0
+        assert engine.pool.stats()["saturation"] == 0.0
+
+    def test_timeout(self, engine):
+        """Checkouts of an exhausted pool wait, then count as timed out."""
+        with engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+        metrics = engine.pool.metrics
+        assert metrics.timeouts == 1
+        assert metrics.max_wait_seconds >= 0.05
+
+    def test_unlimited_overflow(self, tmp_path):
+        """Pools without a limit have no saturation."""
+        engine = create_engine(
+            f"sqlite:///{tmp_path / 'pool.db'}",
+            poolclass=MeteredQueuePool,
+            max_overflow=-1,
+        )
+        assert engine.pool.capacity is None
+        assert engine.pool.saturation is None
+
+
+class TestRequestReport:
+    """Connection waits of a request."""
+
+    @pytest.fixture
+    def pooled(self, tmp_path):
+        """App using a pooled file database."""
+        app = create_app(
+            "tests.settings",
+            {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'app.db'}"},
+        )
+
+        @app.route("/query")
+        def query():
+            db.session.execute(text("SELECT 1"))
+            return "ok"
+
+        return app
+
+    def test_server_timing(self, pooled):
+        """The wait is sent as a metric."""
+        response = pooled.test_client().get("/query")
+        assert any(
+            metric.startswith("db-pool;dur=")
+            for metric in response.headers.getlist("Server-Timing")
+        )
+
+    def test_slow_checkout_logged(self, pooled, caplog):
+        """Waits over the threshold are logged with the pool's state."""
+        pooled.config["DB_POOL_WAIT_WARNING_MS"] = -1
+        with caplog.at_level(logging.WARNING, logger=pooled.logger.name):
+            pooled.test_client().get("/query")
+        (record,) = [r for r in caplog.records if "database connection" in r.msg]
+        assert "'saturation'" in record.getMessage()
+
+    def test_no_database(self, testapp):
+        """Requests not touching the database report nothing."""
+        response = testapp.get("/")
+        assert "db-pool" not in response.headers.get("Server-Timing", "")
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Query profiler tests."""
+import logging
+
+import pytest
+
+from app.profiler import QueryBudgetExceeded, fingerprint, query_budget
+from app.user.models import Role
+
+from .factories import UserFactory
+
+
+def list_role_users():
+    """Load the user of every role lazily, one query per role."""
+    roles = Role.query.options(*Role.loading("user", strategy="select"))
+    return ", ".join(role.user.username for role in roles)
+
+
+@pytest.fixture
+def roles(app, db):
+    """Roles of different users, whose lazy loads the profiler has to catch."""
+    app.config["SQLALCHEMY_RAISE_ON_LAZY_LOAD"] = False
+    for n in range(6):
+        Role.create(name=f"role{n}", user=UserFactory())
+    db.session.expire_all()
+
+
+def test_fingerprint():
+    """Statements differing in their parameters share a fingerprint."""
+    assert fingerprint("SELECT * FROM users WHERE id = ?") == fingerprint(
+        "SELECT *\n  FROM users WHERE id = %(id_1)s"
+    )
+    assert fingerprint("SELECT * FROM t WHERE id IN (?, ?, ?)") == fingerprint(
+        "SELECT * FROM t WHERE id IN (?)"
+    )
+    assert fingerprint("SELECT * FROM t WHERE name = 'it''s' LIMIT 10") == (
+        "SELECT * FROM t WHERE name = ? LIMIT ?"
+    )
+    assert fingerprint("SELECT users_1.id FROM users AS users_1") == (
+        "SELECT users_1.id FROM users AS users_1"
+    )
+
+
+class TestQueryProfiler:
+    """Query profiler."""
+
+    def test_server_timing(self, user, app):
+        """Responses carry the query count and time."""
+        client = app.test_client()
+        response = client.post(
+            "/", data={"username": user.username, "password": "myprecious"}
+        )
+        timing = response.headers["Server-Timing"]
+        assert timing.startswith("db;dur=")
+        assert 'queries"' in timing
+
+    def test_repeated_statement(self, app, roles):
+        """An N+1 lazy load fails the request in tests."""
+        app.add_url_rule("/role-users", view_func=list_role_users)
+        with pytest.raises(QueryBudgetExceeded, match="6 runs of"):
+            app.test_client().get("/role-users")
+
+    def test_budget_override(self, app, roles):
+        """Views can raise their own budget."""
+        app.add_url_rule(
+            "/role-users", view_func=query_budget(max_repeats=10)(list_role_users)
+        )
+        response = app.test_client().get("/role-users")
+        assert response.status_code == 200
+        assert '7 queries"' in response.headers["Server-Timing"]
+
+    def test_zero_budget_override(self, app, db):
+        """A budget of zero queries is enforced, not mistaken for no override."""
+
+        def count_roles():
+            return str(len(Role.query.all()))
+
+        app.add_url_rule("/count", view_func=query_budget(max_queries=0)(count_roles))
+        with pytest.raises(QueryBudgetExceeded, match="1 queries, budget 0"):
+            app.test_client().get("/count")
+
+    def test_over_budget_warning(self, app, roles, caplog):
+        """Outside tests a request over budget is logged."""
+        app.config.update(QUERY_BUDGET_RAISE=False, QUERY_BUDGET=3)
+        app.logger.setLevel(logging.INFO)
+        app.add_url_rule("/role-users", view_func=list_role_users)
+        response = app.test_client().get("/role-users")
+        assert response.status_code == 200
+        assert "list_role_users over query budget: 7 queries, budget 3" in caplog.text
+        assert "Query profile: endpoint=list_role_users queries=7" in caplog.text
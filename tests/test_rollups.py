@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Daily spend rollup tests."""
+import io
+from datetime import date, datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from app.receipt import rollups
+from app.receipt.importer import import_stream
+from app.receipt.models import DailyCategorySpend, DailyMerchantSpend, LineItem, Receipt
+
+from .factories import LineItemFactory, ReceiptFactory
+from .test_importer import CSV_EXPORT
+
+MARCH = (date(2024, 3, 1), date(2024, 4, 1))
+
+
+def snapshot():
+    """Return the rollup tables as comparable sets."""
+    return (
+        {
+            (row.user_id, row.day, row.category, row.amount, row.item_count)
+            for row in DailyCategorySpend.query
+        },
+        {
+            (row.user_id, row.day, row.merchant, row.amount, row.receipt_count)
+            for row in DailyMerchantSpend.query
+        },
+    )
+
+
+@pytest.mark.usefixtures("db")
+class TestIncrementalRollups:
+    """Rollups follow ORM and bulk writes."""
+
+    def test_orm_writes(self, user):
+        """Creating, updating and deleting through CRUDMixin keeps rollups current."""
+        receipt = Receipt.create(
+            user=user,
+            merchant="Tesco",
+            purchased_at=datetime(2024, 3, 2, 18),
+            total=Decimal("5.00"),
+            line_items=[
+                LineItem(description="Milk", category="groceries", amount=Decimal("2")),
+                LineItem(description="Beer", amount=Decimal("3")),
+            ],
+        )
+        assert rollups.category_totals(user.id, *MARCH) == [
+            ("uncategorized", Decimal("3.00"), 1),
+            ("groceries", Decimal("2.00"), 1),
+        ]
+
+        LineItem.query.filter_by(description="Milk").one().update(amount=Decimal("4"))
+        receipt.update(purchased_at=datetime(2024, 3, 5, 9), total=Decimal("7.00"))
+        assert rollups.daily_totals(user.id, *MARCH) == [
+            (date(2024, 3, 5), Decimal("7.00"))
+        ]
+        assert rollups.merchant_totals(user.id, *MARCH) == [
+            ("Tesco", Decimal("7.00"), 1)
+        ]
+
+        # Deleting cascades to the line items, so they are loaded up front.
+        Receipt.query.options(*Receipt.loading("line_items")).one().delete()
+        assert snapshot() == (set(), set())
+
+    def test_rollback_discards_stale_days(self, user, db):
+        """Stale days of a rolled back transaction are not recomputed later."""
+        Receipt(
+            user=user,
+            merchant="Tesco",
+            purchased_at=datetime(2024, 3, 2),
+            total=Decimal("5.00"),
+        ).save(commit=False)
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        assert snapshot() == (set(), set())
+
+    def test_bulk_import_and_delete(self, user):
+        """The import pipeline and bulk_delete maintain the rollups."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        assert rollups.daily_totals(user.id, *MARCH) == [
+            (date(2024, 3, 1), Decimal("7.50")),
+            (date(2024, 3, 2), Decimal("2.40")),
+        ]
+        Receipt.bulk_delete(Receipt.query.filter_by(external_id="A1"))
+        assert rollups.daily_totals(user.id, *MARCH) == [
+            (date(2024, 3, 2), Decimal("2.40"))
+        ]
+
+    def test_bulk_upsert_moves_receipts_and_items(self, user):
+        """Upserts recompute the days rows leave, not just the days they land on."""
+        first = Receipt.create(
+            user=user,
+            merchant="Tesco",
+            purchased_at=datetime(2024, 1, 1),
+            total=Decimal("5.00"),
+            line_items=[LineItem(description="Milk", amount=Decimal("5"))],
+        )
+        second = Receipt.create(
+            user=user,
+            merchant="Lidl",
+            purchased_at=datetime(2024, 1, 3),
+            total=Decimal("2.00"),
+        )
+        item_id = LineItem.query.filter_by(receipt_id=first.id).one().id
+        Receipt.bulk_upsert(
+            [
+                {
+                    "id": first.id,
+                    "user_id": user.id,
+                    "merchant": "Tesco",
+                    "purchased_at": datetime(2024, 2, 1),
+                    "total": Decimal("5.00"),
+                }
+            ]
+        )
+        assert rollups.daily_totals(user.id, date(2024, 1, 1), date(2024, 3, 1)) == [
+            (date(2024, 2, 1), Decimal("5.00"))
+        ]
+        LineItem.bulk_upsert(
+            [
+                {
+                    "id": item_id,
+                    "receipt_id": second.id,
+                    "description": "Milk",
+                    "amount": Decimal("5"),
+                }
+            ]
+        )
+        assert rollups.daily_totals(user.id, date(2024, 1, 1), date(2024, 3, 1)) == [
+            (date(2024, 1, 3), Decimal("5.00"))
+        ]
+        assert rollups.merchant_totals(user.id, date(2024, 1, 1), date(2024, 3, 1)) == [
+            ("Tesco", Decimal("5.00"), 1),
+            ("Lidl", Decimal("2.00"), 1),
+        ]
+
+    def test_rebuild_matches_incremental(self, user, db):
+        """A full rebuild produces the incrementally maintained rows."""
+        LineItemFactory.create_batch(20, receipt__user=user)
+        ReceiptFactory.create_batch(5, user=user)
+        db.session.commit()
+        incremental = snapshot()
+        db.session.execute(DailyCategorySpend.__table__.delete())
+        db.session.execute(DailyMerchantSpend.__table__.delete())
+        rollups.rebuild()
+        assert snapshot() == incremental
+        assert len(incremental[1]) == 25
+
+    def test_rebuild_command(self, app, user):
+        """The CLI rebuilds the rollups of one user."""
+        import_stream(io.StringIO(CSV_EXPORT), user.id, "csv")
+        result = app.test_cli_runner().invoke(
+            args=["rollups", "rebuild", "--user", user.username]
+        )
+        assert result.exit_code == 0, result.output
+        assert len(snapshot()[0]) == 2
+
+
+class RecordingConnection:
+    """Connection stand-in recording the advisory locks taken on PostgreSQL."""
+
+    dialect = SimpleNamespace(name="postgresql")
+
+    def __init__(self):
+        """Create instance."""
+        self.locks = []
+
+    def execute(self, statement, params):
+        """Record the lock function and key."""
+        self.locks.append((str(statement).split()[1].split("(")[0], params["key"]))
+
+
+def test_locks():
+    """Per-user work shares the lock a full rebuild takes exclusively."""
+    connection = RecordingConnection()
+    rollups._lock_user(connection, 7)
+    rollups._lock(connection, rollups.ALL_USERS)
+    assert connection.locks == [
+        ("pg_advisory_xact_lock_shared", rollups.ALL_USERS),
+        ("pg_advisory_xact_lock", 7),
+        ("pg_advisory_xact_lock", rollups.ALL_USERS),
+    ]
+
+
+def test_day_ranges():
+    """Consecutive days are merged into half-open ranges."""
+    days = [date(2024, 3, 3), date(2024, 3, 1), date(2024, 3, 2), date(2024, 3, 7)]
+    assert list(rollups._day_ranges(days)) == [
+        (date(2024, 3, 1), date(2024, 3, 4)),
+        (date(2024, 3, 7), date(2024, 3, 8)),
+    ]
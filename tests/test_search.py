@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Receipt search tests."""
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app.database import InvalidCursor, encode_cursor
+from app.receipt import search
+from app.receipt.models import LineItem, Receipt
+
+from .factories import LineItemFactory, ReceiptFactory, UserFactory
+
+
+def merchants(user, query, **kwargs):
+    """Return the merchants of the receipts of ``user`` matching ``query``."""
+    return [
+        receipt.merchant for receipt in search.search(user.id, query, **kwargs).items
+    ]
+
+
+def receipt_row(user, n, **values):
+    """Return the column values of a receipt for the bulk helpers."""
+    return {
+        "user_id": user.id,
+        "merchant": f"Bulk {n}",
+        "purchased_at": datetime(2024, 3, 1, n),
+        "total": Decimal("1.00"),
+        **values,
+    }
+
+
+@pytest.mark.usefixtures("db")
+class TestSearch:
+    """Matching and ranking."""
+
+    def test_fields(self, user):
+        """Merchants, line item descriptions and notes are searched."""
+        ReceiptFactory(user=user, merchant="Blue Bottle Coffee")
+        LineItemFactory(receipt=ReceiptFactory(user=user), description="Oat latte")
+        ReceiptFactory(user=user, merchant="Shell", notes="coffee on the road")
+        ReceiptFactory(user=user, merchant="Hardware store").save()
+        assert set(merchants(user, "coffee")) == {"Blue Bottle Coffee", "Shell"}
+        assert len(merchants(user, "latte")) == 1
+
+    def test_prefixes_and_any_word(self, user):
+        """Words match as prefixes, and receipts matching any word are found."""
+        ReceiptFactory(user=user, merchant="Blue Bottle Coffee")
+        ReceiptFactory(user=user, merchant="Coffee Place").save()
+        assert set(merchants(user, "that coff pla")) == {
+            "Blue Bottle Coffee",
+            "Coffee Place",
+        }
+
+    def test_ranking(self, user):
+        """Receipts matching more words, or in their merchant, come first."""
+        ReceiptFactory(user=user, merchant="Shell", notes="coffee")
+        ReceiptFactory(user=user, merchant="Coffee Place")
+        ReceiptFactory(user=user, merchant="Blue Bottle Coffee").save()
+        assert merchants(user, "coffee place") == [
+            "Coffee Place",
+            "Blue Bottle Coffee",
+            "Shell",
+        ]
+
+    def test_other_users(self, user):
+        """Only the receipts of the given user are searched."""
+        ReceiptFactory(user=UserFactory(), merchant="Coffee Place").save()
+        assert merchants(user, "coffee") == []
+
+    @pytest.mark.parametrize("query", ["", "  ", "'\"*:&|()"])
+    def test_no_words(self, user, query):
+        """Queries without words match nothing, and are never parsed as syntax."""
+        ReceiptFactory(user=user).save()
+        assert merchants(user, query) == []
+
+    def test_paging(self, user):
+        """Pages follow each other without gaps or repeats."""
+        for n in range(7):
+            ReceiptFactory(user=user, merchant=f"Coffee {n}", notes="coffee" * (n % 2))
+        ReceiptFactory(user=user).save()
+        seen, cursor = [], None
+        while True:
+            page = search.search(user.id, "coffee", cursor=cursor, per_page=3)
+            seen.extend(receipt.id for receipt in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        assert len(seen) == len(set(seen)) == 7
+        assert [receipt.id for receipt in search.search(user.id, "coffee").items] == (
+            seen
+        )
+
+    @pytest.mark.parametrize(
+        "cursor",
+        ["nope", encode_cursor(["high", 1]), encode_cursor([1.5, "1"]), "WzFd"],
+    )
+    def test_invalid_cursor(self, user, cursor):
+        """Tampered cursors are rejected."""
+        with pytest.raises(InvalidCursor):
+            search.search(user.id, "coffee", cursor=cursor)
+
+
+@pytest.mark.usefixtures("db")
+class TestIndexMaintenance:
+    """The index follows every kind of write."""
+
+    def test_orm_updates(self, user, db):
+        """Edits, moved line items and deletions are reindexed on commit."""
+        receipt = ReceiptFactory(user=user, merchant="Coffee Place")
+        other = ReceiptFactory(user=user, merchant="Bakery")
+        item = LineItemFactory(receipt=receipt, description="Sourdough")
+        db.session.commit()
+        receipt.update(merchant="Tea House")
+        assert merchants(user, "coffee") == []
+        assert merchants(user, "tea") == ["Tea House"]
+        item.update(receipt=other)
+        assert merchants(user, "sourdough") == ["Bakery"]
+        db.session.expunge_all()
+        Receipt.query.options(*Receipt.loading("line_items")).filter_by(
+            merchant="Bakery"
+        ).one().delete()
+        assert merchants(user, "bakery sourdough") == []
+
+    def test_rollback(self, user, db):
+        """Rolled back writes leave the index alone."""
+        receipt = ReceiptFactory(user=user, merchant="Coffee Place")
+        db.session.commit()
+        receipt.merchant = "Tea House"
+        db.session.flush()
+        assert db.session.info[search._STALE_RECEIPTS] == {receipt.id}
+        db.session.rollback()
+        assert search._STALE_RECEIPTS not in db.session.info
+        assert merchants(user, "coffee") == ["Coffee Place"]
+
+    def test_bulk_create(self, user):
+        """Receipts and line items bulk inserted are indexed."""
+        Receipt.bulk_create([receipt_row(user, n) for n in range(3)])
+        (receipt_id,) = Receipt.bulk_create(
+            [receipt_row(user, 3, merchant="Coffee Place")], returning=(Receipt.id,)
+        )[0]
+        LineItem.bulk_create(
+            [{"receipt_id": receipt_id, "description": "Flat white", "amount": 1}]
+        )
+        assert len(merchants(user, "bulk")) == 3
+        assert merchants(user, "white") == ["Coffee Place"]
+
+    def test_bulk_upsert(self, user):
+        """Upserted receipts are reindexed."""
+        rows = Receipt.bulk_create(
+            [receipt_row(user, n) for n in range(2)], returning=(Receipt.id,)
+        )
+        Receipt.bulk_upsert([receipt_row(user, 0, id=rows[0].id, merchant="Coffee")])
+        assert merchants(user, "coffee") == ["Coffee"]
+        assert merchants(user, "bulk") == ["Bulk 1"]
+
+    def test_bulk_delete(self, user):
+        """Bulk deleted receipts and line items leave the index."""
+        receipts = ReceiptFactory.create_batch(2, user=user, merchant="Bakery")
+        item = LineItemFactory(receipt=receipts[1], description="Sourdough")
+        item.save()
+        LineItem.bulk_delete([item.id])
+        assert merchants(user, "sourdough") == []
+        Receipt.bulk_delete([receipts[0].id])
+        assert len(merchants(user, "bakery")) == 1
+
+    def test_rebuild(self, user, db):
+        """Rebuilding restores a lost index."""
+        ReceiptFactory(user=user, merchant="Coffee Place").save()
+        db.session.execute(db.text("DELETE FROM receipt_search"))
+        db.session.commit()
+        assert merchants(user, "coffee") == []
+        search.rebuild()
+        assert merchants(user, "coffee") == ["Coffee Place"]
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Columnar receipt snapshot tests."""
+import json
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pyarrow as pa
+import pytest
+from sqlalchemy import update
+
+from app.analytics import engine, snapshot
+from app.analytics.snapshot import open_dataset, read_manifest
+from app.database import db
+from app.receipt.models import LineItem, Receipt
+
+from .factories import LineItemFactory, ReceiptFactory, UserFactory
+
+JANUARY = datetime(2024, 1, 10)
+FEBRUARY = datetime(2024, 2, 10)
+
+
+def rows(dataset, directory, *columns):
+    """Return the snapshot rows of ``dataset`` as sorted tuples of ``columns``."""
+    table = open_dataset(dataset, directory).to_table(columns=list(columns))
+    return sorted(zip(*(table[column].to_pylist() for column in columns)))
+
+
+def partitions(directory, dataset="receipts"):
+    """Return the ``(user_id, month)`` partitions of the snapshot."""
+    return set(rows(dataset, directory, "user_id", "month"))
+
+
+def forget_changes(directory):
+    """Age every row and the last snapshot, so only later writes count as changes."""
+    for model in (Receipt, LineItem):
+        db.session.execute(update(model).values(updated_at=datetime(2000, 1, 1)))
+    db.session.commit()
+    manifest = read_manifest(directory)
+    manifest["started_at"] = datetime(2001, 1, 1).isoformat()
+    with open(os.path.join(directory, snapshot.MANIFEST), "w") as stream:
+        json.dump(manifest, stream)
+
+
+@pytest.fixture
+def receipts(user):
+    """Receipts of two users over two months, with line items."""
+    other = UserFactory()
+    made = [
+        ReceiptFactory(user=user, purchased_at=JANUARY, merchant="Tesco"),
+        ReceiptFactory(user=user, purchased_at=FEBRUARY, merchant="Tesco"),
+        ReceiptFactory(user=other, purchased_at=JANUARY, merchant="Lidl"),
+    ]
+    for receipt in made:
+        LineItemFactory(receipt=receipt, category="groceries")
+    db.session.commit()
+    return made
+
+
+@pytest.mark.usefixtures("db")
+class TestSnapshot:
+    """Writing receipt snapshots."""
+
+    def test_full_snapshot(self, receipts, user, tmp_path):
+        """Receipts and line items are partitioned by user and month."""
+        stats = snapshot.snapshot(str(tmp_path))
+        assert (stats.full, stats.partitions, stats.receipts, stats.line_items) == (
+            True,
+            3,
+            3,
+            3,
+        )
+        assert partitions(tmp_path) == partitions(tmp_path, "line_items")
+        assert (user.id, "2024-02") in partitions(tmp_path)
+        month = os.path.join("receipts", f"user_id={user.id}", "month=2024-01")
+        assert os.path.exists(tmp_path / month / "part-0.arrow")
+        assert rows("receipts", tmp_path, "id", "merchant", "total") == [
+            (receipt.id, receipt.merchant, receipt.total) for receipt in receipts
+        ]
+
+    def test_dictionary_encoding(self, receipts, tmp_path):
+        """Merchants and categories are stored as dictionaries."""
+        snapshot.snapshot(str(tmp_path))
+        schema = open_dataset("line_items", tmp_path).schema
+        assert schema.field("category").type == pa.dictionary(pa.int32(), pa.string())
+        assert open_dataset("receipts", tmp_path).schema.field(
+            "merchant"
+        ).type == pa.dictionary(pa.int32(), pa.string())
+
+    def test_incremental_snapshot(self, receipts, user, tmp_path):
+        """Only the partitions changed rows are in, now or before, are rewritten."""
+        snapshot.snapshot(str(tmp_path))
+        forget_changes(tmp_path)
+        january, february, _ = receipts
+        february.update(purchased_at=datetime(2024, 3, 1))
+        stats = snapshot.snapshot(str(tmp_path))
+        assert (stats.full, stats.partitions, stats.removed, stats.receipts) == (
+            False,
+            1,
+            1,
+            1,
+        )
+        assert (user.id, "2024-02") not in partitions(tmp_path, "line_items")
+        assert (user.id, "2024-03") in partitions(tmp_path, "line_items")
+        assert not os.path.exists(
+            tmp_path / "receipts" / f"user_id={user.id}" / "month=2024-02"
+        )
+
+        forget_changes(tmp_path)
+        LineItemFactory(receipt=january, amount=Decimal("9.99"))
+        db.session.commit()
+        stats = snapshot.snapshot(str(tmp_path))
+        assert (stats.partitions, stats.receipts, stats.line_items) == (1, 1, 2)
+
+    def test_unchanged_snapshot(self, receipts, tmp_path):
+        """Nothing is rewritten when nothing changed."""
+        snapshot.snapshot(str(tmp_path))
+        forget_changes(tmp_path)
+        stats = snapshot.snapshot(str(tmp_path))
+        assert (stats.partitions, stats.receipts, stats.line_items) == (0, 0, 0)
+
+    def test_full_snapshot_drops_deleted_rows(self, receipts, tmp_path):
+        """Deleted receipts leave the snapshot on the next full one."""
+        snapshot.snapshot(str(tmp_path))
+        Receipt.bulk_delete([receipts[2]])
+        snapshot.snapshot(str(tmp_path), full=True)
+        assert len(partitions(tmp_path)) == 2
+        assert len(rows("line_items", tmp_path, "id")) == 2
+
+    def test_parquet(self, receipts, tmp_path):
+        """Switching formats takes a full snapshot in the new one."""
+        snapshot.snapshot(str(tmp_path))
+        stats = snapshot.snapshot(str(tmp_path), fmt="parquet")
+        assert stats.full
+        files = [name for _, _, names in os.walk(tmp_path) for name in names]
+        assert sorted(set(files)) == ["_snapshot.json", "part-0.parquet"]
+        assert len(rows("receipts", tmp_path, "id")) == 3
+
+    def test_snapshot_command(self, app, receipts, tmp_path):
+        """The CLI reports what was written."""
+        result = app.test_cli_runner().invoke(
+            args=["receipts", "snapshot", "-o", str(tmp_path)]
+        )
+        assert result.exit_code == 0, result.output
+        assert "Full snapshot: 3 partitions written" in result.output
+
+
+@pytest.mark.usefixtures("db")
+class TestSnapshotAnalytics:
+    """Analytics read from snapshots."""
+
+    def test_frame_matches_database(self, user, tmp_path):
+        """The snapshot frame holds the same line items as the database one."""
+        for hours in range(0, 30 * 7, 7):
+            LineItemFactory(
+                receipt__user=user,
+                receipt__purchased_at=datetime(2024, 1, 1) + timedelta(hours=hours),
+            )
+        db.session.commit()
+        snapshot.snapshot(str(tmp_path))
+        start, end = datetime(2024, 1, 2), datetime(2024, 1, 5)
+        expected = engine.load_spend_frame(user.id, start, end)
+        frame = engine.load_snapshot_frame(user.id, start, end, str(tmp_path))
+        assert 0 < len(frame) < 30
+        assert frame.amounts.tolist() == expected.amounts.tolist()
+        assert frame.timestamps.tolist() == expected.timestamps.tolist()
+        categories = expected.categories[expected.category_codes].tolist()
+        assert frame.categories[frame.category_codes].tolist() == categories
+
+    def test_missing_snapshot(self, app, user, tmp_path):
+        """Reports from a missing snapshot fail with a hint."""
+        app.config["SNAPSHOT_DIR"] = str(tmp_path)
+        result = app.test_cli_runner().invoke(
+            args=["analytics", "report", "--user", user.username]
+        )
+        assert result.exit_code == 1
+        assert "run 'flask receipts snapshot' first" in result.output
+
+    def test_report_command(self, app, user, tmp_path):
+        """The CLI prints the user's statistics from the snapshot."""
+        LineItemFactory(receipt__user=user, amount=Decimal("12.50"))
+        db.session.commit()
+        snapshot.snapshot(str(tmp_path))
+        app.config["SNAPSHOT_DIR"] = str(tmp_path)
+        result = app.test_cli_runner().invoke(
+            args=["analytics", "report", "--user", user.username]
+        )
+        assert result.exit_code == 0, result.output
+        assert "Total: 12.50 over 1 line items" in result.output
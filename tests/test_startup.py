@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Startup time tests."""
+import click
+import pytest
+
+from app.app import create_app
+from app.startup import StartupReport, parse_importtime
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     _io
+import time:       300 |        900 |   flask
+import time:      2000 |       5000 | app.app
+some other output
+""".splitlines()
+
+
+class TestImportTime:
+    """Parsing ``python -X importtime`` output."""
+
+    def test_parse(self):
+        """Lines become entries with their nesting depth."""
+        imports = parse_importtime(IMPORTTIME)
+        assert [(entry.module, entry.depth) for entry in imports] == [
+            ("_io", 2),
+            ("flask", 1),
+            ("app.app", 0),
+        ]
+        assert (imports[1].self_us, imports[1].cumulative_us) == (300, 900)
+
+    def test_slowest(self):
+        """The slowest imports come first, deeper ones can be left out."""
+        report = StartupReport(0.1, 0.05, parse_importtime(IMPORTTIME))
+        assert [entry.module for entry in report.slowest(2)] == ["app.app", "flask"]
+        assert [entry.module for entry in report.slowest(depth=0)] == ["app.app"]
+        assert report.total_seconds == pytest.approx(0.15)
+
+
+class TestLazyExtensions:
+    """Extensions only some processes need."""
+
+    def test_no_debug_toolbar_when_disabled(self, app):
+        """The toolbar is not set up, so serving requests never imports it."""
+        assert "debugtoolbar" not in app.blueprints
+
+    def test_migrate_outside_cli(self):
+        """Flask-Migrate is only set up for ``flask`` commands."""
+        assert "migrate" not in create_app("tests.settings").extensions
+
+    def test_migrate_in_cli(self):
+        """``flask`` loads the app inside its click context, so ``flask db`` works."""
+        with click.Context(click.Command("flask")):
+            app = create_app("tests.settings")
+        assert "migrate" in app.extensions
+        result = app.test_cli_runner().invoke(args=["db", "--help"])
+        assert result.exit_code == 0, result.output
+        assert "upgrade" in result.output
+
+
+class TestStartupCommand:
+    """The ``flask startup`` command."""
+
+    def test_report(self, app):
+        """A cold start is timed and its slowest imports listed."""
+        result = app.test_cli_runner().invoke(args=["startup", "-n", "3"])
+        assert result.exit_code == 0, result.output
+        assert "create_app:" in result.output
+        assert "app.app" in result.output